@@ -0,0 +1,74 @@
+"""initial schema
+
+Databases created before migrations existed, when the API ran create_all
+on startup, already have these tables; they are left as they are so such
+a database can be adopted with a plain `alembic upgrade head`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 08:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if "image_uploads" not in existing:
+        _create_image_uploads()
+    if "processing_logs" not in existing:
+        _create_processing_logs()
+
+
+def _create_image_uploads() -> None:
+    op.create_table(
+        "image_uploads",
+        sa.Column("id", sa.String(length=36), nullable=False),
+        sa.Column("original_filename", sa.String(length=255), nullable=False),
+        sa.Column("original_url", sa.Text(), nullable=False),
+        sa.Column("thumbnail_url", sa.Text(), nullable=True),
+        sa.Column("resized_url", sa.Text(), nullable=True),
+        sa.Column("compressed_url", sa.Text(), nullable=True),
+        sa.Column("status", sa.String(length=20), nullable=False),
+        sa.Column("error_message", sa.Text(), nullable=True),
+        sa.Column("file_size", sa.Integer(), nullable=True),
+        sa.Column("mime_type", sa.String(length=50), nullable=True),
+        sa.Column("width", sa.Integer(), nullable=True),
+        sa.Column("height", sa.Integer(), nullable=True),
+        sa.Column("processing_started_at", sa.DateTime(), nullable=True),
+        sa.Column("processing_completed_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def _create_processing_logs() -> None:
+    op.create_table(
+        "processing_logs",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("upload_id", sa.String(length=36), nullable=False),
+        sa.Column("step", sa.String(length=50), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=False),
+        sa.Column("message", sa.Text(), nullable=True),
+        sa.Column("duration_ms", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(["upload_id"], ["image_uploads.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("processing_logs")
+    op.drop_table("image_uploads")
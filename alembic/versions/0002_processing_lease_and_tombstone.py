@@ -0,0 +1,40 @@
+"""processing lease and tombstone columns
+
+Nullable columns without defaults are a catalog-only change in Postgres,
+so this is safe to run against a live table. Columns that already exist,
+on a database created by the API's old create_all startup, are skipped.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 08:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    existing = {column["name"] for column in sa.inspect(op.get_bind()).get_columns("image_uploads")}
+    for column in [
+        sa.Column("processing_lease_id", sa.String(length=36), nullable=True),
+        sa.Column("processing_lease_expires_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("deleted_at", sa.DateTime(timezone=True), nullable=True),
+    ]:
+        if column.name not in existing:
+            op.add_column("image_uploads", column)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("image_uploads") as batch_op:
+        batch_op.drop_column("deleted_at")
+        batch_op.drop_column("processing_lease_expires_at")
+        batch_op.drop_column("processing_lease_id")
@@ -0,0 +1,42 @@
+"""listing and processing log indexes
+
+Built with CREATE INDEX CONCURRENTLY so writes are not blocked. Concurrent
+builds cannot run inside a transaction, hence the autocommit block. If a
+build is interrupted, Postgres leaves an INVALID index behind; drop it and
+rerun the migration. Indexes that already exist, on a database created by
+the API's old create_all startup, are skipped.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 08:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = [
+    ("ix_image_uploads_created_at_id", "image_uploads", ["created_at", "id"]),
+    ("ix_image_uploads_status_created_at_id", "image_uploads", ["status", "created_at", "id"]),
+    ("ix_processing_logs_upload_id", "processing_logs", ["upload_id"]),
+]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,148 @@
+"""partition processing logs by day and add processing summaries
+
+On Postgres the existing processing_logs table is not copied. It is
+renamed and attached as the first partition, covering everything before
+the day after tomorrow; retention drops it whole once it ages out. New
+rows land in daily partitions created ahead of time by
+LogRetentionService. A DEFAULT partition catches anything outside the
+prepared range.
+
+The work that reads the whole table runs first, outside the migration's
+transaction, while the table is still live: the (id, created_at) unique
+index is built CONCURRENTLY and a CHECK matching the partition bound is
+validated, neither of which blocks writes. The transaction then only
+changes the catalog. It still takes an ACCESS EXCLUSIVE lock on
+processing_logs at the first RENAME and holds it to the end, but for
+catalog updates only: the primary key is swapped onto the prebuilt index
+and ATTACH skips its scan because the CHECK proves the bound.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 08:30:00.000000
+
+"""
+from datetime import datetime, time, timedelta, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITIONS_AHEAD_DAYS = 7
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        # First: its autocommit block commits whatever ran before it
+        _partition_processing_logs()
+
+    op.create_table(
+        "processing_summaries",
+        sa.Column("upload_id", sa.String(length=36), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=False),
+        sa.Column("mime_type", sa.String(length=50), nullable=True),
+        sa.Column("file_size", sa.Integer(), nullable=True),
+        sa.Column("total_duration_ms", sa.Integer(), nullable=True),
+        sa.Column("stage_durations", sa.JSON(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("upload_id"),
+    )
+
+
+def _partition_processing_logs() -> None:
+    today = datetime.combine(datetime.now(timezone.utc).date(), time.min, tzinfo=timezone.utc)
+    # Rows keep arriving in the old table until it is renamed, so its bound lies
+    # far enough ahead that no insert made meanwhile breaks the CHECK below
+    legacy_bound = today + timedelta(days=2)
+
+    with op.get_context().autocommit_block():
+        # A partition needs the parent's primary key, which includes created_at
+        op.execute(
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS processing_logs_legacy_id_created_at "
+            "ON processing_logs (id, created_at)"
+        )
+        # A validated CHECK matching the partition bound lets ATTACH skip scanning
+        # the table. Adding it NOT VALID is a catalog change; VALIDATE scans under
+        # SHARE UPDATE EXCLUSIVE, which does not block reads or writes
+        op.execute("ALTER TABLE processing_logs DROP CONSTRAINT IF EXISTS processing_logs_legacy_bound")
+        op.execute(
+            "ALTER TABLE processing_logs ADD CONSTRAINT processing_logs_legacy_bound "
+            f"CHECK (created_at < '{legacy_bound.isoformat()}') NOT VALID"
+        )
+        op.execute("ALTER TABLE processing_logs VALIDATE CONSTRAINT processing_logs_legacy_bound")
+
+    # From here on only the catalog changes. Move the existing table (and its
+    # index/constraint names) out of the way
+    op.execute("ALTER TABLE processing_logs RENAME TO processing_logs_legacy")
+    op.execute("ALTER TABLE processing_logs_legacy RENAME CONSTRAINT processing_logs_pkey TO processing_logs_legacy_pkey")
+    op.execute("ALTER INDEX ix_processing_logs_upload_id RENAME TO ix_processing_logs_legacy_upload_id")
+    op.execute("ALTER SEQUENCE processing_logs_id_seq OWNED BY NONE")
+
+    op.execute("""
+        CREATE TABLE processing_logs (
+            id INTEGER NOT NULL DEFAULT nextval('processing_logs_id_seq'),
+            upload_id VARCHAR(36) NOT NULL REFERENCES image_uploads (id) ON DELETE CASCADE,
+            step VARCHAR(50) NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            message TEXT,
+            duration_ms INTEGER,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            CONSTRAINT processing_logs_pkey PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("ALTER SEQUENCE processing_logs_id_seq OWNED BY processing_logs.id")
+    op.execute("CREATE INDEX ix_processing_logs_upload_id ON processing_logs (upload_id)")
+
+    # Swap the primary key onto the prebuilt index; created_at is already NOT NULL
+    op.execute("ALTER TABLE processing_logs_legacy DROP CONSTRAINT processing_logs_legacy_pkey")
+    op.execute(
+        "ALTER TABLE processing_logs_legacy ADD CONSTRAINT processing_logs_legacy_pkey "
+        "PRIMARY KEY USING INDEX processing_logs_legacy_id_created_at"
+    )
+    op.execute(
+        "ALTER TABLE processing_logs ATTACH PARTITION processing_logs_legacy "
+        f"FOR VALUES FROM (MINVALUE) TO ('{legacy_bound.isoformat()}')"
+    )
+    # The partition bound enforces the same thing from here on
+    op.execute("ALTER TABLE processing_logs_legacy DROP CONSTRAINT processing_logs_legacy_bound")
+    for offset in range((legacy_bound - today).days, PARTITIONS_AHEAD_DAYS + 1):
+        start = today + timedelta(days=offset)
+        end = start + timedelta(days=1)
+        op.execute(
+            f"CREATE TABLE processing_logs_p{start:%Y%m%d} PARTITION OF processing_logs "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    op.execute("CREATE TABLE processing_logs_default PARTITION OF processing_logs DEFAULT")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("""
+            CREATE TABLE processing_logs_plain (
+                id INTEGER NOT NULL DEFAULT nextval('processing_logs_id_seq'),
+                upload_id VARCHAR(36) NOT NULL REFERENCES image_uploads (id) ON DELETE CASCADE,
+                step VARCHAR(50) NOT NULL,
+                status VARCHAR(20) NOT NULL,
+                message TEXT,
+                duration_ms INTEGER,
+                created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+                updated_at TIMESTAMP WITH TIME ZONE NOT NULL
+            )
+        """)
+        op.execute("INSERT INTO processing_logs_plain SELECT * FROM processing_logs")
+        op.execute("ALTER SEQUENCE processing_logs_id_seq OWNED BY NONE")
+        op.execute("DROP TABLE processing_logs CASCADE")
+        op.execute("ALTER TABLE processing_logs_plain RENAME TO processing_logs")
+        op.execute("ALTER TABLE processing_logs ADD CONSTRAINT processing_logs_pkey PRIMARY KEY (id)")
+        op.execute("ALTER SEQUENCE processing_logs_id_seq OWNED BY processing_logs.id")
+        op.execute("CREATE INDEX ix_processing_logs_upload_id ON processing_logs (upload_id)")
+
+    op.drop_table("processing_summaries")
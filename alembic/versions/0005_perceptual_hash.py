@@ -0,0 +1,40 @@
+"""perceptual hash column and updated_at index
+
+phash is a nullable column without a default, so adding it is a
+catalog-only change. The (updated_at, id) index backs the incremental
+sync of the near-duplicate index and is built concurrently.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 08:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("image_uploads", sa.Column("phash", sa.BigInteger(), nullable=True))
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_image_uploads_updated_at_id", "image_uploads", ["updated_at", "id"],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_image_uploads_updated_at_id", table_name="image_uploads",
+            postgresql_concurrently=True
+        )
+    op.drop_column("image_uploads", "phash")
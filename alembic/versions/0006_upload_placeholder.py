@@ -0,0 +1,28 @@
+"""inline placeholder column
+
+Nullable column without a default, so a catalog-only change in Postgres.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 08:50:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("image_uploads", sa.Column("placeholder", sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("image_uploads", "placeholder")
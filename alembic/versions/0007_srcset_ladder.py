@@ -0,0 +1,28 @@
+"""srcset ladder column
+
+Nullable column without a default, so a catalog-only change in Postgres.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("image_uploads", sa.Column("srcset", sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("image_uploads", "srcset")
@@ -0,0 +1,43 @@
+"""resumable upload sessions
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19 09:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0009"
+down_revision: Union[str, None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "upload_sessions",
+        sa.Column("id", sa.String(length=36), nullable=False),
+        sa.Column("original_filename", sa.String(length=255), nullable=False),
+        sa.Column("mime_type", sa.String(length=50), nullable=False),
+        sa.Column("total_size", sa.BigInteger(), nullable=False),
+        sa.Column("received_bytes", sa.BigInteger(), nullable=False),
+        sa.Column("chunk_urls", sa.JSON(), nullable=False),
+        sa.Column("callback_url", sa.String(length=2048), nullable=True),
+        sa.Column("status", sa.String(length=20), nullable=False),
+        sa.Column("upload_id", sa.String(length=36), nullable=True),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_upload_sessions_expires_at", "upload_sessions", ["expires_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_upload_sessions_expires_at", table_name="upload_sessions")
+    op.drop_table("upload_sessions")
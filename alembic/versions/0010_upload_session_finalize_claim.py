@@ -0,0 +1,33 @@
+"""upload session finalize claim time
+
+A nullable column without a default is a catalog-only change in Postgres,
+so this is safe to run against a live table.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0010"
+down_revision: Union[str, None] = "0009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "upload_sessions",
+        sa.Column("finalize_claimed_at", sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("upload_sessions") as batch_op:
+        batch_op.drop_column("finalize_claimed_at")
@@ -0,0 +1,35 @@
+import os
+
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy.engine import Engine
+
+ALEMBIC_INI = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "alembic.ini"))
+
+
+def get_alembic_config() -> Config:
+    """Alembic config pointing at the project's migration scripts"""
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(ALEMBIC_INI), "alembic"))
+    return config
+
+
+def get_head_revisions() -> set:
+    """Revisions the code expects the database to be at"""
+    return set(ScriptDirectory.from_config(get_alembic_config()).get_heads())
+
+
+def get_current_revisions(engine: Engine) -> set:
+    """Revisions recorded in the database's alembic_version table"""
+    with engine.connect() as connection:
+        return set(MigrationContext.configure(connection).get_current_heads())
+
+
+def check_schema_revision(engine: Engine) -> bool:
+    """Check that the database has been migrated to the latest revision.
+
+    This only reads the alembic_version table; it never reflects or
+    changes the schema.
+    """
+    return get_current_revisions(engine) == get_head_revisions()
@@ -25,14 +25,92 @@ class Settings(BaseSettings):
     # Redis (for Celery)
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
     
-    # Storage (Google Cloud Storage)
+    # Storage: "gcs", or "local" for a filesystem stand-in (development and tests)
+    STORAGE_TYPE: str = "gcs"
+    LOCAL_STORAGE_PATH: str = "./uploads"
+    LOCAL_STORAGE_URL: str = "http://localhost:8000/api/v1/storage"  # where the /storage routes are served
     GOOGLE_CLOUD_PROJECT: Optional[str] = None
     GOOGLE_STORAGE_BUCKET: str = os.getenv("GOOGLE_STORAGE_BUCKET", "")
     GOOGLE_APPLICATION_CREDENTIALS: Optional[str] = None
+    GCS_API_ENDPOINT: Optional[str] = None  # e.g. a local fake GCS server; uses anonymous credentials
+    # GCS transport: one pooled, keep-alive HTTP session per process
+    GCS_POOL_SIZE: int = 32  # connections kept per host; cover the upload/delete fan-out
+    GCS_TCP_KEEPALIVE_SECONDS: int = 60  # idle time before keep-alive probes (0 disables)
+    GCS_CONNECT_TIMEOUT_SECONDS: float = 5
+    GCS_READ_TIMEOUT_SECONDS: float = 15  # metadata, delete and compose calls
+    GCS_TRANSFER_TIMEOUT_SECONDS: float = 60  # uploads and downloads
+    GCS_RETRY_INITIAL_DELAY_SECONDS: float = 0.5  # jittered, doubled on each retry
+    GCS_RETRY_MAX_DELAY_SECONDS: float = 8
+    GCS_RETRY_DEADLINE_SECONDS: float = 60  # give up retrying an operation after this long
     
     # Worker
     WORKER_CONCURRENCY: int = 4
-    WORKER_MAX_TASKS_PER_CHILD: int = 100
+    WORKER_MAX_TASKS_PER_CHILD: int = 100  # backstop; WORKER_MAX_RSS_MB recycles on actual growth
+    WORKER_MAX_RSS_MB: int = 0  # replace a worker after a task leaves it above this (0 disables)
+    WORKER_WARMUP: bool = True  # preload libraries, clients and DB pool in each new child
+    WORKER_METRICS_PORT: int = 0  # Celery workers serve their processes' /metrics here (0 disables)
+    TASK_MAX_RETRIES: int = 3
+    TASK_RETRY_BACKOFF_BASE: int = 5  # seconds, doubled on each retry
+    TASK_RETRY_BACKOFF_MAX: int = 300
+    PROCESSING_LEASE_SECONDS: int = 300  # should cover task_time_limit
+    TASK_BACKEND: str = "celery"  # "celery", or "local" for an in-process pool without a broker
+    LOCAL_TASK_QUEUE_SIZE: int = 100  # queued + running + awaiting retry
+    # "single" runs process_image as one task; "staged" chains fetch/transform/store/finalize
+    # across the io and cpu queues (Celery backend only)
+    PIPELINE_MODE: str = "single"
+    PIPELINE_IO_QUEUE: str = "io"
+    PIPELINE_CPU_QUEUE: str = "cpu"
+    PIPELINE_CACHE_DIR: Optional[str] = None  # shared by a host's io and cpu workers; default under the temp dir
+    PIPELINE_CACHE_MAX_AGE_SECONDS: int = 3600  # buffers of chains that never finished
+    # Reprocessing backfills (python -m api.v1.workers.backfill) go to their own queue
+    BACKFILL_QUEUE: str = "backfill"
+    BACKFILL_RATE_PER_SECOND: float = 10  # uploads enqueued per second (0 disables throttling)
+    BACKFILL_BATCH_SIZE: int = 200
+    BACKFILL_MAX_QUEUE_DEPTH: int = 500  # pause while this many backfill tasks wait (0 disables)
+    SHUTDOWN_DRAIN_SECONDS: int = 30
+    
+    # Per-task memory profiling (results go to processing_logs and /metrics)
+    MEMORY_PROFILING: bool = False
+    MEMORY_TRACEMALLOC_SAMPLE_RATE: float = 0.01  # fraction of profiled tasks that also trace allocations
+    MEMORY_TRACEMALLOC_TOP_N: int = 10
+    
+    # Admission control on uploads (0 disables a threshold)
+    BACKPRESSURE_MAX_QUEUE_DEPTH: int = 1000  # tasks waiting in the broker
+    BACKPRESSURE_MAX_IN_FLIGHT: int = 0  # uploads being processed right now
+    BACKPRESSURE_RETRY_AFTER_SECONDS: int = 30
+    BACKPRESSURE_CHECK_INTERVAL_SECONDS: float = 1.0  # how long a measurement is reused
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_PER_MINUTE: int = 60  # uploads per client, shared across replicas via Redis
+    RATE_LIMIT_BURST: int = 20
+    RATE_LIMIT_REDIS_TIMEOUT_SECONDS: float = 0.1  # fail open beyond this
+    TRUST_PROXY_HEADERS: bool = False  # identify clients by X-Forwarded-For
+    
+    # Cleanup (runs under Celery beat)
+    CLEANUP_INTERVAL_SECONDS: int = 3600
+    CLEANUP_FAILED_AFTER_HOURS: int = 24
+    CLEANUP_PENDING_AFTER_HOURS: int = 6  # pending this long means the task was lost
+    CLEANUP_CHUNK_SIZE: int = 200
+    CLEANUP_TIME_BUDGET_SECONDS: int = 60
+    STORAGE_DELETE_CONCURRENCY: int = 8
+    PURGE_DELETED_INTERVAL_SECONDS: int = 60
+    
+    # Processing log retention (daily partitions in Postgres)
+    PROCESSING_LOG_RETENTION_DAYS: int = 30
+    PROCESSING_LOG_PARTITIONS_AHEAD_DAYS: int = 7
+    PROCESSING_LOG_MAINTENANCE_INTERVAL_SECONDS: int = 3600
+    PROCESSING_LOG_DETACH_LOCK_TIMEOUT_SECONDS: float = 5
+    
+    # Webhooks (delivered by the deliver-webhooks beat job, signed with SECRET_KEY)
+    WEBHOOK_DISPATCH_INTERVAL_SECONDS: int = 5
+    WEBHOOK_BATCH_SIZE: int = 100
+    WEBHOOK_CONCURRENCY: int = 10
+    WEBHOOK_TIMEOUT_SECONDS: float = 10
+    WEBHOOK_MAX_ATTEMPTS: int = 8  # then the delivery is kept as a dead letter
+    WEBHOOK_RETRY_BACKOFF_BASE: int = 10  # seconds, doubled on each attempt
+    WEBHOOK_RETRY_BACKOFF_MAX: int = 3600
+    WEBHOOK_TIME_BUDGET_SECONDS: int = 30
+    WEBHOOK_RETENTION_DAYS: int = 7  # for delivered events
+    WEBHOOK_ALLOW_PRIVATE_HOSTS: bool = False  # allow loopback/private callback hosts, e.g. in local development
     
     # Image Processing
     MAX_IMAGE_SIZE_MB: int = 10
@@ -42,6 +120,39 @@ class Settings(BaseSettings):
     JPEG_QUALITY: int = 85
     WEBP_QUALITY: int = 80
     
+    # Resumable uploads (chunked sessions)
+    RESUMABLE_UPLOAD_MAX_SIZE_MB: int = 50
+    UPLOAD_CHUNK_MAX_BYTES: int = 8 * 1024 * 1024  # per PUT; bounds API memory per request
+    UPLOAD_CHUNK_MIN_BYTES: int = 256 * 1024  # except the last chunk; bounds chunk objects per session
+    UPLOAD_SESSION_TTL_SECONDS: int = 86400  # extended by every accepted chunk
+    UPLOAD_SESSION_GC_INTERVAL_SECONDS: int = 900
+    UPLOAD_SESSION_FINALIZE_TIMEOUT_SECONDS: int = 300  # a finalize claim older than this may be taken over
+    
+    # Direct-to-storage uploads (client PUTs to a signed URL, then finalizes)
+    DIRECT_UPLOAD_URL_EXPIRY_SECONDS: int = 900
+    DIRECT_UPLOAD_FINALIZE_WINDOW_SECONDS: int = 3600  # after the URL expires
+    
+    # Animated GIF/WebP
+    ANIMATED_WEBP_TRANSCODE: bool = False  # store animated variants as animated WebP
+    ANIMATION_MAX_FRAMES: int = 300
+    # frames * width * height, of the source and of every variant; the encoders
+    # hold a variant's frames all at once, up to 4 bytes a pixel (256 MiB here)
+    ANIMATION_MAX_TOTAL_PIXELS: int = 64_000_000
+    
+    # Responsive srcset ladder; widths at or above the original are skipped
+    SRCSET_WIDTHS: list = [1920, 1280, 960, 640, 320]
+    
+    # HTTP caching of status and result reads
+    RESULT_CACHE_MAX_AGE_SECONDS: int = 86400  # completed results; changes get a new ETag
+    
+    # Inline placeholder (data URI) returned with status and result
+    PLACEHOLDER_SIZE: int = 16  # longest side in pixels
+    PLACEHOLDER_QUALITY: int = 40
+    
+    # Near-duplicate detection
+    PHASH_MAX_DISTANCE: int = 7  # largest Hamming distance a query may ask for (index supports up to 11)
+    PHASH_INDEX_REFRESH_SECONDS: int = 5
+    
     # Security
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-here")
     
@@ -1,12 +1,24 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import sys
+import threading
+import time
 from contextvars import ContextVar
-from typing import Optional
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
 
 DEFAULT_LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 SERVICE_NAME = "Upload_service"
 
+# Per-call-site sampling for chatty INFO/DEBUG records (WARNING and above always pass)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "10"))  # records per second per call site
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", "20"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
 # Context variable for correlation ID (for distributed tracing)
 correlation_id_context: ContextVar[Optional[str]] = ContextVar('correlation_id', default=None)
 
@@ -25,8 +37,118 @@ class CorrelationIdFilter(logging.Filter):
         return True
 
 
+class CallSiteRateLimitFilter(logging.Filter):
+    """Token-bucket rate limit per call site for records below WARNING.
+
+    Records that get dropped are counted, and the count is reported on the
+    next record from the same call site as ``suppressed``.
+    """
+
+    def __init__(self, rate: float = LOG_SAMPLE_RATE, burst: int = LOG_SAMPLE_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[Tuple[str, int], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                # [tokens, last_refill, suppressed]
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                bucket[2] += 1
+                return False
+            bucket[0] = tokens - 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Serialize log records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "correlation_id": getattr(record, "correlation_id", "N/A"),
+            "service": SERVICE_NAME,
+            "message": record.getMessage(),
+            "module": record.module,
+            "function": record.funcName,
+        }
+        suppressed = getattr(record, "suppressed", None)
+        if suppressed:
+            payload["suppressed"] = suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exception"] = record.exc_text
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that leaves JSON serialization to the listener thread.
+
+    Only the work that must happen on the calling thread is done here:
+    interpolating the message arguments and rendering the traceback, since
+    both may reference objects that change after the call returns.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block a request or task on logging; drop instead
+            pass
+
+
+_queue_handler: Optional[_DeferredQueueHandler] = None
+_stream_handler: Optional[logging.Handler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _start_listener() -> None:
+    global _listener
+    _listener = logging.handlers.QueueListener(
+        _queue_handler.queue, _stream_handler, respect_handler_level=True
+    )
+    _listener.start()
+
+
+def _stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
 def setup_logging(level: str = DEFAULT_LOG_LEVEL) -> logging.Logger:
-    """Configure structured logging with correlation ID support."""
+    """Configure structured logging with correlation ID support.
+
+    Records are handed to a bounded queue and written to stdout by a
+    background thread, so callers only pay for the enqueue.
+    """
+    global _queue_handler, _stream_handler
 
     logger = logging.getLogger(SERVICE_NAME)
     logger.setLevel(_resolve_log_level(level))
@@ -36,24 +158,37 @@ def setup_logging(level: str = DEFAULT_LOG_LEVEL) -> logging.Logger:
     if logger.handlers:
         return logger
 
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setLevel(_resolve_log_level(level))
+    _stream_handler = logging.StreamHandler(sys.stdout)
+    _stream_handler.setLevel(_resolve_log_level(level))
+    _stream_handler.setFormatter(JsonFormatter())
 
-    formatter = logging.Formatter(
-        (
-            '{"timestamp": "%(asctime)s", "level": "%(levelname)s", '
-            '"correlation_id": "%(correlation_id)s", "service": "' + SERVICE_NAME + '", '
-            '"message": "%(message)s", "module": "%(module)s", "function": "%(funcName)s"}'
-        )
-    )
-    handler.setFormatter(formatter)
-    handler.addFilter(CorrelationIdFilter())
+    _queue_handler = _DeferredQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(CorrelationIdFilter())
+    _queue_handler.addFilter(CallSiteRateLimitFilter())
 
-    logger.addHandler(handler)
+    _start_listener()
+    atexit.register(_stop_listener)
+
+    logger.addHandler(_queue_handler)
 
     return logger
 
 
+def _restart_listener_in_child() -> None:
+    """Listener threads do not survive fork; give the child its own queue and thread."""
+    if _listener is None:
+        return
+    _queue_handler.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    for log_filter in _queue_handler.filters:
+        if isinstance(log_filter, CallSiteRateLimitFilter):
+            log_filter._lock = threading.Lock()
+    _start_listener()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listener_in_child)
+
+
 # Global logger instance
 logger = setup_logging()
 
@@ -76,9 +211,17 @@ def clear_correlation_id() -> None:
     correlation_id_context.set(None)
 
 
+def flush_logs() -> None:
+    """Block until queued records have been written (used at shutdown and in tests)."""
+    if _listener is not None:
+        _listener.stop()
+        _start_listener()
+
+
 __all__ = [
     "logger",
     "set_correlation_id",
     "get_correlation_id",
     "clear_correlation_id",
-]
\ No newline at end of file
+    "flush_logs",
+]
@@ -0,0 +1,234 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+# (metric name, sorted label pairs)
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: dict) -> _Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format(name: str, labels: Tuple[Tuple[str, str], ...], suffix: str = "") -> str:
+    if not labels:
+        return f"{name}{suffix}"
+    rendered = ",".join(f'{k}="{v}"' for k, v in labels)
+    return f"{name}{suffix}{{{rendered}}}"
+
+
+class MetricsRegistry:
+    """In-process counters, gauges and summaries.
+
+    Each process keeps its own values. Worker processes write theirs to a
+    snapshot file after each task (see write_snapshot), and whoever serves
+    /metrics merges the snapshots into its own registry. Summaries keep
+    count, sum and max, which is enough for averages and worst cases
+    without buckets.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[_Key, float] = {}
+        self._gauges: Dict[_Key, float] = {}
+        self._summaries: Dict[_Key, list] = {}  # [count, sum, max]
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                self._summaries[key] = [1, value, value]
+            else:
+                summary[0] += 1
+                summary[1] += value
+                summary[2] = max(summary[2], value)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._summaries.clear()
+
+    def dump(self) -> dict:
+        """Raw values in a JSON-serializable form, for merge() in another process"""
+        with self._lock:
+            return {
+                kind: [[name, [list(pair) for pair in labels], value] for (name, labels), value in values.items()]
+                for kind, values in (
+                    ("counters", self._counters), ("gauges", self._gauges), ("summaries", self._summaries)
+                )
+            }
+
+    def merge(self, dump: dict, gauges: bool = True) -> None:
+        """Add another registry's dump(): counters and summaries add up, gauges are overwritten"""
+        with self._lock:
+            for name, labels, value in dump.get("counters", []):
+                key = (name, tuple(tuple(pair) for pair in labels))
+                self._counters[key] = self._counters.get(key, 0) + value
+            if gauges:
+                for name, labels, value in dump.get("gauges", []):
+                    self._gauges[(name, tuple(tuple(pair) for pair in labels))] = value
+            for name, labels, (count, total, peak) in dump.get("summaries", []):
+                key = (name, tuple(tuple(pair) for pair in labels))
+                summary = self._summaries.get(key)
+                if summary is None:
+                    self._summaries[key] = [count, total, peak]
+                else:
+                    summary[0] += count
+                    summary[1] += total
+                    summary[2] = max(summary[2], peak)
+
+    def snapshot(self) -> dict:
+        """Current values keyed by rendered metric name"""
+        with self._lock:
+            data = {}
+            for (name, labels), value in self._counters.items():
+                data[_format(name, labels)] = value
+            for (name, labels), value in self._gauges.items():
+                data[_format(name, labels)] = value
+            for (name, labels), (count, total, peak) in self._summaries.items():
+                data[_format(name, labels, "_count")] = count
+                data[_format(name, labels, "_sum")] = total
+                data[_format(name, labels, "_max")] = peak
+            return data
+
+    def render_text(self) -> str:
+        """Prometheus text exposition of every metric"""
+        with self._lock:
+            lines = []
+            for kind, values in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted({name for name, _ in values}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (metric, labels), value in sorted(values.items()):
+                        if metric == name:
+                            lines.append(f"{_format(name, labels)} {value:g}")
+            for name in sorted({name for name, _ in self._summaries}):
+                lines.append(f"# TYPE {name} summary")
+                for (metric, labels), (count, total, peak) in sorted(self._summaries.items()):
+                    if metric == name:
+                        lines.append(f"{_format(name, labels, '_count')} {count:g}")
+                        lines.append(f"{_format(name, labels, '_sum')} {total:g}")
+                        lines.append(f"{_format(name, labels, '_max')} {peak:g}")
+            return "\n".join(lines) + "\n"
+
+
+# Singleton instance
+metrics = MetricsRegistry()
+
+# Where this process writes its snapshot (set in worker processes only), and
+# the directories of worker snapshots this process serves along with its own
+_snapshot_dir: Optional[str] = None
+_snapshot_sources: List[str] = []
+
+
+def set_snapshot_dir(directory: Optional[str]) -> None:
+    """Make write_snapshot() store this process's metrics in `directory`
+
+    The registry is cleared, so a forked worker does not export again what
+    its parent had recorded before the fork.
+    """
+    global _snapshot_dir
+    _snapshot_dir = directory
+    if directory:
+        metrics.reset()
+
+
+def get_snapshot_dir() -> Optional[str]:
+    return _snapshot_dir
+
+
+def write_snapshot() -> None:
+    """Replace this process's snapshot file with its current metrics; a no-op outside workers"""
+    if not _snapshot_dir:
+        return
+    path = os.path.join(_snapshot_dir, f"{os.getpid()}.json")
+    # Per thread: a thread pool worker runs several tasks at once
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(metrics.dump(), f)
+    os.replace(tmp_path, path)
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_snapshots(directory: str, registry: MetricsRegistry) -> None:
+    """Merge every snapshot in `directory` into `registry`
+
+    Counters and summaries of exited processes are kept, so totals do not
+    drop when a worker is recycled; their gauges are left out.
+    """
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                dump = json.load(f)
+        except (OSError, ValueError):
+            continue
+        registry.merge(dump, gauges=_is_running(int(name[:-len(".json")])))
+
+
+def add_snapshot_source(directory: str) -> None:
+    """Serve the worker snapshots in `directory` along with this process's metrics"""
+    if directory not in _snapshot_sources:
+        _snapshot_sources.append(directory)
+
+
+def render_all(sources: Optional[List[str]] = None) -> str:
+    """This process's metrics merged with its workers' snapshots, as Prometheus text"""
+    combined = MetricsRegistry()
+    combined.merge(metrics.dump())
+    for directory in _snapshot_sources if sources is None else sources:
+        read_snapshots(directory, combined)
+    return combined.render_text()
+
+
+def serve_snapshots(directory: str, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve the snapshots in `directory` at /metrics from a background thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            # Only the snapshots: a worker that runs tasks itself has written its own
+            registry = MetricsRegistry()
+            read_snapshots(directory, registry)
+            body = registry.render_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+    return server
@@ -1,7 +1,42 @@
-from typing import Optional
+import hashlib
+import json
+from datetime import date, datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Optional, Union
 
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional speedup
+    orjson = None
+
+
+def _default(obj: Any):
+    """Fallback encoder for types the JSON serializer does not handle natively"""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize to JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(Response):
+    """JSON response that skips jsonable_encoder and serializes in one pass"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
 
 
 def success_response(status_code: int, message: str, 
@@ -20,6 +55,80 @@ def success_response(status_code: int, message: str,
     )
 
 
+def make_etag(*parts: Any) -> str:
+    """Strong ETag derived from the values that identify a representation"""
+    digest = hashlib.sha1(":".join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest[:20]}"'
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes; they are stored as UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def cache_headers(etag: str, last_modified: datetime, cache_control: str) -> dict:
+    """Validator and caching headers for a conditional GET response"""
+    return {
+        "ETag": etag,
+        "Last-Modified": format_datetime(_as_utc(last_modified).replace(microsecond=0), usegmt=True),
+        "Cache-Control": cache_control,
+    }
+
+
+def is_not_modified(request_headers, etag: str, last_modified: datetime) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since for a GET (RFC 9110 section 13.2.2)
+
+    If-None-Match takes precedence; If-Modified-Since is only consulted
+    when the client sent no entity tags.
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison: W/"x" matches "x"
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag in candidates
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return _as_utc(last_modified).replace(microsecond=0) <= since
+    return False
+
+
+def not_modified_response(headers: dict) -> Response:
+    """Empty 304 carrying the same validators a 200 would have had"""
+    return Response(status_code=304, headers=headers)
+
+
+def fast_success_response(status_code: int, message: str,
+                          data: Optional[Union[BaseModel, dict]] = None,
+                          headers: Optional[dict] = None):
+    """Returns the success_response envelope, serialized directly from the model
+
+    Use on hot endpoints. Pydantic models, datetimes and plain dicts go
+    straight to the JSON encoder without the jsonable_encoder pass.
+    """
+
+    response_data = {
+        "status": "success",
+        "status_code": status_code,
+        "message": message,
+        "data": data or {},
+    }
+
+    return FastJSONResponse(
+        status_code=status_code, content=response_data, headers=headers
+    )
+
+
 def auth_response(
     status_code: int, message: str, access_token: str, 
     refresh_token: str, data: Optional[dict] = None
@@ -43,7 +152,8 @@ def auth_response(
 
 
 def fail_response(status_code: int, message: str, 
-                  context: Optional[dict] = None):
+                  context: Optional[dict] = None,
+                  headers: Optional[dict] = None):
     """Returns a JSON response for failure responses"""
 
     response_data = {
@@ -54,7 +164,7 @@ def fail_response(status_code: int, message: str,
     }
 
     return JSONResponse(
-        status_code=status_code, content=jsonable_encoder(response_data)
+        status_code=status_code, content=jsonable_encoder(response_data), headers=headers
     )
 
     
@@ -1,6 +1,6 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import String, Text, Enum, ForeignKey
+from sqlalchemy import BigInteger, DateTime, String, Text, Enum, ForeignKey, Index, JSON
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -14,8 +14,23 @@ class UploadStatus:
     FAILED = "failed"
 
 
+# Status state machine: target status -> statuses it may be entered from.
+# PROCESSING -> PROCESSING lets a retry resume; COMPLETED is terminal.
+ALLOWED_STATUS_TRANSITIONS = {
+    UploadStatus.PROCESSING: (UploadStatus.PENDING, UploadStatus.PROCESSING),
+    UploadStatus.COMPLETED: (UploadStatus.PROCESSING,),
+    UploadStatus.FAILED: (UploadStatus.PENDING, UploadStatus.PROCESSING),
+}
+
 class ImageUpload(BaseModel):
     __tablename__ = "image_uploads"
+    __table_args__ = (
+        # Keyset pagination over (created_at, id), optionally filtered by status
+        Index("ix_image_uploads_created_at_id", "created_at", "id"),
+        Index("ix_image_uploads_status_created_at_id", "status", "created_at", "id"),
+        # Incremental sync of the near-duplicate index
+        Index("ix_image_uploads_updated_at_id", "updated_at", "id"),
+    )
 
     id: Mapped[str] = mapped_column(
         String(36), 
@@ -42,11 +57,30 @@ class ImageUpload(BaseModel):
     mime_type: Mapped[str] = mapped_column(String(50), nullable=True)
     width: Mapped[int] = mapped_column(nullable=True)
     height: Mapped[int] = mapped_column(nullable=True)
+    # 64-bit dHash of the thumbnail, stored as a signed BIGINT
+    phash: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    # Responsive ladder: [{"width", "height", "url"}, ...], widest first
+    srcset: Mapped[list] = mapped_column(JSON, nullable=True)
+    # Tiny WebP preview as a data URI, returned inline with status and result
+    placeholder: Mapped[str] = mapped_column(Text, nullable=True)
     
     # Processing metadata
     processing_started_at: Mapped[datetime] = mapped_column(nullable=True)
     processing_completed_at: Mapped[datetime] = mapped_column(nullable=True)
     
+    # Guard against duplicate deliveries processing the same upload concurrently
+    processing_lease_id: Mapped[str] = mapped_column(String(36), nullable=True)
+    processing_lease_expires_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), 
+        nullable=True
+    )
+    
+    # Where to POST completion/failure events, if the client asked for one
+    callback_url: Mapped[str] = mapped_column(String(2048), nullable=True)
+    
+    # Tombstone: set on delete, the row and its files are purged in the background
+    deleted_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    
     # Relationships
     processing_logs: Mapped[list["ProcessingLog"]] = relationship(
         back_populates="upload", 
@@ -55,12 +89,16 @@ class ImageUpload(BaseModel):
 
 
 class ProcessingLog(BaseModel):
+    # In Postgres this table is range-partitioned by day on created_at, with
+    # primary key (id, created_at); see migration 0004. Old partitions are
+    # dropped by LogRetentionService. The ORM only needs id for identity.
     __tablename__ = "processing_logs"
     
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     upload_id: Mapped[str] = mapped_column(
         String(36), 
-        ForeignKey("image_uploads.id", ondelete="CASCADE")
+        ForeignKey("image_uploads.id", ondelete="CASCADE"),
+        index=True
     )
     step: Mapped[str] = mapped_column(String(50))  # e.g., "download", "resize", "upload"
     status: Mapped[str] = mapped_column(String(20))  # "started", "completed", "failed"
@@ -68,4 +106,53 @@ class ProcessingLog(BaseModel):
     duration_ms: Mapped[int] = mapped_column(nullable=True)  # processing duration
     
     # Relationships
-    upload: Mapped["ImageUpload"] = relationship(back_populates="processing_logs")
\ No newline at end of file
+    upload: Mapped["ImageUpload"] = relationship(back_populates="processing_logs")
+
+
+class ProcessingSummary(BaseModel):
+    """One row per upload with total and per-stage durations.
+    
+    Kept for long-term analytics after the detailed logs have aged out, so
+    there is deliberately no foreign key to image_uploads.
+    """
+    __tablename__ = "processing_summaries"
+    
+    upload_id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    status: Mapped[str] = mapped_column(String(20))
+    mime_type: Mapped[str] = mapped_column(String(50), nullable=True)
+    file_size: Mapped[int] = mapped_column(nullable=True)
+    total_duration_ms: Mapped[int] = mapped_column(nullable=True)
+    stage_durations: Mapped[dict] = mapped_column(JSON, nullable=True)  # {"download": 120, ...}
+
+
+class UploadSessionStatus:
+    ACTIVE = "active"
+    FINALIZING = "finalizing"
+    FINALIZED = "finalized"
+
+
+class UploadSession(BaseModel):
+    """Partial state of a resumable upload.
+    
+    Each accepted chunk is stored as its own object. On finalize the chunks
+    are composed into the original inside the storage service, so the API
+    never holds the whole file. Sessions past expires_at are garbage
+    collected along with their chunks.
+    """
+    __tablename__ = "upload_sessions"
+    
+    id: Mapped[str] = mapped_column(
+        String(36), 
+        primary_key=True, 
+        default=lambda: str(uuid.uuid4())
+    )
+    original_filename: Mapped[str] = mapped_column(String(255))
+    mime_type: Mapped[str] = mapped_column(String(50))
+    total_size: Mapped[int] = mapped_column(BigInteger)
+    received_bytes: Mapped[int] = mapped_column(BigInteger, default=0)
+    chunk_urls: Mapped[list] = mapped_column(JSON, default=list)  # in offset order
+    callback_url: Mapped[str] = mapped_column(String(2048), nullable=True)
+    status: Mapped[str] = mapped_column(String(20), default=UploadSessionStatus.ACTIVE)
+    upload_id: Mapped[str] = mapped_column(String(36), nullable=True)  # chosen by the first finalize
+    finalize_claimed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
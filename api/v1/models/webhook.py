@@ -0,0 +1,36 @@
+from datetime import datetime
+from sqlalchemy import DateTime, String, Text, Index, JSON
+from sqlalchemy.orm import Mapped, mapped_column
+
+from api.db.base_model import BaseModel
+
+
+class WebhookDeliveryStatus:
+    PENDING = "pending"
+    DELIVERED = "delivered"
+    DEAD = "dead"  # gave up after WEBHOOK_MAX_ATTEMPTS; kept for inspection and replay
+
+
+class WebhookDelivery(BaseModel):
+    """Outbox of webhook events, written by the worker when an upload finishes.
+    
+    Rows outlive their upload (no foreign key), so purges do not affect
+    delivery or the dead-letter record.
+    """
+    __tablename__ = "webhook_deliveries"
+    __table_args__ = (
+        # The dispatcher polls for due pending deliveries
+        Index("ix_webhook_deliveries_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+    
+    id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    upload_id: Mapped[str] = mapped_column(String(36), index=True)
+    event: Mapped[str] = mapped_column(String(50))  # "upload.completed", "upload.failed"
+    url: Mapped[str] = mapped_column(String(2048))
+    payload: Mapped[dict] = mapped_column(JSON)
+    status: Mapped[str] = mapped_column(String(20), default=WebhookDeliveryStatus.PENDING)
+    attempts: Mapped[int] = mapped_column(default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+    last_response_status: Mapped[int] = mapped_column(nullable=True)
+    delivered_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,63 @@
+import mimetypes
+
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import FileResponse
+
+from api.v1.services.storage_service import storage_service
+from api.utils.responses import success_response, fail_response
+from api.utils.logger import logger
+
+# Served only when STORAGE_TYPE=local, standing in for the GCS endpoints
+router = APIRouter()
+
+
+class _FileTooLarge(Exception):
+    pass
+
+
+@router.put("/storage/{file_path:path}")
+async def put_local_file(
+    file_path: str,
+    request: Request,
+    expires: int = Query(...),
+    max_bytes: int = Query(...),
+    signature: str = Query(...)
+):
+    """Accept a PUT to a signed upload URL, as GCS would"""
+    try:
+        content_type = request.headers.get("content-type", "")
+        if not storage_service.verify_upload_signature(file_path, content_type, max_bytes, expires, signature):
+            return fail_response(403, "Invalid or expired upload signature")
+
+        try:
+            with storage_service.open_for_write(file_path) as f:
+                received = 0
+                async for block in request.stream():
+                    received += len(block)
+                    if received > max_bytes:
+                        raise _FileTooLarge()
+                    f.write(block)
+        except _FileTooLarge:
+            return fail_response(413, f"File too large. Max size: {max_bytes} bytes")
+
+        return success_response(200, "File stored")
+
+    except ValueError as e:
+        return fail_response(400, str(e))
+    except Exception as e:
+        logger.error(f"Failed to store local file: {str(e)}")
+        return fail_response(500, "Failed to store file", {"error": str(e)})
+
+
+@router.get("/storage/{file_path:path}")
+async def get_local_file(file_path: str):
+    """Serve a stored file"""
+    try:
+        path = storage_service.resolve_path(file_path)
+    except ValueError:
+        return fail_response(404, "File not found")
+
+    if not path.is_file():
+        return fail_response(404, "File not found")
+
+    return FileResponse(path, media_type=mimetypes.guess_type(path.name)[0])
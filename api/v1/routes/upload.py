@@ -1,27 +1,90 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from datetime import datetime
+from typing import Optional
+from urllib.parse import urlparse
+
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Query, Request
 from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 import uuid
 from api.db.database import get_db
 from api.v1.services.upload_service import UploadService
 from api.v1.services.storage_service import storage_service
-from api.v1.schemas.upload import UploadCreate
-from api.v1.workers.celery_app import process_image_task
+from api.v1.services.similarity_service import similarity_service
+from api.v1.services.admission_service import admission_service, get_client_id
+from api.v1.services.direct_upload_service import (
+    DirectUploadService, InvalidUploadTicketError, UploadObjectMissingError
+)
+from api.v1.services.webhook_service import check_callback_host
+from api.v1.services.upload_session_service import (
+    UploadSessionService, UploadOffsetMismatchError, UploadSessionStateError, check_chunk_size
+)
+from api.v1.schemas.upload import UploadCreate, UploadSessionCreate, UploadSessionResponse
+from api.v1.schemas.upload import DirectUploadCreate, DirectUploadFinalize, DirectUploadTicketResponse
+from api.v1.workers.dispatch import DispatchQueueFullError, get_dispatcher
 from api.v1.schemas.upload import UploadResponse, UploadStatusResponse, UploadResultResponse
-from api.utils.responses import success_response, fail_response
+from api.v1.schemas.upload import UploadListItem, UploadListResponse
+from api.v1.schemas.upload import SimilarUpload, SimilarUploadsResponse
+from api.v1.models.upload import UploadSessionStatus, UploadStatus
+from api.utils.responses import success_response, fast_success_response, fail_response
+from api.utils.responses import make_etag, cache_headers, is_not_modified, not_modified_response
 from api.utils.logger import logger
 from api.utils.config import settings
 
 router = APIRouter()
 
 
+def _callback_url_error(callback_url: str) -> Optional[str]:
+    """Why a callback URL is refused, or None; resolves its host, so call it off the event loop"""
+    parsed = urlparse(callback_url)
+    if parsed.scheme not in ("http", "https") or not parsed.netloc or len(callback_url) > 2048:
+        return "callback_url must be an absolute http(s) URL"
+    if settings.WEBHOOK_ALLOW_PRIVATE_HOSTS:
+        return None
+    reason = check_callback_host(callback_url)
+    return f"callback_url {reason}" if reason else None
+
+
+def _session_response(session) -> UploadSessionResponse:
+    return UploadSessionResponse(
+        session_id=session.id,
+        status=session.status,
+        offset=session.received_bytes,
+        total_size=session.total_size,
+        expires_at=session.expires_at,
+        # Reserved when finalize first claims the session, but only real once finalized
+        upload_id=session.upload_id if session.status == UploadSessionStatus.FINALIZED else None
+    )
+
+
 @router.post("/upload", response_model=UploadResponse)
 async def upload_image(
+    request: Request,
     file: UploadFile = File(...),
+    callback_url: Optional[str] = Form(None),
     db: Session = Depends(get_db)
 ):
-    """Upload an image for processing"""
+    """Upload an image for processing
+
+    If `callback_url` is given, a signed `upload.completed` or
+    `upload.failed` event is POSTed to it when processing finishes.
+    """
     try:
+        # Admission control before any storage or database writes
+        retry_after = await admission_service.check_rate_limit(get_client_id(request))
+        if retry_after is not None:
+            return fail_response(429, "Too many uploads. Try again later.",
+                                 headers={"Retry-After": str(retry_after)})
+        
+        retry_after = await admission_service.check_backlog(db)
+        if retry_after is not None:
+            return fail_response(429, "Processing backlog is full. Try again later.",
+                                 headers={"Retry-After": str(retry_after)})
+        
+        if callback_url is not None:
+            callback_error = await run_in_threadpool(_callback_url_error, callback_url)
+            if callback_error:
+                return fail_response(400, callback_error)
+        
         # Validate file type
         if file.content_type not in settings.ALLOWED_IMAGE_TYPES:
             return fail_response(400, f"File type not allowed. Allowed types: {settings.ALLOWED_IMAGE_TYPES}")
@@ -53,16 +116,24 @@ async def upload_image(
         upload_data = UploadCreate(
             original_filename=file.filename,
             file_size=file_size,
-            mime_type=file.content_type
+            mime_type=file.content_type,
+            callback_url=callback_url
         )
         
         upload = upload_service.create_upload(upload_data, original_url)
         
         # Start background processing
-        process_image_task.delay(upload.id)
+        try:
+            get_dispatcher().submit_process_image(upload.id)
+        except DispatchQueueFullError as e:
+            # Nothing will process it; let the purger remove the row and original
+            upload_service.tombstone_upload(upload.id)
+            logger.warning(f"Rejected upload {upload.id}: {str(e)}")
+            return fail_response(429, "Processing queue is full. Try again later.",
+                                 headers={"Retry-After": str(settings.BACKPRESSURE_RETRY_AFTER_SECONDS)})
         
         # Return response
-        return success_response(
+        return fast_success_response(
             202,
             "Image uploaded successfully. Processing started.",
             UploadResponse(
@@ -71,7 +142,7 @@ async def upload_image(
                 result_url=f"/upload/{upload.id}/result",
                 original_url=upload.original_url,
                 created_at=upload.created_at
-            ).dict()
+            )
         )
         
     except Exception as e:
@@ -79,9 +150,338 @@ async def upload_image(
         return fail_response(500, "Failed to upload image", {"error": str(e)})
 
 
+@router.post("/upload/direct", response_model=DirectUploadTicketResponse)
+async def create_direct_upload(
+    request: Request,
+    upload_data: DirectUploadCreate,
+    db: Session = Depends(get_db)
+):
+    """Get a signed URL to PUT an original straight to storage
+
+    Send the file to `upload_url` with the returned `headers`, then POST
+    `finalize_token` to /upload/direct/finalize to start processing. The
+    file bytes never pass through the API.
+    """
+    try:
+        retry_after = await admission_service.check_rate_limit(get_client_id(request))
+        if retry_after is not None:
+            return fail_response(429, "Too many uploads. Try again later.",
+                                 headers={"Retry-After": str(retry_after)})
+        
+        if upload_data.callback_url is not None:
+            callback_error = await run_in_threadpool(_callback_url_error, upload_data.callback_url)
+            if callback_error:
+                return fail_response(400, callback_error)
+        
+        if upload_data.mime_type not in settings.ALLOWED_IMAGE_TYPES:
+            return fail_response(400, f"File type not allowed. Allowed types: {settings.ALLOWED_IMAGE_TYPES}")
+        
+        if "." not in upload_data.original_filename:
+            return fail_response(400, "original_filename must have an extension")
+        
+        ticket = DirectUploadService(db).create_ticket(
+            original_filename=upload_data.original_filename,
+            mime_type=upload_data.mime_type,
+            storage=storage_service,
+            callback_url=upload_data.callback_url
+        )
+        
+        return fast_success_response(201, "Upload URL created", DirectUploadTicketResponse(**ticket))
+        
+    except Exception as e:
+        logger.error(f"Failed to create direct upload: {str(e)}")
+        return fail_response(500, "Failed to create direct upload", {"error": str(e)})
+
+
+@router.post("/upload/direct/finalize", response_model=UploadResponse)
+async def finalize_direct_upload(
+    finalize_data: DirectUploadFinalize,
+    db: Session = Depends(get_db)
+):
+    """Check a directly uploaded original and start processing it
+
+    Safe to repeat: the same token always yields the same upload.
+    """
+    try:
+        retry_after = await admission_service.check_backlog(db)
+        if retry_after is not None:
+            return fail_response(429, "Processing backlog is full. Try again later.",
+                                 headers={"Retry-After": str(retry_after)})
+        
+        try:
+            upload, _ = await run_in_threadpool(
+                DirectUploadService(db).finalize, finalize_data.finalize_token, storage_service
+            )
+        except InvalidUploadTicketError as e:
+            return fail_response(400, str(e))
+        except UploadObjectMissingError as e:
+            return fail_response(409, str(e))
+        except ValueError as e:
+            return fail_response(400, str(e))
+        
+        # Re-sent on a repeated finalize while the upload is still pending;
+        # the processing lease keeps a duplicate task from doing the work twice
+        if upload.status == UploadStatus.PENDING:
+            try:
+                get_dispatcher().submit_process_image(upload.id)
+            except DispatchQueueFullError as e:
+                logger.warning(f"Deferred processing of upload {upload.id}: {str(e)}")
+                return fail_response(429, "Processing queue is full. Try again later.",
+                                     headers={"Retry-After": str(settings.BACKPRESSURE_RETRY_AFTER_SECONDS)})
+        
+        return fast_success_response(
+            202,
+            "Upload finalized. Processing started.",
+            UploadResponse(
+                upload_id=upload.id,
+                status_url=f"/upload/{upload.id}/status",
+                result_url=f"/upload/{upload.id}/result",
+                original_url=upload.original_url,
+                created_at=upload.created_at
+            )
+        )
+        
+    except Exception as e:
+        logger.error(f"Failed to finalize direct upload: {str(e)}")
+        return fail_response(500, "Failed to finalize direct upload", {"error": str(e)})
+
+
+@router.post("/upload/sessions", response_model=UploadSessionResponse)
+async def create_upload_session(
+    request: Request,
+    session_data: UploadSessionCreate,
+    db: Session = Depends(get_db)
+):
+    """Start a resumable upload
+
+    Send the file with PUT /upload/sessions/{id}/chunks?offset=N, one chunk
+    at a time in order. After a dropped connection, GET the session to learn
+    the offset to resume from. POST /upload/sessions/{id}/finalize once all
+    bytes are in to start processing.
+    """
+    try:
+        retry_after = await admission_service.check_rate_limit(get_client_id(request))
+        if retry_after is not None:
+            return fail_response(429, "Too many uploads. Try again later.",
+                                 headers={"Retry-After": str(retry_after)})
+        
+        if session_data.callback_url is not None:
+            callback_error = await run_in_threadpool(_callback_url_error, session_data.callback_url)
+            if callback_error:
+                return fail_response(400, callback_error)
+        
+        if session_data.mime_type not in settings.ALLOWED_IMAGE_TYPES:
+            return fail_response(400, f"File type not allowed. Allowed types: {settings.ALLOWED_IMAGE_TYPES}")
+        
+        if "." not in session_data.original_filename:
+            return fail_response(400, "original_filename must have an extension")
+        
+        if session_data.total_size > settings.RESUMABLE_UPLOAD_MAX_SIZE_MB * 1024 * 1024:
+            return fail_response(400, f"File too large. Max size: {settings.RESUMABLE_UPLOAD_MAX_SIZE_MB}MB")
+        
+        session = UploadSessionService(db).create_session(
+            original_filename=session_data.original_filename,
+            mime_type=session_data.mime_type,
+            total_size=session_data.total_size,
+            callback_url=session_data.callback_url
+        )
+        
+        return fast_success_response(201, "Upload session created", _session_response(session))
+        
+    except Exception as e:
+        logger.error(f"Failed to create upload session: {str(e)}")
+        return fail_response(500, "Failed to create upload session", {"error": str(e)})
+
+
+@router.get("/upload/sessions/{session_id}", response_model=UploadSessionResponse)
+async def get_upload_session(
+    session_id: str,
+    db: Session = Depends(get_db)
+):
+    """Get the offset a resumable upload should continue from"""
+    try:
+        session = UploadSessionService(db).get_session(session_id)
+        
+        if not session:
+            return fail_response(404, "Upload session not found")
+        
+        return fast_success_response(
+            200, "Upload session retrieved successfully", _session_response(session),
+            headers={"Cache-Control": "no-store"}
+        )
+        
+    except Exception as e:
+        logger.error(f"Failed to get upload session: {str(e)}")
+        return fail_response(500, "Failed to get upload session", {"error": str(e)})
+
+
+@router.put("/upload/sessions/{session_id}/chunks", response_model=UploadSessionResponse)
+async def upload_session_chunk(
+    session_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    db: Session = Depends(get_db)
+):
+    """Append the request body to a resumable upload at `offset`
+
+    A chunk that does not start at the session's current offset is
+    rejected with 409 and the offset to resume from. Every chunk but the
+    last must be at least UPLOAD_CHUNK_MIN_BYTES.
+    """
+    try:
+        session_service = UploadSessionService(db)
+        session = session_service.get_session(session_id)
+        
+        if not session:
+            return fail_response(404, "Upload session not found")
+        
+        # Refuse a declared undersized chunk before reading it; append_chunk checks the actual size
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit():
+            try:
+                check_chunk_size(session, offset, int(content_length))
+            except ValueError as e:
+                return fail_response(400, str(e))
+        
+        # Only one chunk is ever held in memory
+        max_bytes = settings.UPLOAD_CHUNK_MAX_BYTES
+        data = bytearray()
+        async for block in request.stream():
+            data.extend(block)
+            if len(data) > max_bytes:
+                return fail_response(413, f"Chunk too large. Max size: {max_bytes} bytes")
+        
+        try:
+            session = await run_in_threadpool(
+                session_service.append_chunk, session, offset, bytes(data), storage_service
+            )
+        except UploadOffsetMismatchError as e:
+            return fail_response(409, "Chunk offset does not match the session",
+                                 {"offset": e.current_offset})
+        except UploadSessionStateError as e:
+            return fail_response(409, str(e))
+        except ValueError as e:
+            return fail_response(400, str(e))
+        
+        return fast_success_response(200, "Chunk stored", _session_response(session))
+        
+    except Exception as e:
+        logger.error(f"Failed to store chunk for session {session_id}: {str(e)}")
+        return fail_response(500, "Failed to store chunk", {"error": str(e)})
+
+
+@router.post("/upload/sessions/{session_id}/finalize", response_model=UploadResponse)
+async def finalize_upload_session(
+    session_id: str,
+    db: Session = Depends(get_db)
+):
+    """Assemble a completed resumable upload and start processing it
+
+    Safe to repeat: finalizing an already finalized session returns the
+    same upload.
+    """
+    try:
+        session_service = UploadSessionService(db)
+        session = session_service.get_session(session_id)
+        
+        if not session:
+            return fail_response(404, "Upload session not found")
+        
+        retry_after = await admission_service.check_backlog(db)
+        if retry_after is not None:
+            return fail_response(429, "Processing backlog is full. Try again later.",
+                                 headers={"Retry-After": str(retry_after)})
+        
+        try:
+            upload, _ = await run_in_threadpool(session_service.finalize, session, storage_service)
+        except UploadSessionStateError as e:
+            return fail_response(409, str(e))
+        
+        # Also re-sent on a repeated finalize while the upload is still pending;
+        # the processing lease keeps a duplicate task from doing the work twice
+        if upload.status == UploadStatus.PENDING:
+            try:
+                get_dispatcher().submit_process_image(upload.id)
+            except DispatchQueueFullError as e:
+                # The upload stays pending; finalizing again resubmits it
+                logger.warning(f"Deferred processing of upload {upload.id}: {str(e)}")
+                return fail_response(429, "Processing queue is full. Try again later.",
+                                     headers={"Retry-After": str(settings.BACKPRESSURE_RETRY_AFTER_SECONDS)})
+        
+        return fast_success_response(
+            202,
+            "Upload finalized. Processing started.",
+            UploadResponse(
+                upload_id=upload.id,
+                status_url=f"/upload/{upload.id}/status",
+                result_url=f"/upload/{upload.id}/result",
+                original_url=upload.original_url,
+                created_at=upload.created_at
+            )
+        )
+        
+    except Exception as e:
+        logger.error(f"Failed to finalize upload session {session_id}: {str(e)}")
+        return fail_response(500, "Failed to finalize upload session", {"error": str(e)})
+
+
+@router.get("/uploads", response_model=UploadListResponse)
+async def list_uploads(
+    status: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """List uploads newest first, paginated with an opaque cursor"""
+    try:
+        valid_statuses = [UploadStatus.PENDING, UploadStatus.PROCESSING,
+                          UploadStatus.COMPLETED, UploadStatus.FAILED]
+        if status and status not in valid_statuses:
+            return fail_response(400, f"Invalid status. Allowed: {valid_statuses}")
+        
+        upload_service = UploadService(db)
+        try:
+            uploads, next_cursor = upload_service.list_uploads(
+                status=status,
+                created_after=created_after,
+                created_before=created_before,
+                limit=limit,
+                cursor=cursor
+            )
+        except ValueError as e:
+            return fail_response(400, str(e))
+        
+        return fast_success_response(
+            200,
+            "Uploads retrieved successfully",
+            UploadListResponse(
+                items=[
+                    UploadListItem(
+                        upload_id=upload.id,
+                        status=upload.status,
+                        original_filename=upload.original_filename,
+                        mime_type=upload.mime_type,
+                        file_size=upload.file_size,
+                        created_at=upload.created_at,
+                        updated_at=upload.updated_at
+                    )
+                    for upload in uploads
+                ],
+                next_cursor=next_cursor
+            )
+        )
+        
+    except Exception as e:
+        logger.error(f"Failed to list uploads: {str(e)}")
+        return fail_response(500, "Failed to list uploads", {"error": str(e)})
+
+
 @router.get("/upload/{upload_id}/status", response_model=UploadStatusResponse)
 async def get_upload_status(
     upload_id: str,
+    request: Request,
     db: Session = Depends(get_db)
 ):
     """Get processing status of an upload"""
@@ -92,7 +492,16 @@ async def get_upload_status(
         if not upload:
             return fail_response(404, "Upload not found")
         
-        return success_response(
+        # Status changes while processing, so caches must revalidate every time
+        headers = cache_headers(
+            make_etag("status", upload.id, upload.status, upload.updated_at.isoformat()),
+            upload.updated_at,
+            "no-cache"
+        )
+        if is_not_modified(request.headers, headers["ETag"], upload.updated_at):
+            return not_modified_response(headers)
+        
+        return fast_success_response(
             200,
             "Status retrieved successfully",
             UploadStatusResponse(
@@ -101,9 +510,11 @@ async def get_upload_status(
                 error_message=upload.error_message,
                 processing_started_at=upload.processing_started_at,
                 processing_completed_at=upload.processing_completed_at,
+                placeholder=upload.placeholder,
                 created_at=upload.created_at,
                 updated_at=upload.updated_at
-            ).dict()
+            ),
+            headers=headers
         )
         
     except Exception as e:
@@ -114,6 +525,7 @@ async def get_upload_status(
 @router.get("/upload/{upload_id}/result", response_model=UploadResultResponse)
 async def get_upload_result(
     upload_id: str,
+    request: Request,
     db: Session = Depends(get_db)
 ):
     """Get processing result of an upload"""
@@ -127,7 +539,16 @@ async def get_upload_result(
         if upload.status != "completed":
             return fail_response(400, "Processing not completed yet")
         
-        return success_response(
+        # Completed results only change on reprocessing, which moves updated_at
+        headers = cache_headers(
+            make_etag("result", upload.id, upload.status, upload.updated_at.isoformat()),
+            upload.updated_at,
+            f"public, max-age={settings.RESULT_CACHE_MAX_AGE_SECONDS}"
+        )
+        if is_not_modified(request.headers, headers["ETag"], upload.updated_at):
+            return not_modified_response(headers)
+        
+        return fast_success_response(
             200,
             "Result retrieved successfully",
             UploadResultResponse(
@@ -137,9 +558,12 @@ async def get_upload_result(
                 thumbnail_url=upload.thumbnail_url,
                 resized_url=upload.resized_url,
                 compressed_url=upload.compressed_url,
+                srcset=upload.srcset or [],
+                placeholder=upload.placeholder,
                 created_at=upload.created_at,
                 updated_at=upload.updated_at
-            ).dict()
+            ),
+            headers=headers
         )
         
     except Exception as e:
@@ -147,12 +571,14 @@ async def get_upload_result(
         return fail_response(500, "Failed to get result", {"error": str(e)})
 
 
-@router.delete("/upload/{upload_id}")
-async def delete_upload(
+@router.get("/upload/{upload_id}/similar", response_model=SimilarUploadsResponse)
+async def get_similar_uploads(
     upload_id: str,
+    max_distance: int = Query(settings.PHASH_MAX_DISTANCE, ge=0, le=settings.PHASH_MAX_DISTANCE),
+    limit: int = Query(20, ge=1, le=100),
     db: Session = Depends(get_db)
 ):
-    """Delete an upload and its files"""
+    """Find near-duplicates of an upload by perceptual hash distance"""
     try:
         upload_service = UploadService(db)
         upload = upload_service.get_upload(upload_id)
@@ -160,23 +586,48 @@ async def delete_upload(
         if not upload:
             return fail_response(404, "Upload not found")
         
-        # Delete files from storage
-        urls_to_delete = [
-            upload.original_url,
-            upload.thumbnail_url,
-            upload.resized_url,
-            upload.compressed_url
-        ]
+        if upload.phash is None:
+            return fail_response(400, "Perceptual hash not available yet")
+        
+        matches = similarity_service.find_similar(db, upload, max_distance, limit)
         
-        for url in urls_to_delete:
-            if url:
-                await run_in_threadpool(storage_service.delete_file, url)
+        return fast_success_response(
+            200,
+            "Similar uploads retrieved successfully",
+            SimilarUploadsResponse(
+                upload_id=upload.id,
+                max_distance=max_distance,
+                items=[
+                    SimilarUpload(
+                        upload_id=match.id,
+                        distance=distance,
+                        thumbnail_url=match.thumbnail_url,
+                        created_at=match.created_at
+                    )
+                    for match, distance in matches
+                ]
+            )
+        )
         
-        # Delete from database
-        upload.delete(db)
+    except Exception as e:
+        logger.error(f"Failed to find similar uploads: {str(e)}")
+        return fail_response(500, "Failed to find similar uploads", {"error": str(e)})
+
+
+@router.delete("/upload/{upload_id}")
+async def delete_upload(
+    upload_id: str,
+    db: Session = Depends(get_db)
+):
+    """Delete an upload; its files are removed in the background"""
+    try:
+        upload_service = UploadService(db)
+        
+        if not upload_service.tombstone_upload(upload_id):
+            return fail_response(404, "Upload not found")
         
-        return success_response(200, "Upload deleted successfully")
+        return success_response(202, "Upload scheduled for deletion")
         
     except Exception as e:
         logger.error(f"Failed to delete upload: {str(e)}")
-        return fail_response(500, "Failed to delete upload", {"error": str(e)})
\ No newline at end of file
+        return fail_response(500, "Failed to delete upload", {"error": str(e)})
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, Field, HttpUrl
 
 
@@ -10,7 +10,7 @@ class UploadBase(BaseModel):
 
 
 class UploadCreate(UploadBase):
-    pass
+    callback_url: Optional[str] = None
 
 
 class UploadUpdate(BaseModel):
@@ -38,6 +38,42 @@ class UploadInDB(UploadBase):
         from_attributes = True
 
 
+class UploadSessionCreate(BaseModel):
+    original_filename: str = Field(..., min_length=1, max_length=255)
+    mime_type: str
+    total_size: int = Field(..., gt=0)
+    callback_url: Optional[str] = None
+
+
+class UploadSessionResponse(BaseModel):
+    session_id: str
+    status: str
+    offset: int
+    total_size: int
+    expires_at: datetime
+    upload_id: Optional[str] = None
+
+
+class DirectUploadCreate(BaseModel):
+    original_filename: str = Field(..., min_length=1, max_length=255)
+    mime_type: str
+    callback_url: Optional[str] = None
+
+
+class DirectUploadTicketResponse(BaseModel):
+    upload_id: str
+    upload_url: str
+    method: str = "PUT"
+    headers: dict
+    max_size: int
+    expires_at: datetime
+    finalize_token: str
+
+
+class DirectUploadFinalize(BaseModel):
+    finalize_token: str
+
+
 class UploadResponse(BaseModel):
     upload_id: str
     status_url: str
@@ -52,10 +88,17 @@ class UploadStatusResponse(BaseModel):
     error_message: Optional[str] = None
     processing_started_at: Optional[datetime] = None
     processing_completed_at: Optional[datetime] = None
+    placeholder: Optional[str] = None
     created_at: datetime
     updated_at: datetime
 
 
+class SrcsetEntry(BaseModel):
+    width: int
+    height: int
+    url: str
+
+
 class UploadResultResponse(BaseModel):
     upload_id: str
     status: str
@@ -63,5 +106,35 @@ class UploadResultResponse(BaseModel):
     thumbnail_url: Optional[str] = None
     resized_url: Optional[str] = None
     compressed_url: Optional[str] = None
+    srcset: List[SrcsetEntry] = []
+    placeholder: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+
+class UploadListItem(BaseModel):
+    upload_id: str
+    status: str
+    original_filename: str
+    mime_type: Optional[str] = None
+    file_size: Optional[int] = None
     created_at: datetime
-    updated_at: datetime
\ No newline at end of file
+    updated_at: datetime
+
+
+class UploadListResponse(BaseModel):
+    items: List[UploadListItem]
+    next_cursor: Optional[str] = None
+
+
+class SimilarUpload(BaseModel):
+    upload_id: str
+    distance: int
+    thumbnail_url: Optional[str] = None
+    created_at: datetime
+
+
+class SimilarUploadsResponse(BaseModel):
+    upload_id: str
+    max_distance: int
+    items: List[SimilarUpload]
@@ -0,0 +1,144 @@
+import math
+import time
+from typing import Optional
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from api.v1.services.upload_service import UploadService
+from api.utils.config import settings
+from api.utils.logger import logger
+
+# Token bucket kept in a Redis hash per client. Runs atomically on the
+# server, so every API replica shares one budget per client. Time comes
+# from Redis itself, so replica clock skew does not matter. Returns
+# {allowed, seconds until a token is available} (as a string, since Lua
+# numbers are truncated to integers on the way out).
+RATE_LIMIT_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(wait)}
+"""
+
+# After a Redis failure, stop trying for this long instead of paying the timeout on every request
+REDIS_RETRY_AFTER_FAILURE_SECONDS = 5.0
+
+
+def get_client_id(request: Request) -> str:
+    """Identify the caller for rate limiting"""
+    if settings.TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+class AdmissionService:
+    """Decide whether a new upload may be accepted.
+
+    Two checks, each returning the number of seconds the client should
+    wait (for Retry-After) or None to admit:
+
+    - a per-client token bucket shared across replicas through Redis;
+      if Redis is unavailable the limiter fails open
+    - backpressure on the processing backlog (broker queue depth and
+      uploads in flight), measured at most once per
+      BACKPRESSURE_CHECK_INTERVAL_SECONDS per process
+    """
+
+    def __init__(self, redis_client=None):
+        self._redis = redis_client
+        self._script = None
+        self._redis_down_until = 0.0
+        self._backlog_checked_at = float("-inf")
+        self._queue_depth = 0
+        self._in_flight = 0
+
+    def _get_script(self):
+        if self._script is None:
+            if self._redis is None:
+                import redis.asyncio
+
+                self._redis = redis.asyncio.from_url(
+                    settings.REDIS_URL,
+                    socket_timeout=settings.RATE_LIMIT_REDIS_TIMEOUT_SECONDS,
+                    socket_connect_timeout=settings.RATE_LIMIT_REDIS_TIMEOUT_SECONDS
+                )
+            # EVALSHA with a transparent reload if the server lost the script
+            self._script = self._redis.register_script(RATE_LIMIT_SCRIPT)
+        return self._script
+
+    async def check_rate_limit(self, client_id: str) -> Optional[int]:
+        """Take a token for `client_id`; returns Retry-After seconds when out of tokens"""
+        if not settings.RATE_LIMIT_ENABLED or settings.RATE_LIMIT_PER_MINUTE <= 0:
+            return None
+        if time.monotonic() < self._redis_down_until:
+            return None
+
+        try:
+            allowed, wait = await self._get_script()(
+                keys=[f"ratelimit:upload:{client_id}"],
+                args=[settings.RATE_LIMIT_PER_MINUTE / 60, settings.RATE_LIMIT_BURST]
+            )
+        except Exception as e:
+            self._redis_down_until = time.monotonic() + REDIS_RETRY_AFTER_FAILURE_SECONDS
+            logger.warning(f"Rate limiter unavailable, admitting requests: {str(e)}")
+            return None
+
+        if int(allowed):
+            return None
+        return max(1, math.ceil(float(wait)))
+
+    async def check_backlog(self, db: Session) -> Optional[int]:
+        """Returns Retry-After seconds when the processing backlog is over its thresholds"""
+        max_depth = settings.BACKPRESSURE_MAX_QUEUE_DEPTH
+        max_in_flight = settings.BACKPRESSURE_MAX_IN_FLIGHT
+        if max_depth <= 0 and max_in_flight <= 0:
+            return None
+
+        now = time.monotonic()
+        if now - self._backlog_checked_at >= settings.BACKPRESSURE_CHECK_INTERVAL_SECONDS:
+            self._backlog_checked_at = now
+            try:
+                from api.v1.workers.dispatch import get_dispatcher
+
+                if max_depth > 0:
+                    self._queue_depth = await run_in_threadpool(get_dispatcher().queue_depth)
+                if max_in_flight > 0:
+                    self._in_flight = UploadService(db).count_in_flight()
+            except Exception as e:
+                # Measuring failed; keep admitting rather than turning it into an outage
+                logger.warning(f"Failed to measure processing backlog: {str(e)}")
+                self._queue_depth = self._in_flight = 0
+
+        if (max_depth > 0 and self._queue_depth >= max_depth) or \
+                (max_in_flight > 0 and self._in_flight >= max_in_flight):
+            logger.warning(
+                f"Backpressure: queue depth {self._queue_depth}, in flight {self._in_flight}"
+            )
+            return settings.BACKPRESSURE_RETRY_AFTER_SECONDS
+        return None
+
+
+# Singleton instance
+admission_service = AdmissionService()
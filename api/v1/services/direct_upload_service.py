@@ -0,0 +1,171 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from api.v1.models.upload import ImageUpload
+from api.v1.schemas.upload import UploadCreate
+from api.v1.services.upload_service import UploadService
+from api.utils.config import settings
+from api.utils.logger import logger
+
+# Enough for every signature detect_image_type looks at
+HEADER_BYTES = 16
+
+
+class InvalidUploadTicketError(Exception):
+    """Raised when a finalize token is malformed, forged or expired"""
+
+
+class UploadObjectMissingError(Exception):
+    """Raised when finalize is called before the client's PUT has landed"""
+
+
+def detect_image_type(header: bytes) -> Optional[str]:
+    """MIME type of an image from its leading bytes, or None if not recognized"""
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def sign_ticket(claims: dict) -> str:
+    """Encode `claims` as a tamper-proof token (HMAC-SHA256 with SECRET_KEY)"""
+    body = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    signature = hmac.new(settings.SECRET_KEY.encode(), body.encode(), hashlib.sha256).digest()
+    return f"{body}.{_b64encode(signature)}"
+
+
+def verify_ticket(token: str) -> dict:
+    """Claims of a token produced by sign_ticket; raises InvalidUploadTicketError"""
+    try:
+        body, signature = token.split(".")
+        expected = hmac.new(settings.SECRET_KEY.encode(), body.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            raise InvalidUploadTicketError("Invalid finalize token")
+        claims = json.loads(_b64decode(body))
+    except InvalidUploadTicketError:
+        raise
+    except Exception as e:
+        raise InvalidUploadTicketError("Invalid finalize token") from e
+
+    if claims.get("exp", 0) < time.time():
+        raise InvalidUploadTicketError("Finalize token has expired")
+    return claims
+
+
+class DirectUploadService:
+    """Uploads that go straight from the client to storage.
+
+    The API hands out a signed URL for the original plus a finalize token
+    describing it; nothing is stored until finalize. Finalize checks that
+    the object exists, fits the size limit and really is the declared image
+    type (from a ranged read of its first bytes), then creates the upload
+    record under the ID from the token, so repeating it is harmless.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def create_ticket(
+        self,
+        original_filename: str,
+        mime_type: str,
+        storage,
+        callback_url: Optional[str] = None
+    ) -> dict:
+        """Signed upload URL for a new original, and the token to finalize it with"""
+        upload_id = str(uuid.uuid4())
+        file_path = storage.generate_file_path(upload_id, original_filename)
+        max_bytes = settings.MAX_IMAGE_SIZE_MB * 1024 * 1024
+        expires_seconds = settings.DIRECT_UPLOAD_URL_EXPIRY_SECONDS
+
+        upload_url, headers = storage.generate_upload_url(file_path, mime_type, max_bytes, expires_seconds)
+        now = time.time()
+        token = sign_ticket({
+            "upload_id": upload_id,
+            "url": storage.get_file_url(file_path),
+            "filename": original_filename,
+            "mime_type": mime_type,
+            "callback_url": callback_url,
+            "exp": int(now + expires_seconds + settings.DIRECT_UPLOAD_FINALIZE_WINDOW_SECONDS),
+        })
+
+        return {
+            "upload_id": upload_id,
+            "upload_url": upload_url,
+            "headers": headers,
+            "max_size": max_bytes,
+            "expires_at": datetime.fromtimestamp(now + expires_seconds, timezone.utc),
+            "finalize_token": token,
+        }
+
+    def finalize(self, token: str, storage) -> Tuple[ImageUpload, bool]:
+        """Validate the uploaded object and create its upload record
+
+        Returns the upload and whether this call created it. Raises
+        InvalidUploadTicketError, UploadObjectMissingError, or ValueError
+        when the object is rejected (it is then deleted).
+        """
+        claims = verify_ticket(token)
+        upload_id = claims["upload_id"]
+
+        existing = self.db.get(ImageUpload, upload_id)
+        if existing is not None:
+            if existing.deleted_at is not None:
+                raise InvalidUploadTicketError("Upload has been deleted")
+            return existing, False
+
+        url = claims["url"]
+        info = storage.get_file_info(url)
+        if info is None:
+            raise UploadObjectMissingError("File has not been uploaded yet")
+
+        max_bytes = settings.MAX_IMAGE_SIZE_MB * 1024 * 1024
+        if not 0 < info["size"] <= max_bytes:
+            storage.delete_file(url)
+            raise ValueError(f"File is empty or too large. Max size: {settings.MAX_IMAGE_SIZE_MB}MB")
+
+        detected = detect_image_type(storage.read_file_header(url, HEADER_BYTES))
+        if detected != claims["mime_type"]:
+            storage.delete_file(url)
+            raise ValueError(f"File content is not {claims['mime_type']}")
+
+        try:
+            upload = UploadService(self.db).create_upload(
+                UploadCreate(
+                    original_filename=claims["filename"],
+                    file_size=info["size"],
+                    mime_type=detected,
+                    callback_url=claims["callback_url"]
+                ),
+                url,
+                upload_id=upload_id
+            )
+        except IntegrityError:
+            # A concurrent finalize of the same token got there first
+            self.db.rollback()
+            return self.db.get(ImageUpload, upload_id), False
+
+        logger.info(f"Finalized direct upload {upload_id} ({info['size']} bytes)")
+        return upload, True
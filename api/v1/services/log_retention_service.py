@@ -0,0 +1,210 @@
+import re
+from datetime import date, datetime, time, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.exc import DBAPIError, OperationalError, SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from api.v1.models.upload import ProcessingLog
+from api.utils.logger import logger
+
+PARENT_TABLE = ProcessingLog.__tablename__
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+
+# Bounds of a range partition, as rendered by pg_get_expr
+_LOWER_BOUND = re.compile(r"FROM \('([^']+)'\)")
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def _parse_bound(pattern: re.Pattern, bound: Optional[str]) -> Optional[datetime]:
+    match = pattern.search(bound or "")
+    if not match:
+        return None
+    parsed = datetime.fromisoformat(match.group(1))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class LogRetentionService:
+    """Maintain processing_logs partitions and enforce retention.
+
+    In Postgres processing_logs is partitioned by day, so expiring logs is a
+    DROP TABLE per partition instead of a large DELETE. On other databases
+    (tests, local SQLite) it falls back to chunked deletes.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def is_partitioned(self) -> bool:
+        """Check whether processing_logs is a partitioned table"""
+        if self.db.get_bind().dialect.name != "postgresql":
+            return False
+        return self.db.execute(
+            text(
+                "SELECT 1 FROM pg_partitioned_table p "
+                "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :name"
+            ),
+            {"name": PARENT_TABLE},
+        ).first() is not None
+
+    @staticmethod
+    def partition_name(day: date) -> str:
+        return f"{PARENT_TABLE}_p{day:%Y%m%d}"
+
+    def partition_ranges(self) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+        """(name, lower, upper) of each range partition; None stands for MINVALUE/MAXVALUE
+
+        The DEFAULT partition has no range and is left out.
+        """
+        partitions = self.db.execute(text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :name"
+        ), {"name": PARENT_TABLE}).all()
+        return [
+            (name, _parse_bound(_LOWER_BOUND, bound), _parse_bound(_UPPER_BOUND, bound))
+            for name, bound in partitions
+            if bound != "DEFAULT"
+        ]
+
+    def ensure_partitions(self, days_ahead: int, today: Optional[date] = None) -> List[str]:
+        """Create daily partitions from today through `days_ahead` days from now
+
+        Days already covered by a partition, such as the legacy one the
+        partitioning migration attached, are skipped. Each partition is
+        committed on its own. One that cannot be created, typically because
+        the DEFAULT partition already holds rows for that day, is logged and
+        skipped; those rows stay in DEFAULT until they expire.
+        """
+        today = today or datetime.now(timezone.utc).date()
+        ranges = self.partition_ranges()
+        created = []
+        for offset in range(days_ahead + 1):
+            day = today + timedelta(days=offset)
+            name = self.partition_name(day)
+            start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+            end = start + timedelta(days=1)
+            if any(
+                (lower is None or lower < end) and (upper is None or upper > start)
+                for _, lower, upper in ranges
+            ):
+                continue
+            try:
+                self.db.execute(text(
+                    f"CREATE TABLE {name} PARTITION OF {PARENT_TABLE} "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                ))
+                self.db.commit()
+            except DBAPIError as e:
+                self.db.rollback()
+                logger.warning(f"Could not create processing log partition {name}: {e}")
+                continue
+            created.append(name)
+
+        if created:
+            logger.info(f"Created processing log partitions: {', '.join(created)}")
+        return created
+
+    def drop_expired_partitions(self, retention_days: int, lock_timeout_seconds: float = 5) -> List[str]:
+        """Drop partitions whose whole range is older than the retention window.
+
+        DETACH PARTITION takes an ACCESS EXCLUSIVE lock on processing_logs,
+        and the CONCURRENTLY form is not allowed while a DEFAULT partition
+        exists. The detach is committed on its own so the lock is held only
+        for the catalog change, and `lock_timeout_seconds` stops it from
+        queueing behind long queries while every log insert queues behind
+        it. A partition that cannot be locked in time is left for the next
+        run.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+        dropped = []
+        for name, _, upper in self.partition_ranges():
+            if upper is not None and upper <= cutoff:
+                try:
+                    self.db.execute(text(f"SET LOCAL lock_timeout = '{int(lock_timeout_seconds * 1000)}ms'"))
+                    self.db.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+                    self.db.commit()
+                except OperationalError as e:
+                    self.db.rollback()
+                    logger.warning(f"Could not detach processing log partition {name}, retrying next run: {e}")
+                    continue
+                # Detached, so dropping it no longer touches the parent
+                self.db.execute(text(f"DROP TABLE {name}"))
+                self.db.commit()
+                dropped.append(name)
+
+        if dropped:
+            logger.info(f"Dropped expired processing log partitions: {', '.join(dropped)}")
+        return dropped
+
+    def delete_expired_default_logs(self, retention_days: int, chunk_size: int = 5000) -> int:
+        """Delete expired rows from the DEFAULT partition in chunks
+
+        Logs land there when no daily partition was ready for them. The
+        partition is never dropped, so its rows are deleted like those of
+        an unpartitioned table.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+        deleted = 0
+        while True:
+            result = self.db.execute(text(
+                f"DELETE FROM {DEFAULT_PARTITION} WHERE ctid IN ("
+                f"SELECT ctid FROM {DEFAULT_PARTITION} WHERE created_at < :cutoff LIMIT :limit)"
+            ), {"cutoff": cutoff, "limit": chunk_size})
+            self.db.commit()
+            deleted += result.rowcount
+            if result.rowcount < chunk_size:
+                break
+
+        if deleted:
+            logger.info(f"Deleted {deleted} expired processing logs from {DEFAULT_PARTITION}")
+        return deleted
+
+    def delete_expired_logs(self, retention_days: int, chunk_size: int = 5000) -> int:
+        """Fallback for unpartitioned tables: delete old logs in chunks"""
+        cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+        deleted = 0
+        while True:
+            ids = self.db.execute(
+                select(ProcessingLog.id).where(ProcessingLog.created_at < cutoff).limit(chunk_size)
+            ).scalars().all()
+            if not ids:
+                break
+            self.db.execute(
+                delete(ProcessingLog)
+                .where(ProcessingLog.id.in_(ids))
+                .execution_options(synchronize_session=False)
+            )
+            self.db.commit()
+            deleted += len(ids)
+
+        if deleted:
+            logger.info(f"Deleted {deleted} expired processing logs")
+        return deleted
+
+    def apply_retention(self, retention_days: int, days_ahead: int, lock_timeout_seconds: float = 5) -> dict:
+        """Create upcoming partitions and expire old logs
+
+        Each step runs even when another one fails, so a partition that
+        cannot be created never keeps expired ones from being dropped.
+        """
+        if not self.is_partitioned():
+            return {"deleted": self.delete_expired_logs(retention_days)}
+
+        steps = {
+            "created": (lambda: self.ensure_partitions(days_ahead), []),
+            "dropped": (lambda: self.drop_expired_partitions(retention_days, lock_timeout_seconds), []),
+            "deleted": (lambda: self.delete_expired_default_logs(retention_days), 0),
+        }
+        result = {}
+        for key, (step, fallback) in steps.items():
+            try:
+                result[key] = step()
+            except SQLAlchemyError as e:
+                self.db.rollback()
+                logger.error(f"Processing log retention step {key!r} failed: {e}")
+                result[key] = fallback
+        return result
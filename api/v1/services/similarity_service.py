@@ -0,0 +1,236 @@
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+
+from api.v1.models.upload import ImageUpload
+from api.utils.config import settings
+from api.utils.logger import logger
+
+HASH_BITS = 64
+_UNSIGNED_MASK = (1 << HASH_BITS) - 1
+
+# Rows changed this long before the last sync position are read again, so
+# commits that land slightly out of updated_at order are not missed
+SYNC_OVERLAP = timedelta(seconds=30)
+SYNC_CHUNK_SIZE = 5000
+
+
+def to_signed(value: int) -> int:
+    """Map an unsigned 64-bit hash onto the signed BIGINT range"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def from_signed(value: int) -> int:
+    """Inverse of to_signed"""
+    return value & _UNSIGNED_MASK
+
+
+class MultiIndexHash:
+    """In-memory Hamming-distance index over 64-bit hashes.
+
+    Each hash is split into four 16-bit chunks, each with its own lookup
+    table. Two hashes within distance d must agree to within d // 4 bits on
+    at least one chunk (pigeonhole), so a query only probes each table with
+    the chunk values that are that close, then verifies the full distance
+    of the candidates with a popcount.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = HASH_BITS // CHUNKS
+    # Probing radius 2 means 137 lookups per table; beyond that it is cheaper to scan
+    MAX_RADIUS = 2
+    MAX_DISTANCE = CHUNKS * (MAX_RADIUS + 1) - 1
+
+    _CHUNK_MASK = (1 << CHUNK_BITS) - 1
+    _FLIP_MASKS: Dict[int, List[int]] = {}
+
+    def __init__(self):
+        # chunk value -> {key: full hash}; keeping the hash in the bucket
+        # lets candidates be verified without a second lookup
+        self._tables: List[Dict[int, Dict[str, int]]] = [defaultdict(dict) for _ in range(self.CHUNKS)]
+        self._hashes: Dict[str, int] = {}
+
+    @classmethod
+    def _flip_masks(cls, radius: int) -> List[int]:
+        """All CHUNK_BITS-bit masks with at most `radius` bits set"""
+        masks = cls._FLIP_MASKS.get(radius)
+        if masks is None:
+            masks = [0]
+            for bits in range(1, radius + 1):
+                for positions in combinations(range(cls.CHUNK_BITS), bits):
+                    masks.append(sum(1 << p for p in positions))
+            cls._FLIP_MASKS[radius] = masks
+        return masks
+
+    def _chunks(self, value: int) -> List[int]:
+        return [(value >> (i * self.CHUNK_BITS)) & self._CHUNK_MASK for i in range(self.CHUNKS)]
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._hashes
+
+    def add(self, key: str, value: int) -> None:
+        """Index `value` under `key`, replacing any previous hash for it"""
+        if self._hashes.get(key) == value:
+            return
+        self.remove(key)
+        self._hashes[key] = value
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            table[chunk][key] = value
+
+    def remove(self, key: str) -> None:
+        value = self._hashes.pop(key, None)
+        if value is None:
+            return
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            bucket = table[chunk]
+            bucket.pop(key, None)
+            if not bucket:
+                del table[chunk]
+
+    def query(self, value: int, max_distance: int) -> List[Tuple[str, int]]:
+        """Keys whose hash is within `max_distance` bits of `value`, closest first"""
+        if not 0 <= max_distance <= self.MAX_DISTANCE:
+            raise ValueError(f"max_distance must be between 0 and {self.MAX_DISTANCE}")
+
+        masks = self._flip_masks(max_distance // self.CHUNKS)
+        matches: Dict[str, int] = {}
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            for mask in masks:
+                bucket = table.get(chunk ^ mask)
+                if not bucket:
+                    continue
+                for key, candidate in bucket.items():
+                    distance = (candidate ^ value).bit_count()
+                    if distance <= max_distance:
+                        matches[key] = distance
+        return sorted(matches.items(), key=lambda match: (match[1], match[0]))
+
+
+class SimilarityService:
+    """Near-duplicate lookup over the perceptual hashes of uploads.
+
+    The index lives in process memory and is brought up to date
+    incrementally from image_uploads, reading only rows whose updated_at
+    moved since the last sync. Results are re-checked against the database
+    before being returned, so a stale index never surfaces deleted uploads.
+    """
+
+    def __init__(self):
+        self._index = MultiIndexHash()
+        self._lock = threading.Lock()
+        self._synced_until: Optional[datetime] = None
+        self._last_sync = 0.0
+
+    def reset(self) -> None:
+        with self._lock:
+            self._index = MultiIndexHash()
+            self._synced_until = None
+            self._last_sync = 0.0
+
+    def sync(self, db: Session, force: bool = False) -> int:
+        """Apply changes made since the last sync; returns the number of rows read"""
+        with self._lock:
+            if not force and time.monotonic() - self._last_sync < settings.PHASH_INDEX_REFRESH_SECONDS:
+                return 0
+
+            since = self._synced_until - SYNC_OVERLAP if self._synced_until else None
+            position: Optional[Tuple[datetime, str]] = None
+            seen = 0
+
+            while True:
+                query = select(
+                    ImageUpload.id, ImageUpload.phash, ImageUpload.deleted_at, ImageUpload.updated_at
+                )
+                if since is not None:
+                    query = query.where(ImageUpload.updated_at >= since)
+                if position is not None:
+                    query = query.where(or_(
+                        ImageUpload.updated_at > position[0],
+                        and_(ImageUpload.updated_at == position[0], ImageUpload.id > position[1])
+                    ))
+                rows = db.execute(
+                    query.order_by(ImageUpload.updated_at, ImageUpload.id).limit(SYNC_CHUNK_SIZE)
+                ).all()
+
+                for upload_id, phash, deleted_at, _ in rows:
+                    if phash is None or deleted_at is not None:
+                        self._index.remove(upload_id)
+                    else:
+                        self._index.add(upload_id, from_signed(phash))
+
+                seen += len(rows)
+                if len(rows) < SYNC_CHUNK_SIZE:
+                    break
+                position = (rows[-1].updated_at, rows[-1].id)
+
+            if rows:
+                self._synced_until = rows[-1].updated_at
+            elif position is not None:
+                self._synced_until = position[0]
+            self._last_sync = time.monotonic()
+
+        if seen:
+            logger.debug("Similarity index synced %s rows, %s hashes indexed", seen, len(self._index))
+        return seen
+
+    def find_similar(
+        self,
+        db: Session,
+        upload: ImageUpload,
+        max_distance: int,
+        limit: int
+    ) -> List[Tuple[ImageUpload, int]]:
+        """Uploads whose perceptual hash is within `max_distance` of `upload`'s"""
+        if upload.phash is None:
+            return []
+
+        self.sync(db)
+        with self._lock:
+            matches = [
+                (upload_id, distance)
+                for upload_id, distance in self._index.query(from_signed(upload.phash), max_distance)
+                if upload_id != upload.id
+            ]
+        if not matches:
+            return []
+
+        # Confirm against the database; the index may lag behind deletions
+        live = {
+            row.id: row
+            for row in db.scalars(
+                select(ImageUpload).where(
+                    ImageUpload.id.in_([upload_id for upload_id, _ in matches]),
+                    ImageUpload.deleted_at.is_(None),
+                    ImageUpload.phash.is_not(None)
+                )
+            )
+        }
+        with self._lock:
+            for upload_id, _ in matches:
+                if upload_id not in live:
+                    self._index.remove(upload_id)
+
+        target = from_signed(upload.phash)
+        results = []
+        for upload_id, _ in matches:
+            row = live.get(upload_id)
+            if row is None:
+                continue
+            distance = (from_signed(row.phash) ^ target).bit_count()
+            if distance <= max_distance:
+                results.append((row, distance))
+        results.sort(key=lambda result: (result[1], result[0].id))
+        return results[:limit]
+
+
+# Singleton instance
+similarity_service = SimilarityService()
@@ -1,12 +1,159 @@
+import hashlib
+import hmac
 import io
-from datetime import datetime
-from typing import Optional
+import os
+import shutil
+import socket
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional, Tuple
+from urllib.parse import urlencode
 
+import google.auth
+import requests
+from google.api_core import exceptions as gcs_exceptions
+from google.api_core.retry import Retry
+from google.auth.credentials import AnonymousCredentials
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
+from google.resumable_media.common import DataCorruption
 from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
 
 from api.utils.config import settings
 from api.utils.logger import logger
+from api.utils.metrics import metrics
+
+
+# Errors worth retrying: throttling, server-side failures and network drops
+# (including a download whose bytes do not match their checksum)
+TRANSIENT_STORAGE_ERRORS = (
+    gcs_exceptions.TooManyRequests,
+    gcs_exceptions.InternalServerError,
+    gcs_exceptions.BadGateway,
+    gcs_exceptions.ServiceUnavailable,
+    gcs_exceptions.GatewayTimeout,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    ConnectionError,
+    TimeoutError,
+    DataCorruption,
+    # The retry policy gave up on one of the above; the task may still succeed later
+    gcs_exceptions.RetryError,
+)
+
+
+# Most source objects GCS accepts in one compose request
+MAX_COMPOSE_SOURCES = 32
+
+
+def is_transient_storage_error(exc: BaseException) -> bool:
+    """Check whether a storage error is likely to succeed on retry."""
+    return isinstance(exc, TRANSIENT_STORAGE_ERRORS)
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """Connection pool whose sockets send TCP keep-alive probes once idle.
+
+    Pooled connections sit idle between tasks; the probes keep NAT and
+    load balancer entries alive and detect dead peers before the next
+    request is written to them.
+    """
+
+    def __init__(self, keepalive_seconds: int = 0, **kwargs):
+        self.keepalive_seconds = keepalive_seconds
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.keepalive_seconds > 0:
+            kwargs["socket_options"] = HTTPConnection.default_socket_options + _keepalive_options(
+                self.keepalive_seconds
+            )
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _keepalive_options(idle_seconds: int) -> list:
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    # TCP_KEEPIDLE on Linux, TCP_KEEPALIVE on macOS
+    idle_option = getattr(socket, "TCP_KEEPIDLE", getattr(socket, "TCP_KEEPALIVE", None))
+    if idle_option is not None:
+        options.append((socket.IPPROTO_TCP, idle_option, idle_seconds))
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, idle_seconds // 4)))
+    if hasattr(socket, "TCP_KEEPCNT"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 4))
+    return options
+
+
+def build_http_session(credentials) -> AuthorizedSession:
+    """Authorized HTTP session with a GCS_POOL_SIZE keep-alive connection pool
+
+    Retries are left to the operation's retry policy, not to urllib3.
+    """
+    session = AuthorizedSession(credentials)
+    adapter = KeepAliveAdapter(
+        keepalive_seconds=settings.GCS_TCP_KEEPALIVE_SECONDS,
+        pool_connections=settings.GCS_POOL_SIZE,
+        pool_maxsize=settings.GCS_POOL_SIZE,
+        max_retries=0,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def build_retry_policy() -> Retry:
+    """Retry transient storage errors with full-jitter exponential backoff"""
+    return Retry(
+        predicate=is_transient_storage_error,
+        initial=settings.GCS_RETRY_INITIAL_DELAY_SECONDS,
+        maximum=settings.GCS_RETRY_MAX_DELAY_SECONDS,
+        multiplier=2.0,
+        timeout=settings.GCS_RETRY_DEADLINE_SECONDS,
+    )
+
+
+class EncodedImage:
+    """An image encoded once, ready to store as is"""
+
+    def __init__(self, data: bytes, format: str, width: int, height: int):
+        self.data = data
+        self.format = format.upper()
+        self.width = width
+        self.height = height
+
+    @property
+    def content_type(self) -> str:
+        return "image/jpeg" if self.format == "JPEG" else f"image/{self.format.lower()}"
+
+    @property
+    def extension(self) -> str:
+        return "jpg" if self.format == "JPEG" else self.format.lower()
+
+
+def encode_image(
+    image: Image.Image,
+    format: str = "JPEG",
+    quality: int = 85,
+    optimize: bool = False
+) -> EncodedImage:
+    """Encode a PIL Image for storage"""
+    img_io = io.BytesIO()
+
+    # Handle RGBA to RGB conversion for JPEGs
+    if format.upper() == "JPEG" and image.mode in ("RGBA", "LA"):
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1]) # use alpha channel as mask
+        image = background
+
+    image.save(img_io, format=format, quality=quality, optimize=optimize)
+    # getvalue() hands over the buffer itself when no view of it is held, so there is no copy
+    return EncodedImage(img_io.getvalue(), format, image.width, image.height)
 
 
 class StorageService:
@@ -15,13 +162,32 @@ class StorageService:
         self._client = None
         self._bucket = None
         self._init_failed = False
+        # Every call gets a bounded wait per attempt and a bounded number of attempts,
+        # so a slow GCS response cannot hold a worker until the task time limit
+        self.retry = build_retry_policy()
+        self.timeout = (settings.GCS_CONNECT_TIMEOUT_SECONDS, settings.GCS_READ_TIMEOUT_SECONDS)
+        self.transfer_timeout = (settings.GCS_CONNECT_TIMEOUT_SECONDS, settings.GCS_TRANSFER_TIMEOUT_SECONDS)
+
+    def _create_client(self) -> storage.Client:
+        client_options = None
+        if settings.GCS_API_ENDPOINT:
+            credentials, project = AnonymousCredentials(), "local"
+            client_options = {"api_endpoint": settings.GCS_API_ENDPOINT}
+        else:
+            credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+        return storage.Client(
+            project=settings.GOOGLE_CLOUD_PROJECT or project,
+            credentials=credentials,
+            _http=build_http_session(credentials),
+            client_options=client_options,
+        )
 
     @property
     def client(self):
         """Lazily initialize Google Cloud Storage client."""
         if self._client is None and not self._init_failed:
             try:
-                self._client = storage.Client()
+                self._client = self._create_client()
                 logger.info("Google Cloud Storage client initialized successfully")
             except Exception as e:
                 logger.warning(f"Failed to initialize Google Cloud Storage client: {e}. "
@@ -37,13 +203,49 @@ class StorageService:
             self._bucket = self.client.bucket(self.bucket_name)
         return self._bucket
 
-    def generate_file_path(self, upload_id: str, filename: str, suffix: str = "") -> str:
+    @contextmanager
+    def _observe(self, operation: str):
+        """Record the latency of a storage call, by operation and outcome."""
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            metrics.observe(
+                "storage_operation_seconds", time.perf_counter() - started,
+                operation=operation, outcome=outcome
+            )
+
+    def reset_client(self) -> None:
+        """Forget the client and bucket, e.g. after fork, so they are rebuilt in this process."""
+        self._client = None
+        self._bucket = None
+        self._init_failed = False
+
+    def get_blob_path(self, file_url: str) -> str:
+        """Convert a public GCS URL back to the blob path."""
+        prefix = f"https://storage.googleapis.com/{self.bucket_name}/"
+        return file_url.replace(prefix, "")
+
+    def get_file_url(self, file_path: str) -> str:
+        """Public URL of a blob path."""
+        return f"https://storage.googleapis.com/{self.bucket_name}/{file_path}"
+
+    def generate_file_path(
+        self,
+        upload_id: str,
+        filename: str,
+        suffix: str = "",
+        extension: Optional[str] = None,
+    ) -> str:
         """Generate file path in GCS."""
         date_str = datetime.now().strftime("%Y/%m/%d")
         name, ext = filename.rsplit(".", 1)
 
         if suffix:
-            filename = f"{name}_{suffix}.{ext}"
+            name = f"{name}_{suffix}"
+        filename = f"{name}.{extension or ext}"
 
         return f"uploads/{date_str}/{upload_id}/{filename}"
 
@@ -54,66 +256,156 @@ class StorageService:
         original_filename: str,
         suffix: str = "",
         content_type: Optional[str] = None,
+        extension: Optional[str] = None,
     ) -> str:
         """Upload raw bytes to Google Cloud Storage."""
         try:
             if not self.client or not self.bucket:
                 raise RuntimeError("Google Cloud Storage not configured. Please set up credentials.")
             
-            file_path = self.generate_file_path(upload_id, original_filename, suffix)
+            file_path = self.generate_file_path(upload_id, original_filename, suffix, extension)
             blob = self.bucket.blob(file_path)
 
-            blob.upload_from_string(
-                file_content,
-                content_type=content_type,
-            )
+            # The paths are unique per upload, so rewriting one on retry is safe;
+            # GCS rejects the upload if the bytes do not match the CRC32C sent with them
+            with self._observe("upload"):
+                blob.upload_from_string(
+                    file_content,
+                    content_type=content_type,
+                    checksum="crc32c",
+                    timeout=self.transfer_timeout,
+                    retry=self.retry,
+                )
 
-            public_url = f"https://storage.googleapis.com/{self.bucket_name}/{file_path}"
+            public_url = self.get_file_url(file_path)
 
-            logger.info(f"File uploaded to GCS: {file_path}")
+            logger.info("File uploaded to GCS: %s", file_path)
             return public_url
 
         except Exception as e:
             logger.error(f"Failed to upload file to GCS: {str(e)}")
             raise
 
-    def upload_image(
+    def upload_session_chunk(self, session_id: str, chunk_name: str, file_content: bytes) -> str:
+        """Store one chunk of a resumable upload session."""
+        if not self.client or not self.bucket:
+            raise RuntimeError("Google Cloud Storage not configured. Please set up credentials.")
+
+        file_path = f"upload-sessions/{session_id}/{chunk_name}"
+        with self._observe("upload"):
+            self.bucket.blob(file_path).upload_from_string(
+                file_content,
+                content_type="application/octet-stream",
+                checksum="crc32c",
+                timeout=self.transfer_timeout,
+                retry=self.retry,
+            )
+        return self.get_file_url(file_path)
+
+    def compose_files(
         self,
-        image: Image.Image,
+        file_urls: List[str],
         upload_id: str,
         original_filename: str,
-        suffix: str = "",
-        format: str = "JPEG",
-        quality: int = 85,
+        content_type: Optional[str] = None,
     ) -> str:
-        """Upload a PIL Image to Google Cloud Storage."""
+        """Concatenate stored objects into a new file, server side.
+
+        GCS composes at most MAX_COMPOSE_SOURCES objects per request, so
+        longer lists are folded through intermediate objects, which are
+        deleted afterwards. The sources themselves are left in place.
+        """
+        if not self.client or not self.bucket:
+            raise RuntimeError("Google Cloud Storage not configured. Please set up credentials.")
+        if not file_urls:
+            raise ValueError("Nothing to compose")
+
+        file_path = self.generate_file_path(upload_id, original_filename)
+        sources = [self.bucket.blob(self.get_blob_path(url)) for url in file_urls]
+        intermediates = []
         try:
-            img_io = io.BytesIO()
-            
-            # Handle RGBA to RGB conversion for JPEGs
-            if format.upper() == "JPEG" and image.mode in ("RGBA", "LA"):
-                background = Image.new("RGB", image.size, (255, 255, 255))
-                background.paste(image, mask=image.split()[-1]) # use alpha channel as mask
-                image = background
-
-            image.save(img_io, format=format, quality=quality)
-            img_io.seek(0)
-
-            content_type = f"image/{format.lower()}"
-            if format.upper() == "JPEG":
-                content_type = "image/jpeg"
-
-            return self.upload_file(
-                img_io.getvalue(),
-                upload_id,
-                original_filename,
-                suffix,
-                content_type,
+            while len(sources) > MAX_COMPOSE_SOURCES:
+                # First object absorbs as many sources as a request allows, then carries on
+                part = self.bucket.blob(f"{file_path}.compose-{len(intermediates)}")
+                with self._observe("compose"):
+                    part.compose(sources[:MAX_COMPOSE_SOURCES], timeout=self.timeout, retry=self.retry)
+                intermediates.append(part)
+                sources = [part] + sources[MAX_COMPOSE_SOURCES:]
+
+            destination = self.bucket.blob(file_path)
+            destination.content_type = content_type
+            with self._observe("compose"):
+                destination.compose(sources, timeout=self.timeout, retry=self.retry)
+        finally:
+            for part in intermediates:
+                try:
+                    part.delete(timeout=self.timeout, retry=self.retry)
+                except Exception as e:
+                    logger.warning(f"Failed to delete intermediate compose object {part.name}: {e}")
+
+        logger.info("Composed %d objects into %s", len(file_urls), file_path)
+        return self.get_file_url(file_path)
+
+    def generate_upload_url(
+        self,
+        file_path: str,
+        content_type: str,
+        max_bytes: int,
+        expires_seconds: int,
+    ) -> Tuple[str, dict]:
+        """Signed URL a client can PUT one object to, bypassing the API.
+
+        Returns the URL and the headers the client must send with it; the
+        content type and a size limit are part of the signature.
+        """
+        if not self.client or not self.bucket:
+            raise RuntimeError("Google Cloud Storage not configured. Please set up credentials.")
+
+        headers = {
+            "Content-Type": content_type,
+            "x-goog-content-length-range": f"0,{max_bytes}",
+        }
+        url = self.bucket.blob(file_path).generate_signed_url(
+            version="v4",
+            expiration=timedelta(seconds=expires_seconds),
+            method="PUT",
+            content_type=content_type,
+            headers={"x-goog-content-length-range": headers["x-goog-content-length-range"]},
+        )
+        return url, headers
+
+    def get_file_info(self, file_url: str) -> Optional[dict]:
+        """Size and content type of a stored file, or None if it does not exist."""
+        if not self.client or not self.bucket:
+            raise RuntimeError("Google Cloud Storage not configured. Please set up credentials.")
+
+        with self._observe("stat"):
+            blob = self.bucket.get_blob(self.get_blob_path(file_url), timeout=self.timeout, retry=self.retry)
+        if blob is None:
+            return None
+        return {"size": blob.size, "content_type": blob.content_type}
+
+    def read_file_header(self, file_url: str, num_bytes: int) -> bytes:
+        """Download only the first `num_bytes` of a file."""
+        if not self.client or not self.bucket:
+            raise RuntimeError("Google Cloud Storage not configured. Please set up credentials.")
+
+        blob = self.bucket.blob(self.get_blob_path(file_url))
+        # The object's checksum covers all of it, so a range cannot be verified
+        with self._observe("download_range"):
+            return blob.download_as_bytes(
+                start=0, end=num_bytes - 1, checksum=None, timeout=self.timeout, retry=self.retry
             )
 
-        except Exception as e:
-            logger.error(f"Failed to upload image to GCS: {str(e)}")
-            raise
+    def download_file(self, file_url: str) -> bytes:
+        """Download a file from Google Cloud Storage."""
+        if not self.client or not self.bucket:
+            raise RuntimeError("Google Cloud Storage not configured. Please set up credentials.")
+
+        blob = self.bucket.blob(self.get_blob_path(file_url))
+        # Raises DataCorruption if the bytes do not match the object's CRC32C
+        with self._observe("download"):
+            return blob.download_as_bytes(checksum="crc32c", timeout=self.transfer_timeout, retry=self.retry)
 
     def delete_file(self, file_url: str) -> bool:
         """Delete a file from Google Cloud Storage."""
@@ -122,19 +414,183 @@ class StorageService:
                 logger.warning("Cannot delete file: Google Cloud Storage not configured")
                 return False
             
-            prefix = f"https://storage.googleapis.com/{self.bucket_name}/"
-            blob_path = file_url.replace(prefix, "")
-
+            blob_path = self.get_blob_path(file_url)
             blob = self.bucket.blob(blob_path)
-            blob.delete()
+            with self._observe("delete"):
+                blob.delete(timeout=self.timeout, retry=self.retry)
 
-            logger.info(f"File deleted from GCS: {blob_path}")
+            logger.info("File deleted from GCS: %s", blob_path)
             return True
 
         except Exception as e:
             logger.error(f"Failed to delete file from GCS: {str(e)}")
             return False
 
+    def delete_files(self, file_urls: List[str]) -> int:
+        """Delete a batch of files concurrently. Returns the number deleted."""
+        if not file_urls:
+            return 0
+
+        max_workers = min(settings.STORAGE_DELETE_CONCURRENCY, len(file_urls))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            deleted = sum(executor.map(self.delete_file, file_urls))
+
+        logger.info("Deleted %d of %d files from GCS", deleted, len(file_urls))
+        return deleted
+
+
+class LocalStorageService(StorageService):
+    """Filesystem stand-in for Google Cloud Storage, for development and tests.
+
+    Files live under LOCAL_STORAGE_PATH and are served, and accept signed
+    uploads, through the /storage routes at LOCAL_STORAGE_URL. Upload URLs
+    are signed with an HMAC of SECRET_KEY in place of GCS V4 signatures.
+    """
+
+    def __init__(self, root: Optional[str] = None, base_url: Optional[str] = None):
+        super().__init__()
+        self.root = Path(root or settings.LOCAL_STORAGE_PATH).resolve()
+        self.base_url = (base_url or settings.LOCAL_STORAGE_URL).rstrip("/")
+
+    @property
+    def bucket(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        return self.root
+
+    def reset_client(self) -> None:
+        pass
+
+    def get_blob_path(self, file_url: str) -> str:
+        return file_url.replace(f"{self.base_url}/", "")
+
+    def get_file_url(self, file_path: str) -> str:
+        return f"{self.base_url}/{file_path}"
+
+    def resolve_path(self, file_path: str) -> Path:
+        """Filesystem path of a blob path; refuses paths outside the storage root."""
+        path = (self.root / file_path).resolve()
+        if not path.is_relative_to(self.root) or path == self.root:
+            raise ValueError(f"Invalid storage path: {file_path}")
+        return path
+
+    @contextmanager
+    def open_for_write(self, file_path: str):
+        """Writable file that only replaces `file_path` if the block completes."""
+        path = self.resolve_path(file_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield f
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def upload_file(
+        self,
+        file_content: bytes,
+        upload_id: str,
+        original_filename: str,
+        suffix: str = "",
+        content_type: Optional[str] = None,
+        extension: Optional[str] = None,
+    ) -> str:
+        file_path = self.generate_file_path(upload_id, original_filename, suffix, extension)
+        with self.open_for_write(file_path) as f:
+            f.write(file_content)
+        logger.info("File stored locally: %s", file_path)
+        return self.get_file_url(file_path)
+
+    def upload_session_chunk(self, session_id: str, chunk_name: str, file_content: bytes) -> str:
+        file_path = f"upload-sessions/{session_id}/{chunk_name}"
+        with self.open_for_write(file_path) as f:
+            f.write(file_content)
+        return self.get_file_url(file_path)
+
+    def compose_files(
+        self,
+        file_urls: List[str],
+        upload_id: str,
+        original_filename: str,
+        content_type: Optional[str] = None,
+    ) -> str:
+        if not file_urls:
+            raise ValueError("Nothing to compose")
+
+        file_path = self.generate_file_path(upload_id, original_filename)
+        with self.open_for_write(file_path) as f:
+            for url in file_urls:
+                with open(self.resolve_path(self.get_blob_path(url)), "rb") as source:
+                    shutil.copyfileobj(source, f)
+        return self.get_file_url(file_path)
+
+    def _sign(self, file_path: str, content_type: str, max_bytes: int, expires: int) -> str:
+        message = f"PUT\n{file_path}\n{content_type}\n{max_bytes}\n{expires}".encode()
+        return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+    def generate_upload_url(
+        self,
+        file_path: str,
+        content_type: str,
+        max_bytes: int,
+        expires_seconds: int,
+    ) -> Tuple[str, dict]:
+        self.resolve_path(file_path)
+        expires = int(time.time()) + expires_seconds
+        query = urlencode({
+            "expires": expires,
+            "max_bytes": max_bytes,
+            "signature": self._sign(file_path, content_type, max_bytes, expires),
+        })
+        return f"{self.get_file_url(file_path)}?{query}", {"Content-Type": content_type}
+
+    def verify_upload_signature(
+        self,
+        file_path: str,
+        content_type: str,
+        max_bytes: int,
+        expires: int,
+        signature: str,
+    ) -> bool:
+        """Check a signed upload URL produced by generate_upload_url."""
+        if expires < time.time():
+            return False
+        expected = self._sign(file_path, content_type, max_bytes, expires)
+        return hmac.compare_digest(expected, signature)
+
+    def get_file_info(self, file_url: str) -> Optional[dict]:
+        path = self.resolve_path(self.get_blob_path(file_url))
+        if not path.is_file():
+            return None
+        return {"size": path.stat().st_size, "content_type": None}
+
+    def read_file_header(self, file_url: str, num_bytes: int) -> bytes:
+        with open(self.resolve_path(self.get_blob_path(file_url)), "rb") as f:
+            return f.read(num_bytes)
+
+    def download_file(self, file_url: str) -> bytes:
+        return self.resolve_path(self.get_blob_path(file_url)).read_bytes()
+
+    def delete_file(self, file_url: str) -> bool:
+        try:
+            self.resolve_path(self.get_blob_path(file_url)).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error(f"Failed to delete local file: {str(e)}")
+            return False
+
+
+def create_storage_service() -> StorageService:
+    """Storage backend for the configured STORAGE_TYPE"""
+    if settings.STORAGE_TYPE == "local":
+        return LocalStorageService()
+    if settings.STORAGE_TYPE == "gcs":
+        return StorageService()
+    raise ValueError(f"Unknown STORAGE_TYPE: {settings.STORAGE_TYPE}")
+
 
 # Singleton instance
-storage_service = StorageService()
+storage_service = create_storage_service()
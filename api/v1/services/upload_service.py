@@ -1,26 +1,66 @@
+import base64
+import json
+import time
 import uuid
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import List, Optional, Tuple
 
+from sqlalchemy import and_, delete, func, or_, select, update
 from sqlalchemy.orm import Session
 
-from api.v1.models.upload import ImageUpload, UploadStatus, ProcessingLog
+from api.v1.models.upload import (
+    ALLOWED_STATUS_TRANSITIONS, ImageUpload, UploadStatus, ProcessingLog,
+    ProcessingSummary
+)
 from api.v1.schemas.upload import UploadCreate, UploadUpdate
 from api.utils.logger import logger
 
 
+def variant_urls(values) -> List[str]:
+    """The storage URLs among variant column values, srcset rungs included"""
+    urls = []
+    for value in values:
+        if isinstance(value, list):
+            urls.extend(rung["url"] for rung in value)
+        elif value:
+            urls.append(value)
+    return urls
+
+
+def encode_cursor(created_at: datetime, upload_id: str) -> str:
+    """Encode a keyset position as an opaque cursor"""
+    raw = json.dumps([created_at.isoformat(), upload_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a cursor produced by encode_cursor; raises ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, upload_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(upload_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
 class UploadService:
     def __init__(self, db: Session):
         self.db = db
     
-    def create_upload(self, upload_data: UploadCreate, original_url: str) -> ImageUpload:
+    def create_upload(
+        self,
+        upload_data: UploadCreate,
+        original_url: str,
+        upload_id: Optional[str] = None
+    ) -> ImageUpload:
         """Create a new upload record"""
         upload = ImageUpload(
-            id=str(uuid.uuid4()),
+            id=upload_id or str(uuid.uuid4()),
             original_filename=upload_data.original_filename,
             original_url=original_url,
             file_size=upload_data.file_size,
             mime_type=upload_data.mime_type,
+            callback_url=upload_data.callback_url,
             status=UploadStatus.PENDING
         )
         
@@ -32,30 +72,206 @@ class UploadService:
         return upload
     
     def get_upload(self, upload_id: str) -> Optional[ImageUpload]:
-        """Get upload by ID"""
-        return self.db.query(ImageUpload).filter(ImageUpload.id == upload_id).first()
+        """Get upload by ID (deleted uploads are hidden)"""
+        return self.db.query(ImageUpload).filter(
+            ImageUpload.id == upload_id,
+            ImageUpload.deleted_at.is_(None)
+        ).first()
+    
+    def _filter_uploads(
+        self,
+        query,
+        status: Optional[str] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        mime_type: Optional[str] = None
+    ):
+        query = query.where(ImageUpload.deleted_at.is_(None))
+        if status:
+            query = query.where(ImageUpload.status == status)
+        if created_after:
+            query = query.where(ImageUpload.created_at >= created_after)
+        if created_before:
+            query = query.where(ImageUpload.created_at < created_before)
+        if mime_type:
+            query = query.where(ImageUpload.mime_type == mime_type)
+        return query
+    
+    def list_uploads(
+        self,
+        status: Optional[str] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[ImageUpload], Optional[str]]:
+        """List uploads newest first using keyset pagination over (created_at, id)
+        
+        Returns the page and the cursor for the next page (None on the last page).
+        """
+        query = self._filter_uploads(select(ImageUpload), status, created_after, created_before)
+        if cursor:
+            last_created_at, last_id = decode_cursor(cursor)
+            query = query.where(or_(
+                ImageUpload.created_at < last_created_at,
+                and_(ImageUpload.created_at == last_created_at, ImageUpload.id < last_id)
+            ))
+        
+        # Fetch one extra row to know whether another page exists
+        rows = self.db.execute(
+            query.order_by(ImageUpload.created_at.desc(), ImageUpload.id.desc()).limit(limit + 1)
+        ).scalars().all()
+        
+        page = list(rows[:limit])
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(page[-1].created_at, page[-1].id)
+        return page, next_cursor
+    
+    def scan_uploads(
+        self,
+        after: Optional[Tuple[datetime, str]] = None,
+        limit: int = 200,
+        **filters
+    ) -> List[Tuple[str, datetime]]:
+        """(id, created_at) of uploads oldest first, strictly after the keyset position `after`
+        
+        Takes the filters of _filter_uploads. Only the key columns are read,
+        so walking the whole table stays cheap.
+        """
+        query = self._filter_uploads(select(ImageUpload.id, ImageUpload.created_at), **filters)
+        if after:
+            last_created_at, last_id = after
+            query = query.where(or_(
+                ImageUpload.created_at > last_created_at,
+                and_(ImageUpload.created_at == last_created_at, ImageUpload.id > last_id)
+            ))
+        return [
+            (upload_id, created_at)
+            for upload_id, created_at in self.db.execute(
+                query.order_by(ImageUpload.created_at, ImageUpload.id).limit(limit)
+            )
+        ]
+    
+    def count_uploads(self, after: Optional[Tuple[datetime, str]] = None, **filters) -> int:
+        """Number of uploads scan_uploads would still return after `after`"""
+        query = self._filter_uploads(select(func.count()).select_from(ImageUpload), **filters)
+        if after:
+            last_created_at, last_id = after
+            query = query.where(or_(
+                ImageUpload.created_at > last_created_at,
+                and_(ImageUpload.created_at == last_created_at, ImageUpload.id > last_id)
+            ))
+        return self.db.scalar(query)
+    
+    def swap_variant_urls(self, upload_id: str, lease_id: str, values: dict) -> Optional[List[str]]:
+        """Replace a completed upload's variant columns with regenerated ones
+        
+        A compare-and-set: it only matches while the upload is completed,
+        not deleted and still leased by `lease_id`, and releases the lease
+        in the same UPDATE. updated_at moves, so cached results get a new
+        ETag. The row is locked while its current values are read, so the
+        URLs returned are exactly the ones replaced, which nothing
+        references any more. Returns None when nothing was swapped.
+        """
+        criteria = and_(
+            ImageUpload.id == upload_id,
+            ImageUpload.status == UploadStatus.COMPLETED,
+            ImageUpload.deleted_at.is_(None),
+            ImageUpload.processing_lease_id == lease_id
+        )
+        current = self.db.execute(
+            select(*(getattr(ImageUpload, column) for column in values))
+            .where(criteria)
+            .with_for_update()
+        ).first()
+        
+        swapped = current is not None and self.db.execute(
+            update(ImageUpload)
+            .where(criteria)
+            .values(
+                processing_lease_id=None,
+                processing_lease_expires_at=None,
+                updated_at=func.now(),
+                **values
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount == 1
+        self.db.commit()
+        if not swapped:
+            logger.warning(f"Regenerated variants of upload {upload_id} were not swapped in")
+            return None
+        
+        kept = set(variant_urls(values.values()))
+        return [url for url in variant_urls(current) if url not in kept]
+    
+    def tombstone_upload(self, upload_id: str) -> bool:
+        """Mark an upload as deleted; the purger removes the row and files later"""
+        result = self.db.execute(
+            update(ImageUpload)
+            .where(ImageUpload.id == upload_id, ImageUpload.deleted_at.is_(None))
+            .values(deleted_at=datetime.now(timezone.utc))
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+        
+        if result.rowcount:
+            logger.info(f"Tombstoned upload {upload_id}")
+        return result.rowcount == 1
     
     def update_upload_status(
         self, 
         upload_id: str, 
         status: str,
-        error_message: Optional[str] = None
+        error_message: Optional[str] = None,
+        commit: bool = True
     ) -> Optional[ImageUpload]:
-        """Update upload status"""
-        upload = self.get_upload(upload_id)
-        if not upload:
-            return None
+        """Update upload status
         
-        upload.status = status
-        upload.error_message = error_message
+        The transition is a single compare-and-set UPDATE ... RETURNING that
+        only matches rows in a status allowed by ALLOWED_STATUS_TRANSITIONS,
+        with timestamps set by the database. Returns None when the upload
+        does not exist or the transition is not allowed, e.g. a late
+        redelivery trying to move a completed upload back to processing.
+        With `commit=False` the change is left in the caller's transaction.
+        """
+        allowed_from = ALLOWED_STATUS_TRANSITIONS.get(status)
+        if allowed_from is None:
+            raise ValueError(f"Unknown upload status: {status}")
         
-        if status == UploadStatus.PROCESSING and not upload.processing_started_at:
-            upload.processing_started_at = datetime.now(timezone.utc)
-        elif status == UploadStatus.COMPLETED and not upload.processing_completed_at:
-            upload.processing_completed_at = datetime.now(timezone.utc)
+        values = {
+            "status": status,
+            "error_message": error_message,
+            "updated_at": func.now()
+        }
+        if status == UploadStatus.PROCESSING:
+            values["processing_started_at"] = func.coalesce(
+                ImageUpload.processing_started_at, func.now()
+            )
+        elif status == UploadStatus.COMPLETED:
+            values["processing_completed_at"] = func.coalesce(
+                ImageUpload.processing_completed_at, func.now()
+            )
         
-        upload.update(self.db)
-        logger.info(f"Updated upload {upload_id} status to {status}")
+        upload = self.db.execute(
+            update(ImageUpload)
+            .where(
+                ImageUpload.id == upload_id,
+                ImageUpload.status.in_(allowed_from),
+                ImageUpload.deleted_at.is_(None)
+            )
+            .values(**values)
+            .returning(ImageUpload)
+            .execution_options(populate_existing=True)
+        ).scalars().first()
+        if commit:
+            self.db.commit()
+        
+        if upload is None:
+            logger.warning("Rejected status change of upload %s to %s", upload_id, status)
+            return None
+        
+        logger.info("Updated upload %s status to %s", upload_id, status)
         return upload
     
     def update_processed_urls(
@@ -81,6 +297,75 @@ class UploadService:
         logger.info(f"Updated processed URLs for upload {upload_id}")
         return upload
     
+    def acquire_processing_lease(
+        self,
+        upload_id: str,
+        lease_id: str,
+        ttl_seconds: int
+    ) -> bool:
+        """Claim exclusive processing rights for an upload.
+        
+        Succeeds when no lease is held, the held lease has expired, or the
+        caller already holds it. Done as a single conditional UPDATE so two
+        deliveries of the same task cannot both win.
+        """
+        now = datetime.now(timezone.utc)
+        result = self.db.execute(
+            update(ImageUpload)
+            .where(
+                ImageUpload.id == upload_id,
+                or_(
+                    ImageUpload.processing_lease_id.is_(None),
+                    ImageUpload.processing_lease_id == lease_id,
+                    ImageUpload.processing_lease_expires_at < now
+                )
+            )
+            .values(
+                processing_lease_id=lease_id,
+                processing_lease_expires_at=now + timedelta(seconds=ttl_seconds)
+            )
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+        return result.rowcount == 1
+    
+    def release_processing_lease(self, upload_id: str, lease_id: str, commit: bool = True) -> bool:
+        """Release a processing lease held by the caller"""
+        result = self.db.execute(
+            update(ImageUpload)
+            .where(
+                ImageUpload.id == upload_id,
+                ImageUpload.processing_lease_id == lease_id
+            )
+            .values(processing_lease_id=None, processing_lease_expires_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        if commit:
+            self.db.commit()
+        return result.rowcount == 1
+    
+    def count_in_flight(self) -> int:
+        """Uploads currently held by a worker (processing with a live lease)"""
+        return self.db.scalar(
+            select(func.count())
+            .select_from(ImageUpload)
+            .where(
+                ImageUpload.status == UploadStatus.PROCESSING,
+                ImageUpload.processing_lease_expires_at > datetime.now(timezone.utc)
+            )
+        )
+    
+    def update_image_metadata(self, upload_id: str, **values) -> bool:
+        """Set metadata columns (e.g. phash, width, height) in a single UPDATE"""
+        result = self.db.execute(
+            update(ImageUpload)
+            .where(ImageUpload.id == upload_id)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+        return result.rowcount == 1
+    
     def add_processing_log(
         self,
         upload_id: str,
@@ -102,23 +387,149 @@ class UploadService:
         self.db.commit()
         self.db.refresh(log)
         
-        logger.info(f"Added processing log for upload {upload_id}, step: {step}")
+        logger.info("Added processing log for upload %s, step: %s", upload_id, step)
         return log
     
-    def cleanup_failed_uploads(self, hours_old: int = 24) -> int:
-        """Clean up failed uploads older than specified hours"""
-        cutoff_time = datetime.now(timezone.utc) - timedelta(hours=hours_old)
+    def record_processing_summary(
+        self,
+        upload: ImageUpload,
+        status: str,
+        total_duration_ms: Optional[int],
+        stage_durations: dict
+    ) -> ProcessingSummary:
+        """Create or replace the long-lived processing summary for an upload"""
+        summary = self.db.merge(ProcessingSummary(
+            upload_id=upload.id,
+            status=status,
+            mime_type=upload.mime_type,
+            file_size=upload.file_size,
+            total_duration_ms=total_duration_ms,
+            stage_durations=stage_durations
+        ))
+        self.db.commit()
+        return summary
+    
+    def cleanup_failed_uploads(
+        self,
+        hours_old: int = 24,
+        pending_hours_old: Optional[int] = None,
+        chunk_size: int = 200,
+        time_budget_seconds: Optional[float] = None,
+        storage=None
+    ) -> int:
+        """Clean up failed uploads older than specified hours
         
-        # Find failed uploads
-        failed_uploads = self.db.query(ImageUpload).filter(
+        When `pending_hours_old` is given, uploads stuck in pending for that
+        long (their task was lost) are cleaned up too; that is measured from
+        updated_at, when the upload last changed.
+        Pass `storage` to also delete the stored files.
+        """
+        now = datetime.now(timezone.utc)
+        criteria = and_(
             ImageUpload.status == UploadStatus.FAILED,
-            ImageUpload.created_at < cutoff_time
-        ).all()
+            ImageUpload.created_at < now - timedelta(hours=hours_old)
+        )
+        if pending_hours_old is not None:
+            criteria = or_(
+                criteria,
+                and_(
+                    ImageUpload.status == UploadStatus.PENDING,
+                    ImageUpload.updated_at < now - timedelta(hours=pending_hours_old)
+                )
+            )
+        
+        purged = self._purge_uploads(criteria, chunk_size, time_budget_seconds, storage)
+        logger.info(f"Cleaned up {purged} failed uploads")
+        return purged
+    
+    def purge_deleted_uploads(
+        self,
+        chunk_size: int = 200,
+        time_budget_seconds: Optional[float] = None,
+        storage=None
+    ) -> int:
+        """Hard-delete tombstoned uploads and their files
         
-        # Delete them
-        for upload in failed_uploads:
-            upload.delete(self.db)
+        Uploads still held by a live processing lease are left for a later
+        run so a worker cannot write files after they have been purged.
+        """
+        now = datetime.now(timezone.utc)
+        criteria = and_(
+            ImageUpload.deleted_at.is_not(None),
+            or_(
+                ImageUpload.processing_lease_id.is_(None),
+                ImageUpload.processing_lease_expires_at < now
+            )
+        )
         
-        self.db.commit()
-        logger.info(f"Cleaned up {len(failed_uploads)} failed uploads")
-        return len(failed_uploads)
\ No newline at end of file
+        purged = self._purge_uploads(criteria, chunk_size, time_budget_seconds, storage)
+        logger.info(f"Purged {purged} deleted uploads")
+        return purged
+    
+    def _purge_uploads(
+        self,
+        criteria,
+        chunk_size: int,
+        time_budget_seconds: Optional[float],
+        storage
+    ) -> int:
+        """Delete matching uploads (and optionally their files) in keyset-ordered chunks
+        
+        Each chunk is committed on its own, and the walk stops between chunks
+        once the time budget is spent; the next run picks up where it left off.
+        """
+        deadline = time.monotonic() + time_budget_seconds if time_budget_seconds else None
+        purged = 0
+        last_key = None
+        
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.info(f"Purge time budget exhausted after {purged} uploads")
+                break
+            
+            query = select(
+                ImageUpload.id,
+                ImageUpload.created_at,
+                ImageUpload.original_url,
+                ImageUpload.thumbnail_url,
+                ImageUpload.resized_url,
+                ImageUpload.compressed_url,
+                ImageUpload.srcset
+            ).where(criteria)
+            if last_key is not None:
+                last_created_at, last_id = last_key
+                query = query.where(or_(
+                    ImageUpload.created_at > last_created_at,
+                    and_(ImageUpload.created_at == last_created_at, ImageUpload.id > last_id)
+                ))
+            rows = self.db.execute(
+                query.order_by(ImageUpload.created_at, ImageUpload.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            
+            if storage is not None:
+                urls = [url for row in rows for url in row[2:6] if url]
+                urls.extend(rung["url"] for row in rows for rung in row.srcset or [])
+                storage.delete_files(urls)
+            
+            ids = [row.id for row in rows]
+            # Logs first: bulk deletes bypass the ORM cascade
+            self.db.execute(
+                delete(ProcessingLog)
+                .where(ProcessingLog.upload_id.in_(ids))
+                .execution_options(synchronize_session=False)
+            )
+            self.db.execute(
+                delete(ImageUpload)
+                .where(ImageUpload.id.in_(ids))
+                .execution_options(synchronize_session="fetch")
+            )
+            self.db.commit()
+            
+            purged += len(ids)
+            last_key = (rows[-1].created_at, rows[-1].id)
+            if len(rows) < chunk_size:
+                break
+        
+        return purged
@@ -0,0 +1,257 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from api.v1.models.upload import ImageUpload, UploadSession, UploadSessionStatus
+from api.v1.schemas.upload import UploadCreate
+from api.v1.services.upload_service import UploadService
+from api.utils.config import settings
+from api.utils.logger import logger
+
+
+class UploadOffsetMismatchError(Exception):
+    """Raised when a chunk does not start where the session left off"""
+
+    def __init__(self, current_offset: int):
+        super().__init__(f"Chunk offset does not match the session offset {current_offset}")
+        self.current_offset = current_offset
+
+
+class UploadSessionStateError(Exception):
+    """Raised when a session cannot take the requested step in its current state"""
+
+
+def check_chunk_size(session: UploadSession, offset: int, size: int) -> None:
+    """Raise ValueError unless a chunk of `size` bytes at `offset` fits the session
+
+    Every chunk but the last must be at least UPLOAD_CHUNK_MIN_BYTES, which
+    bounds the number of chunk objects a session can create and compose.
+    """
+    if size == 0:
+        raise ValueError("Chunk is empty")
+    if offset + size > session.total_size:
+        raise ValueError(f"Chunk runs past the declared size of {session.total_size} bytes")
+    min_bytes = settings.UPLOAD_CHUNK_MIN_BYTES
+    if size < min_bytes and offset + size < session.total_size:
+        raise ValueError(f"Chunk too small. Every chunk but the last must be at least {min_bytes} bytes")
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes even for timezone-aware columns
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class UploadSessionService:
+    """Resumable uploads: sessions, chunk appends and finalize.
+
+    Every accepted chunk is its own storage object, recorded on the session
+    with a compare-and-set on received_bytes, so a chunk resent after a lost
+    response is rejected with the current offset instead of being appended
+    twice. Finalize composes the chunks into the original in storage and
+    creates the upload record the normal processing path starts from.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def create_session(
+        self,
+        original_filename: str,
+        mime_type: str,
+        total_size: int,
+        callback_url: Optional[str] = None
+    ) -> UploadSession:
+        """Open a new session expecting `total_size` bytes"""
+        session = UploadSession(
+            id=str(uuid.uuid4()),
+            original_filename=original_filename,
+            mime_type=mime_type,
+            total_size=total_size,
+            received_bytes=0,
+            chunk_urls=[],
+            callback_url=callback_url,
+            status=UploadSessionStatus.ACTIVE,
+            expires_at=_utcnow() + timedelta(seconds=settings.UPLOAD_SESSION_TTL_SECONDS)
+        )
+        session.add(self.db)
+        self.db.commit()
+        self.db.refresh(session)
+
+        logger.info(f"Created upload session {session.id} for {total_size} bytes")
+        return session
+
+    def get_session(self, session_id: str) -> Optional[UploadSession]:
+        """Get a session by ID (expired sessions are hidden)"""
+        session = self.db.get(UploadSession, session_id, populate_existing=True)
+        if session is None or _as_utc(session.expires_at) <= _utcnow():
+            return None
+        return session
+
+    def append_chunk(self, session: UploadSession, offset: int, data: bytes, storage) -> UploadSession:
+        """Store `data` as the bytes of the session starting at `offset`
+
+        Raises UploadOffsetMismatchError when `offset` is not the session's
+        current offset (including when another request appended first), and
+        ValueError when the chunk is empty, runs past total_size, or is
+        smaller than UPLOAD_CHUNK_MIN_BYTES without being the last one.
+        """
+        if session.status != UploadSessionStatus.ACTIVE:
+            raise UploadSessionStateError(f"Upload session is {session.status}")
+        if offset != session.received_bytes:
+            raise UploadOffsetMismatchError(session.received_bytes)
+        check_chunk_size(session, offset, len(data))
+
+        # Unique name, so a losing concurrent append never overwrites the winner's chunk
+        chunk_url = storage.upload_session_chunk(
+            session.id, f"{offset:012d}-{uuid.uuid4().hex[:8]}", data
+        )
+
+        result = self.db.execute(
+            update(UploadSession)
+            .where(
+                UploadSession.id == session.id,
+                UploadSession.status == UploadSessionStatus.ACTIVE,
+                UploadSession.received_bytes == offset
+            )
+            .values(
+                received_bytes=offset + len(data),
+                chunk_urls=list(session.chunk_urls or []) + [chunk_url],
+                expires_at=_utcnow() + timedelta(seconds=settings.UPLOAD_SESSION_TTL_SECONDS)
+            )
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+
+        if result.rowcount != 1:
+            storage.delete_file(chunk_url)
+            current = self.db.get(UploadSession, session.id, populate_existing=True)
+            raise UploadOffsetMismatchError(current.received_bytes if current else offset)
+
+        self.db.refresh(session)
+        return session
+
+    def finalize(self, session: UploadSession, storage) -> Tuple[ImageUpload, bool]:
+        """Assemble the original and create its upload record
+
+        Returns the upload and whether this call created it. Finalizing a
+        session that is already finalized returns its upload again, so a
+        client may safely retry after a lost response.
+
+        The claim on the session is timestamped. A claim older than
+        UPLOAD_SESSION_FINALIZE_TIMEOUT_SECONDS belongs to a call that died
+        mid-compose and is taken over; the upload id is fixed by the first
+        claim, so the takeover composes to the same target and reuses the
+        upload record if the dead call got as far as creating it.
+        """
+        if session.status == UploadSessionStatus.FINALIZED:
+            upload = self.db.get(ImageUpload, session.upload_id)
+            if upload is None:
+                raise UploadSessionStateError("Upload of this session no longer exists")
+            return upload, False
+        if session.received_bytes != session.total_size:
+            raise UploadSessionStateError(
+                f"Upload session has {session.received_bytes} of {session.total_size} bytes"
+            )
+
+        # Claim the session so concurrent finalize calls do not compose twice
+        claimed_at = _utcnow()
+        stale_before = claimed_at - timedelta(seconds=settings.UPLOAD_SESSION_FINALIZE_TIMEOUT_SECONDS)
+        result = self.db.execute(
+            update(UploadSession)
+            .where(
+                UploadSession.id == session.id,
+                or_(
+                    UploadSession.status == UploadSessionStatus.ACTIVE,
+                    and_(
+                        UploadSession.status == UploadSessionStatus.FINALIZING,
+                        UploadSession.finalize_claimed_at < stale_before
+                    )
+                )
+            )
+            .values(
+                status=UploadSessionStatus.FINALIZING,
+                finalize_claimed_at=claimed_at,
+                upload_id=func.coalesce(UploadSession.upload_id, str(uuid.uuid4()))
+            )
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+        if result.rowcount != 1:
+            raise UploadSessionStateError("Upload session is already being finalized")
+        self.db.refresh(session)
+        # Only while this call still holds the claim
+        held = and_(UploadSession.id == session.id, UploadSession.finalize_claimed_at == claimed_at)
+
+        try:
+            upload_service = UploadService(self.db)
+            original_url = storage.compose_files(
+                session.chunk_urls, session.upload_id, session.original_filename, session.mime_type
+            )
+            upload = self.db.get(ImageUpload, session.upload_id) or upload_service.create_upload(
+                UploadCreate(
+                    original_filename=session.original_filename,
+                    file_size=session.total_size,
+                    mime_type=session.mime_type,
+                    callback_url=session.callback_url
+                ),
+                original_url,
+                upload_id=session.upload_id
+            )
+        except Exception:
+            self.db.rollback()
+            self.db.execute(
+                update(UploadSession)
+                .where(held)
+                .values(status=UploadSessionStatus.ACTIVE, finalize_claimed_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            self.db.commit()
+            raise
+
+        chunk_urls = list(session.chunk_urls)
+        self.db.execute(
+            update(UploadSession)
+            .where(held)
+            .values(status=UploadSessionStatus.FINALIZED, chunk_urls=[])
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+        self.db.refresh(session)
+        if session.status != UploadSessionStatus.FINALIZED:
+            # Taken over as stale meanwhile; the newer claim finishes the session
+            return upload, True
+
+        # The composed original is a separate object; the chunks are no longer needed
+        storage.delete_files(chunk_urls)
+
+        logger.info(f"Finalized upload session {session.id} into upload {upload.id}")
+        return upload, True
+
+    def expire_sessions(self, chunk_size: int, storage) -> int:
+        """Delete up to `chunk_size` expired sessions and their chunks; returns the number removed"""
+        sessions = self.db.scalars(
+            select(UploadSession)
+            .where(UploadSession.expires_at < _utcnow())
+            .order_by(UploadSession.expires_at)
+            .limit(chunk_size)
+        ).all()
+        if not sessions:
+            return 0
+
+        storage.delete_files([url for session in sessions for url in (session.chunk_urls or [])])
+        self.db.execute(
+            delete(UploadSession)
+            .where(UploadSession.id.in_([session.id for session in sessions]))
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+
+        logger.info(f"Expired {len(sessions)} upload sessions")
+        return len(sessions)
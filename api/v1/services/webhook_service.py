@@ -0,0 +1,375 @@
+import hashlib
+import hmac
+import ipaddress
+import json
+import random
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import delete, select
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+from sqlalchemy.orm import Session
+
+from api.v1.models.upload import ImageUpload, UploadStatus
+from api.v1.models.webhook import WebhookDelivery, WebhookDeliveryStatus
+from api.utils.config import settings
+from api.utils.logger import logger
+
+SIGNATURE_HEADER = "X-Webhook-Signature"
+
+EVENTS = {
+    UploadStatus.COMPLETED: "upload.completed",
+    UploadStatus.FAILED: "upload.failed",
+}
+
+
+def sign_payload(body: bytes, timestamp: int, secret: str) -> str:
+    """Signature header value: HMAC-SHA256 over "<timestamp>.<body>"
+
+    Receivers recompute the HMAC with the shared secret and compare in
+    constant time. Rejecting stale timestamps stops replays.
+    """
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def compute_webhook_retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter after the given number of failed attempts"""
+    delay = min(settings.WEBHOOK_RETRY_BACKOFF_MAX,
+                settings.WEBHOOK_RETRY_BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def is_public_address(address: str) -> bool:
+    """Whether webhooks may connect to this IP: not loopback, private, link-local, reserved or multicast"""
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_callback_host(url: str) -> Optional[str]:
+    """Resolve a callback URL's host; returns why it is refused, or None if every address is public"""
+    host = urlparse(url).hostname
+    if not host:
+        return "has no host"
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError):
+        return f"host {host} does not resolve"
+    for address in sorted(addresses):
+        if not is_public_address(address):
+            return f"host {host} resolves to non-public address {address}"
+    return None
+
+
+def _check_peer(connection, sock) -> None:
+    """Refuse a connection that landed on a non-public address
+
+    Checking the connected socket rather than an earlier lookup also
+    catches a host re-resolved to an internal address (DNS rebinding).
+    """
+    address = sock.getpeername()[0]
+    if not is_public_address(address):
+        sock.close()
+        raise NewConnectionError(connection, f"{connection.host} resolves to non-public address {address}")
+
+
+class PublicHTTPConnection(HTTPConnection):
+    def _new_conn(self):
+        sock = super()._new_conn()
+        _check_peer(self, sock)
+        return sock
+
+
+class PublicHTTPSConnection(HTTPSConnection):
+    def _new_conn(self):
+        sock = super()._new_conn()
+        _check_peer(self, sock)
+        return sock
+
+
+class PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = PublicHTTPConnection
+
+
+class PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = PublicHTTPSConnection
+
+
+class PublicAddressAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections may only reach public addresses"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": PublicHTTPConnectionPool,
+            "https": PublicHTTPSConnectionPool,
+        }
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class WebhookService:
+    """Database side of webhooks: the delivery outbox"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def enqueue(self, upload: ImageUpload, commit: bool = True) -> Optional[WebhookDelivery]:
+        """Queue the completion or failure event of a finished upload, if it has a callback
+
+        Pass `commit=False` to insert the delivery in the transaction that
+        changes the upload's status, so one is never stored without the other.
+        """
+        event = EVENTS.get(upload.status)
+        if not upload.callback_url or event is None:
+            return None
+
+        now = _utcnow()
+        payload = {
+            "event": event,
+            "upload_id": upload.id,
+            "status": upload.status,
+            "error_message": upload.error_message,
+            "original_url": upload.original_url,
+            "thumbnail_url": upload.thumbnail_url,
+            "resized_url": upload.resized_url,
+            "compressed_url": upload.compressed_url,
+            "srcset": upload.srcset or [],
+            "occurred_at": now.isoformat(),
+        }
+        delivery = WebhookDelivery(
+            id=str(uuid.uuid4()),
+            upload_id=upload.id,
+            event=event,
+            url=upload.callback_url,
+            payload=payload,
+            status=WebhookDeliveryStatus.PENDING,
+            attempts=0,
+            next_attempt_at=now
+        )
+        delivery.add(self.db)
+        if commit:
+            self.db.commit()
+
+        logger.info(f"Queued {event} webhook for upload {upload.id}")
+        return delivery
+
+    def claim_due(self, limit: int, lease_seconds: float) -> List[dict]:
+        """Take up to `limit` due deliveries for this dispatcher
+
+        Claimed rows have next_attempt_at pushed past the delivery timeout,
+        so concurrent dispatchers (and overlapping beat runs) skip them.
+        In Postgres, SKIP LOCKED keeps claimers from waiting on each other.
+        Returns plain snapshots, which are safe to hand to delivery threads.
+        """
+        now = _utcnow()
+        rows = self.db.scalars(
+            select(WebhookDelivery)
+            .where(
+                WebhookDelivery.status == WebhookDeliveryStatus.PENDING,
+                WebhookDelivery.next_attempt_at <= now
+            )
+            .order_by(WebhookDelivery.next_attempt_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ).all()
+
+        claimed = []
+        for row in rows:
+            row.next_attempt_at = now + timedelta(seconds=lease_seconds)
+            claimed.append({
+                "id": row.id,
+                "upload_id": row.upload_id,
+                "event": row.event,
+                "url": row.url,
+                "payload": row.payload,
+                "attempts": row.attempts,
+            })
+        self.db.commit()
+        return claimed
+
+    def record_results(
+        self,
+        outcomes: List[Tuple[str, bool, Optional[int], Optional[str]]],
+        max_attempts: int
+    ) -> dict:
+        """Store the outcome of a batch of attempts in one transaction
+
+        `outcomes` holds (delivery id, delivered, response status, error).
+        Returns the new status of each delivery by id.
+        """
+        deliveries = {
+            delivery.id: delivery
+            for delivery in self.db.scalars(
+                select(WebhookDelivery).where(WebhookDelivery.id.in_([outcome[0] for outcome in outcomes]))
+            )
+        }
+
+        now = _utcnow()
+        statuses = {}
+        for delivery_id, ok, response_status, error in outcomes:
+            delivery = deliveries.get(delivery_id)
+            if delivery is None:
+                continue
+            delivery.attempts += 1
+            delivery.last_response_status = response_status
+            if ok:
+                delivery.status = WebhookDeliveryStatus.DELIVERED
+                delivery.delivered_at = now
+                delivery.last_error = None
+            elif delivery.attempts >= max_attempts:
+                delivery.status = WebhookDeliveryStatus.DEAD
+                delivery.last_error = error
+                logger.error(
+                    f"Webhook {delivery.id} for upload {delivery.upload_id} moved to dead letter "
+                    f"after {delivery.attempts} attempts: {error}"
+                )
+            else:
+                delivery.last_error = error
+                delivery.next_attempt_at = now + timedelta(
+                    seconds=compute_webhook_retry_delay(delivery.attempts)
+                )
+            statuses[delivery_id] = delivery.status
+        self.db.commit()
+        return statuses
+
+    def requeue_dead(self, delivery_id: str) -> bool:
+        """Send a dead-lettered delivery again, with a fresh attempt budget"""
+        delivery = self.db.get(WebhookDelivery, delivery_id)
+        if delivery is None or delivery.status != WebhookDeliveryStatus.DEAD:
+            return False
+        delivery.status = WebhookDeliveryStatus.PENDING
+        delivery.attempts = 0
+        delivery.next_attempt_at = _utcnow()
+        self.db.commit()
+        return True
+
+    def prune_delivered(self, older_than_days: int) -> int:
+        """Delete delivered rows past retention; dead letters are kept"""
+        cutoff = _utcnow() - timedelta(days=older_than_days)
+        result = self.db.execute(
+            delete(WebhookDelivery)
+            .where(
+                WebhookDelivery.status == WebhookDeliveryStatus.DELIVERED,
+                WebhookDelivery.delivered_at < cutoff
+            )
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+        return result.rowcount
+
+
+class WebhookDispatcher:
+    """Deliver due webhook events over pooled HTTP connections.
+
+    One requests.Session is shared by a bounded thread pool, and its
+    connection pool is sized to match, so concurrent deliveries to the same
+    receiver reuse keep-alive connections. Redirects are not followed, and
+    unless `allow_private_hosts` is set, connections to loopback, private
+    and other internal addresses are refused when they are opened.
+    """
+
+    def __init__(
+        self,
+        secret: str,
+        concurrency: int,
+        timeout: float,
+        session: Optional[requests.Session] = None,
+        allow_private_hosts: bool = False
+    ):
+        self.secret = secret
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        adapter_class = HTTPAdapter if allow_private_hosts else PublicAddressAdapter
+        adapter = adapter_class(pool_connections=concurrency, pool_maxsize=concurrency, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="webhook")
+
+    def send(self, delivery: dict) -> Tuple[bool, Optional[int], Optional[str]]:
+        """POST one event; returns (delivered, response status, error)"""
+        body = json.dumps(delivery["payload"], separators=(",", ":"), default=str).encode()
+        headers = {
+            "Content-Type": "application/json",
+            "User-Agent": "image-upload-service-webhooks",
+            "X-Webhook-Id": delivery["id"],
+            "X-Webhook-Event": delivery["event"],
+            SIGNATURE_HEADER: sign_payload(body, int(time.time()), self.secret),
+        }
+        try:
+            response = self.session.post(
+                delivery["url"], data=body, headers=headers,
+                timeout=self.timeout, allow_redirects=False
+            )
+        except requests.RequestException as e:
+            return False, None, f"{type(e).__name__}: {str(e)}"
+
+        # Drain the body so the connection goes back to the pool
+        response.content
+        if 200 <= response.status_code < 300:
+            return True, response.status_code, None
+        return False, response.status_code, f"HTTP {response.status_code}"
+
+    def deliver_due(
+        self,
+        db: Session,
+        batch_size: int,
+        max_attempts: int,
+        time_budget_seconds: Optional[float] = None
+    ) -> dict:
+        """Deliver due events batch by batch until none are left or the budget is spent"""
+        webhook_service = WebhookService(db)
+        deadline = time.monotonic() + time_budget_seconds if time_budget_seconds else None
+        counts = {"delivered": 0, "retrying": 0, "dead": 0}
+
+        while deadline is None or time.monotonic() < deadline:
+            batch = webhook_service.claim_due(batch_size, lease_seconds=self.timeout + 30)
+            if not batch:
+                break
+
+            results = self._executor.map(self.send, batch)
+            statuses = webhook_service.record_results(
+                [(delivery["id"], *result) for delivery, result in zip(batch, results)],
+                max_attempts
+            )
+            for status in statuses.values():
+                if status == WebhookDeliveryStatus.DELIVERED:
+                    counts["delivered"] += 1
+                elif status == WebhookDeliveryStatus.DEAD:
+                    counts["dead"] += 1
+                else:
+                    counts["retrying"] += 1
+
+            if len(batch) < batch_size:
+                break
+
+        return counts
+
+
+_dispatcher: Optional[WebhookDispatcher] = None
+
+
+def get_webhook_dispatcher() -> WebhookDispatcher:
+    """Per-process dispatcher, created on first use (after any fork)"""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = WebhookDispatcher(
+            secret=settings.SECRET_KEY,
+            concurrency=settings.WEBHOOK_CONCURRENCY,
+            timeout=settings.WEBHOOK_TIMEOUT_SECONDS,
+            allow_private_hosts=settings.WEBHOOK_ALLOW_PRIVATE_HOSTS
+        )
+    return _dispatcher
@@ -0,0 +1,321 @@
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+
+from api.v1.models.upload import UploadStatus
+from api.v1.services.upload_service import UploadService
+from api.v1.workers.tasks import VARIANTS, db_session
+from api.utils.config import settings
+from api.utils.logger import logger
+
+# Regenerate variants of existing uploads, e.g. after adding a variant or
+# changing how one is rendered:
+#
+#   python -m api.v1.workers.backfill --created-after 2026-01-01 \
+#       --variants thumbnail --checkpoint backfill.json
+#
+# Completed uploads are walked oldest first by keyset over (created_at, id)
+# and enqueued for regenerate_variants on BACKFILL_QUEUE at a throttled rate.
+# The uploads stay completed and keep serving their current variants until
+# the new ones are swapped in. Progress is written to the checkpoint file
+# after every batch, so an interrupted run picks up where it stopped when
+# started again with the same arguments.
+
+
+class BackfillError(Exception):
+    """The backfill cannot start, e.g. its checkpoint belongs to another run"""
+
+
+def parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    """ISO 8601 date or datetime; naive values are taken as UTC"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class Checkpoint:
+    """JSON file holding a backfill's progress, replaced atomically on each save"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Optional[dict]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state: dict) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class Backfill:
+    """Walk the completed uploads matching `filters` and enqueue each one for regeneration.
+
+    `filters` are the string forms of created_after, created_before and
+    mime_type; together with `variants` they identify the run, and a
+    checkpoint written for different ones is refused. `enqueue` is called
+    with each upload id, the variants and the run's generation, at most
+    `rate` times per second; while `queue_depth()` reports
+    `max_queue_depth` or more waiting tasks, the next batch is held back.
+
+    The generation tags the paths of the new objects and is kept in the
+    checkpoint, so a resumed run reuses it. A batch's ids are checkpointed
+    as in flight, together with the position after them, before they are
+    enqueued. If the run dies before enqueueing all of them, the next run
+    enqueues the whole batch again; regenerate_variants skips an upload
+    that already carries the generation, so a duplicate is harmless.
+    """
+
+    def __init__(
+        self,
+        filters: dict,
+        enqueue: Callable[[str, List[str], str], None],
+        variants: Optional[List[str]] = None,
+        rate: float = 0,
+        batch_size: int = 200,
+        checkpoint: Optional[Checkpoint] = None,
+        queue_depth: Optional[Callable[[], int]] = None,
+        max_queue_depth: int = 0,
+        dry_run: bool = False,
+        report_interval: float = 10.0,
+        report: Callable[[str], None] = print,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        unknown = set(variants or ()) - set(VARIANTS)
+        if unknown:
+            raise BackfillError(f"Unknown variants: {', '.join(sorted(unknown))}")
+        self.filters = filters
+        self.variants = [variant for variant in VARIANTS if variant in (variants or VARIANTS)]
+        self.enqueue = enqueue
+        self.rate = rate
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.queue_depth = queue_depth
+        self.max_queue_depth = max_queue_depth
+        self.dry_run = dry_run
+        self.report_interval = report_interval
+        self.report = report
+        self.clock = clock
+        self.sleep = sleep
+        self._next_enqueue_at = 0.0
+
+    def _query_filters(self) -> dict:
+        return {
+            # Only completed uploads have variants to replace
+            "status": UploadStatus.COMPLETED,
+            "created_after": parse_datetime(self.filters.get("created_after")),
+            "created_before": parse_datetime(self.filters.get("created_before")),
+            "mime_type": self.filters.get("mime_type"),
+        }
+
+    def _load_state(self) -> dict:
+        state = self.checkpoint.load() if self.checkpoint else None
+        if state is None:
+            return {
+                "filters": self.filters,
+                "variants": self.variants,
+                "generation": uuid.uuid4().hex[:12],
+                "position": None,
+                "in_flight": [],
+                "scanned": 0,
+                "enqueued": 0,
+                "done": False,
+            }
+        if state["filters"] != self.filters or state["variants"] != self.variants:
+            raise BackfillError(
+                f"Checkpoint {self.checkpoint.path} belongs to a backfill with other filters or variants; "
+                "remove it to start over"
+            )
+        return state
+
+    def _save_state(self, state: dict) -> None:
+        if self.checkpoint and not self.dry_run:
+            state["updated_at"] = datetime.now(timezone.utc).isoformat()
+            self.checkpoint.save(state)
+
+    def _throttle(self) -> None:
+        if self.rate <= 0:
+            return
+        now = self.clock()
+        if self._next_enqueue_at > now:
+            self.sleep(self._next_enqueue_at - now)
+            now = self._next_enqueue_at
+        self._next_enqueue_at = now + 1 / self.rate
+
+    def _wait_for_queue(self) -> None:
+        if not self.queue_depth or self.max_queue_depth <= 0:
+            return
+        while self.queue_depth() >= self.max_queue_depth:
+            self.sleep(1)
+
+    def _enqueue_all(self, upload_ids: List[str], generation: str) -> None:
+        for upload_id in upload_ids:
+            self._throttle()
+            self.enqueue(upload_id, self.variants, generation)
+
+    def _recover(self, state: dict) -> None:
+        """Enqueue again the batch an interrupted run may not have finished enqueueing"""
+        if not state["in_flight"]:
+            return
+        self.report(f"Re-enqueueing {len(state['in_flight'])} uploads left in flight by the previous run")
+        self._enqueue_all(state["in_flight"], state["generation"])
+        state["in_flight"] = []
+        self._save_state(state)
+
+    def run(self, limit: Optional[int] = None) -> dict:
+        """Enqueue up to `limit` uploads (all of them by default); returns the run's counters"""
+        state = self._load_state()
+        if not self.dry_run:
+            self._recover(state)
+
+        position = state["position"]
+        after = (parse_datetime(position[0]), position[1]) if position else None
+        query_filters = self._query_filters()
+        with db_session() as db:
+            total = UploadService(db).count_uploads(after=after, **query_filters)
+        if limit is not None:
+            total = min(total, limit)
+        self.report(f"Backfill of {total} uploads ({', '.join(self.variants)}) started")
+
+        started = last_report = self.clock()
+        scanned = enqueued = 0
+        while limit is None or scanned < limit:
+            self._wait_for_queue()
+            batch_size = self.batch_size if limit is None else min(self.batch_size, limit - scanned)
+            with db_session() as db:
+                rows = UploadService(db).scan_uploads(after=after, limit=batch_size, **query_filters)
+            if not rows:
+                state["done"] = True
+                break
+
+            upload_ids = [upload_id for upload_id, _ in rows]
+            last_id, last_created_at = rows[-1]
+            after = (last_created_at, last_id)
+            # The batch is the in-flight part of the new position
+            state.update(position=[last_created_at.isoformat(), last_id], in_flight=upload_ids)
+            if not self.dry_run:
+                self._save_state(state)
+                self._enqueue_all(upload_ids, state["generation"])
+
+            scanned += len(rows)
+            enqueued += len(upload_ids)
+            state.update(
+                in_flight=[],
+                scanned=state["scanned"] + len(rows),
+                enqueued=state["enqueued"] + len(upload_ids),
+            )
+            self._save_state(state)
+
+            now = self.clock()
+            if now - last_report >= self.report_interval:
+                last_report = now
+                self.report(self._progress(scanned, enqueued, total, now - started))
+
+        self._save_state(state)
+        elapsed = self.clock() - started
+        self.report(self._progress(scanned, enqueued, total, elapsed) + (" - done" if state["done"] else ""))
+        return {
+            "scanned": scanned,
+            "enqueued": enqueued,
+            "done": state["done"],
+            "elapsed_seconds": round(elapsed, 3),
+        }
+
+    @staticmethod
+    def _progress(scanned: int, enqueued: int, total: int, elapsed: float) -> str:
+        throughput = scanned / elapsed if elapsed > 0 else 0.0
+        remaining = max(total - scanned, 0)
+        eta = format_duration(remaining / throughput) if throughput > 0 else "unknown"
+        percent = scanned / total if total else 1.0
+        return (
+            f"{scanned}/{total} uploads scanned ({percent:.1%}), {enqueued} enqueued, "
+            f"{throughput:.1f} uploads/s, ETA {eta}"
+        )
+
+
+def enqueue_on_backfill_queue(upload_id: str, variants: List[str], generation: str) -> None:
+    from api.v1.workers.celery_app import regenerate_variants_task
+
+    regenerate_variants_task.apply_async(args=[upload_id, variants, generation], queue=settings.BACKFILL_QUEUE)
+
+
+def backfill_queue_depth() -> int:
+    import redis
+
+    client = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=5, socket_connect_timeout=5)
+    # The Redis transport keeps each queue as a list named after it
+    return client.llen(settings.BACKFILL_QUEUE)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m api.v1.workers.backfill",
+        description="Regenerate variants of completed uploads on the low-priority backfill queue."
+    )
+    parser.add_argument("--created-after", help="ISO date or datetime (inclusive, UTC unless given)")
+    parser.add_argument("--created-before", help="ISO date or datetime (exclusive, UTC unless given)")
+    parser.add_argument("--mime-type", help="e.g. image/png")
+    parser.add_argument("--variants", help=f"comma-separated subset of {','.join(VARIANTS)} (default: all)")
+    parser.add_argument("--rate", type=float, default=settings.BACKFILL_RATE_PER_SECOND,
+                        help="uploads enqueued per second (0 for no limit)")
+    parser.add_argument("--batch-size", type=int, default=settings.BACKFILL_BATCH_SIZE)
+    parser.add_argument("--max-queue-depth", type=int, default=settings.BACKFILL_MAX_QUEUE_DEPTH,
+                        help="pause while this many backfill tasks wait in the broker (0 to never pause)")
+    parser.add_argument("--limit", type=int, help="stop after this many uploads; rerun to continue")
+    parser.add_argument("--checkpoint", help="progress file; rerunning with it resumes the backfill")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be regenerated without changing anything")
+    args = parser.parse_args(argv)
+
+    try:
+        filters = {
+            "created_after": args.created_after,
+            "created_before": args.created_before,
+            "mime_type": args.mime_type,
+        }
+        # Fail on a malformed date before anything is touched
+        parse_datetime(args.created_after)
+        parse_datetime(args.created_before)
+        backfill = Backfill(
+            filters,
+            enqueue=enqueue_on_backfill_queue,
+            variants=args.variants.split(",") if args.variants else None,
+            rate=args.rate,
+            batch_size=args.batch_size,
+            checkpoint=Checkpoint(args.checkpoint) if args.checkpoint else None,
+            queue_depth=backfill_queue_depth,
+            max_queue_depth=args.max_queue_depth,
+            dry_run=args.dry_run,
+        )
+        result = backfill.run(limit=args.limit)
+    except (BackfillError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    except KeyboardInterrupt:
+        print("Interrupted; rerun with the same arguments to resume", file=sys.stderr)
+        return 130
+
+    logger.info(f"Backfill finished: {result}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,13 @@
-from celery import Celery
+import shutil
+import tempfile
+from functools import partial
+
+from celery import Celery, chain
+from celery.signals import task_postrun, worker_init, worker_process_init, worker_ready, worker_shutdown
 from sqlalchemy.orm import Session
 
 from api.utils.config import settings
+from api.utils.metrics import get_snapshot_dir, serve_snapshots, set_snapshot_dir, write_snapshot
 from api.db.database import SessionLocal
 from api.utils.logger import logger
 
@@ -22,14 +28,88 @@ celery_app.conf.update(
     enable_utc=True,
     worker_concurrency=settings.WORKER_CONCURRENCY,
     worker_max_tasks_per_child=settings.WORKER_MAX_TASKS_PER_CHILD,
+    # Checked by the pool after each task; Celery takes kilobytes
+    worker_max_memory_per_child=settings.WORKER_MAX_RSS_MB * 1024 or None,
     task_acks_late=True,
     worker_prefetch_multiplier=1,
     task_track_started=True,
     task_time_limit=300,
     task_soft_time_limit=240,
+    # Headroom for warm_up_worker_process before the parent gives up on a new child
+    worker_proc_alive_timeout=15,
+    # Staged pipeline: I/O stages on a thread pool, encoding on one process per core
+    task_routes={
+        "api.v1.workers.celery_app.fetch_stage_task": {"queue": settings.PIPELINE_IO_QUEUE},
+        "api.v1.workers.celery_app.transform_stage_task": {"queue": settings.PIPELINE_CPU_QUEUE},
+        "api.v1.workers.celery_app.store_stage_task": {"queue": settings.PIPELINE_IO_QUEUE},
+        "api.v1.workers.celery_app.finalize_stage_task": {"queue": settings.PIPELINE_IO_QUEUE},
+    },
+    beat_schedule={
+        "cleanup-uploads": {
+            "task": "api.v1.workers.celery_app.cleanup_uploads_task",
+            "schedule": settings.CLEANUP_INTERVAL_SECONDS,
+        },
+        "purge-deleted-uploads": {
+            "task": "api.v1.workers.celery_app.purge_deleted_uploads_task",
+            "schedule": settings.PURGE_DELETED_INTERVAL_SECONDS,
+        },
+        "expire-upload-sessions": {
+            "task": "api.v1.workers.celery_app.expire_upload_sessions_task",
+            "schedule": settings.UPLOAD_SESSION_GC_INTERVAL_SECONDS,
+        },
+        "deliver-webhooks": {
+            "task": "api.v1.workers.celery_app.deliver_webhooks_task",
+            "schedule": settings.WEBHOOK_DISPATCH_INTERVAL_SECONDS,
+        },
+        "maintain-processing-logs": {
+            "task": "api.v1.workers.celery_app.maintain_processing_logs_task",
+            "schedule": settings.PROCESSING_LOG_MAINTENANCE_INTERVAL_SECONDS,
+        },
+    },
 )
 
 
+@worker_process_init.connect
+def warm_up_worker_process(**kwargs):
+    """Preload libraries and clients in each new child, including ones
+    started after worker_max_tasks_per_child recycles a process."""
+    from api.v1.workers.warmup import init_worker_process
+
+    # Start the child's metrics from zero rather than from the parent's at fork
+    set_snapshot_dir(get_snapshot_dir())
+    init_worker_process()
+
+
+# Metrics: each pool process writes a snapshot after every task, and the
+# main worker process serves them all on WORKER_METRICS_PORT.
+@worker_init.connect
+def prepare_worker_metrics(**kwargs):
+    if settings.WORKER_METRICS_PORT:
+        # Before the pool forks, so every child inherits the directory
+        set_snapshot_dir(tempfile.mkdtemp(prefix="celery-worker-metrics-"))
+    elif settings.MEMORY_PROFILING:
+        logger.warning("MEMORY_PROFILING is on without WORKER_METRICS_PORT; "
+                       "task memory profiles only reach processing_logs")
+
+
+@worker_ready.connect
+def start_worker_metrics_exporter(**kwargs):
+    if get_snapshot_dir():
+        serve_snapshots(get_snapshot_dir(), settings.WORKER_METRICS_PORT)
+        logger.info(f"Serving worker metrics on port {settings.WORKER_METRICS_PORT}")
+
+
+@task_postrun.connect
+def export_task_metrics(**kwargs):
+    write_snapshot()
+
+
+@worker_shutdown.connect
+def remove_worker_metrics(**kwargs):
+    if get_snapshot_dir():
+        shutil.rmtree(get_snapshot_dir(), ignore_errors=True)
+
+
 # def get_db() -> Session:
 #     db = SessionLocal()
 #     try:
@@ -38,14 +118,135 @@ celery_app.conf.update(
 #         db.close()
 
 
-@celery_app.task(bind=True, max_retries=3, default_retry_delay=60)
+@celery_app.task(bind=True, max_retries=settings.TASK_MAX_RETRIES, default_retry_delay=60)
 def process_image_task(self, upload_id: str):
-    from api.v1.workers.tasks import process_image
+    from api.v1.workers.tasks import process_image, compute_retry_delay
+    from api.v1.services.storage_service import is_transient_storage_error
+
+    final_attempt = self.request.retries >= self.max_retries
     try:
         logger.info(f"Celery received task process_image_task for upload_id={upload_id}")
-        result = process_image(upload_id)
+        result = process_image(upload_id, final_attempt=final_attempt)
         logger.info(f"Celery completed task process_image_task for upload_id={upload_id}")
         return result
     except Exception as exc:
+        if not final_attempt and is_transient_storage_error(exc):
+            countdown = compute_retry_delay(self.request.retries)
+            logger.warning(
+                f"Retrying process_image_task for upload_id={upload_id} in {countdown:.1f}s "
+                f"(attempt {self.request.retries + 1}/{self.max_retries}): {exc}"
+            )
+            raise self.retry(exc=exc, countdown=countdown)
         logger.exception(f"Exception in Celery task process_image_task for upload_id={upload_id}: {exc}")
         raise
+
+
+@celery_app.task(bind=True, max_retries=settings.TASK_MAX_RETRIES, default_retry_delay=60)
+def regenerate_variants_task(self, upload_id: str, variants: list, generation: str):
+    from api.v1.workers.tasks import regenerate_variants
+
+    return _run_stage(self, partial(regenerate_variants, variants=variants, generation=generation), upload_id)
+
+
+def _run_stage(task, stage, argument):
+    """Run a pipeline stage, retrying transient storage errors like process_image_task"""
+    from api.v1.workers.tasks import compute_retry_delay
+    from api.v1.services.storage_service import is_transient_storage_error
+
+    final_attempt = task.request.retries >= task.max_retries
+    try:
+        return stage(argument, final_attempt=final_attempt)
+    except Exception as exc:
+        if not final_attempt and is_transient_storage_error(exc):
+            countdown = compute_retry_delay(task.request.retries)
+            logger.warning(
+                f"Retrying {task.name} in {countdown:.1f}s "
+                f"(attempt {task.request.retries + 1}/{task.max_retries}): {exc}"
+            )
+            raise task.retry(exc=exc, countdown=countdown)
+        logger.exception(f"Exception in Celery task {task.name}: {exc}")
+        raise
+
+
+@celery_app.task(bind=True, max_retries=settings.TASK_MAX_RETRIES)
+def fetch_stage_task(self, upload_id: str):
+    from api.v1.workers.pipeline import fetch_stage
+
+    return _run_stage(self, fetch_stage, upload_id)
+
+
+@celery_app.task(bind=True, max_retries=settings.TASK_MAX_RETRIES)
+def transform_stage_task(self, context):
+    from api.v1.workers.pipeline import transform_stage
+
+    return _run_stage(self, transform_stage, context)
+
+
+@celery_app.task(bind=True, max_retries=settings.TASK_MAX_RETRIES)
+def store_stage_task(self, context):
+    from api.v1.workers.pipeline import store_stage
+
+    return _run_stage(self, store_stage, context)
+
+
+@celery_app.task(bind=True, max_retries=settings.TASK_MAX_RETRIES)
+def finalize_stage_task(self, context):
+    from api.v1.workers.pipeline import finalize_stage
+
+    return _run_stage(self, finalize_stage, context)
+
+
+def process_image_pipeline(upload_id: str):
+    """The staged equivalent of process_image_task, as a Celery chain"""
+    return chain(
+        fetch_stage_task.s(upload_id),
+        transform_stage_task.s(),
+        store_stage_task.s(),
+        finalize_stage_task.s(),
+    )
+
+
+@celery_app.task(ignore_result=True)
+def cleanup_uploads_task():
+    from api.v1.workers.tasks import cleanup_uploads
+
+    result = cleanup_uploads()
+    logger.info(f"Celery completed cleanup_uploads_task: {result}")
+    return result
+
+
+@celery_app.task(ignore_result=True)
+def purge_deleted_uploads_task():
+    from api.v1.workers.tasks import purge_deleted_uploads
+
+    result = purge_deleted_uploads()
+    logger.info(f"Celery completed purge_deleted_uploads_task: {result}")
+    return result
+
+
+@celery_app.task(ignore_result=True)
+def expire_upload_sessions_task():
+    from api.v1.workers.tasks import expire_upload_sessions
+
+    result = expire_upload_sessions()
+    logger.info(f"Celery completed expire_upload_sessions_task: {result}")
+    return result
+
+
+@celery_app.task(ignore_result=True)
+def deliver_webhooks_task():
+    from api.v1.workers.tasks import deliver_webhooks
+
+    result = deliver_webhooks()
+    if any(result.values()):
+        logger.info(f"Celery completed deliver_webhooks_task: {result}")
+    return result
+
+
+@celery_app.task(ignore_result=True)
+def maintain_processing_logs_task():
+    from api.v1.workers.tasks import maintain_processing_logs
+
+    result = maintain_processing_logs()
+    logger.info(f"Celery completed maintain_processing_logs_task: {result}")
+    return result
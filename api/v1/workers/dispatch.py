@@ -0,0 +1,299 @@
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Optional, Tuple
+
+from api.utils.config import settings
+from api.utils.logger import logger
+from api.utils.metrics import add_snapshot_source, set_snapshot_dir, write_snapshot
+from api.v1.workers.memory import over_rss_budget
+from api.v1.workers.warmup import init_worker_process
+
+
+class DispatchQueueFullError(Exception):
+    """Raised when the local backend has no room for another task"""
+
+
+class LocalTaskError(Exception):
+    """Picklable summary of a failure inside a local worker process.
+
+    Arbitrary exceptions (e.g. from the GCS client) do not always survive
+    the trip back from the child, so only the message and whether the
+    error is worth retrying are sent.
+    """
+
+    def __init__(self, message: str, transient: bool = False):
+        super().__init__(message, transient)
+        self.transient = transient
+
+    def __str__(self) -> str:
+        return self.args[0]
+
+
+def run_process_image(upload_id: str, final_attempt: bool) -> dict:
+    """Entry point for process_image inside a local worker process"""
+    from api.v1.workers.tasks import process_image
+    from api.v1.services.storage_service import is_transient_storage_error
+
+    try:
+        return process_image(upload_id, final_attempt=final_attempt)
+    except Exception as exc:
+        raise LocalTaskError(
+            f"{type(exc).__name__}: {exc}", transient=is_transient_storage_error(exc)
+        ) from None
+
+
+def _init_local_worker(metrics_dir: str, initializer: Optional[Callable[[], None]]) -> None:
+    set_snapshot_dir(metrics_dir)
+    if initializer:
+        initializer()
+
+
+def _run_local_task(task: Callable[[str, bool], dict], upload_id: str, final_attempt: bool) -> dict:
+    """Run a task in a local worker process, then export the process's metrics"""
+    try:
+        return task(upload_id, final_attempt)
+    finally:
+        write_snapshot()
+
+
+class CeleryDispatcher:
+    """Hand tasks to Celery workers through the Redis broker"""
+
+    name = "celery"
+
+    def __init__(self):
+        self._redis = None
+
+    def submit_process_image(self, upload_id: str) -> None:
+        from api.v1.workers.celery_app import process_image_pipeline, process_image_task
+
+        if settings.PIPELINE_MODE == "staged":
+            process_image_pipeline(upload_id).delay()
+        else:
+            process_image_task.delay(upload_id)
+
+    def queue_depth(self) -> int:
+        """Tasks waiting in the broker, not yet picked up by a worker"""
+        import redis
+        from api.v1.workers.celery_app import celery_app
+
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(
+                settings.REDIS_URL, socket_timeout=1, socket_connect_timeout=1
+            )
+        queues = [celery_app.conf.task_default_queue]
+        if settings.PIPELINE_MODE == "staged":
+            queues += [settings.PIPELINE_IO_QUEUE, settings.PIPELINE_CPU_QUEUE]
+        # The Redis transport keeps each queue as a list named after it
+        pipe = self._redis.pipeline(transaction=False)
+        for queue in queues:
+            pipe.llen(queue)
+        return sum(pipe.execute())
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        pass
+
+
+class LocalDispatcher:
+    """Run tasks in a process pool owned by this process, without a broker.
+
+    At most `max_queue` tasks may be queued, running or waiting for a retry
+    at once; beyond that submissions fail fast with DispatchQueueFullError.
+    Retries follow the Celery task: transient storage errors are retried up
+    to `max_retries` times with compute_retry_delay backoff, and the last
+    attempt marks the upload failed. On shutdown, new work is refused,
+    pending retries run immediately, and outstanding tasks are given
+    `timeout` seconds to finish.
+
+    A process pool cannot replace a single child, so when a task reports
+    its worker above `max_rss_mb` the whole pool is swapped for a fresh one;
+    the old pool finishes the tasks it already holds and then exits.
+
+    Worker processes write their metrics to a snapshot in `metrics_dir`
+    after each task, and the API's /metrics includes them.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        max_workers: int,
+        max_queue: int,
+        max_retries: int,
+        task: Callable[[str, bool], dict] = run_process_image,
+        initializer: Optional[Callable[[], None]] = init_worker_process,
+        max_rss_mb: int = 0
+    ):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.max_rss_mb = max_rss_mb
+        self.recycled = 0
+        self._task = task
+        self.metrics_dir = tempfile.mkdtemp(prefix="local-worker-metrics-")
+        add_snapshot_source(self.metrics_dir)
+        self._initializer = partial(_init_local_worker, self.metrics_dir, initializer)
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, initializer=self._initializer)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._outstanding = 0
+        # upload_id -> (timer, retry number it will run)
+        self._retry_timers: Dict[str, Tuple[threading.Timer, int]] = {}
+        self._closing = False
+
+    @property
+    def outstanding(self) -> int:
+        """Tasks queued, running or waiting to be retried"""
+        return self._outstanding
+
+    def queue_depth(self) -> int:
+        """Tasks not yet running, assuming every worker process is busy"""
+        return max(0, self._outstanding - self.max_workers)
+
+    def submit_process_image(self, upload_id: str) -> None:
+        with self._lock:
+            if self._closing:
+                raise RuntimeError("Dispatcher is shutting down")
+            if self._outstanding >= self.max_queue:
+                raise DispatchQueueFullError(f"Local task queue is full ({self.max_queue} tasks)")
+            self._outstanding += 1
+        self._submit(upload_id, 0)
+
+    def _submit(self, upload_id: str, retries: int) -> None:
+        final_attempt = retries >= self.max_retries
+        executor = self._executor
+        try:
+            future = executor.submit(_run_local_task, self._task, upload_id, final_attempt)
+        except Exception as exc:
+            logger.error(f"Failed to submit local task for upload_id={upload_id}: {exc}")
+            self._finish()
+            return
+        future.add_done_callback(partial(self._on_done, upload_id, retries, executor))
+
+    def _on_done(
+        self,
+        upload_id: str,
+        retries: int,
+        executor: ProcessPoolExecutor,
+        future: Future
+    ) -> None:
+        exc = future.exception() if not future.cancelled() else None
+        if future.cancelled():
+            logger.warning(f"Local task for upload_id={upload_id} was cancelled")
+        elif exc is None:
+            logger.info(f"Local task completed for upload_id={upload_id}")
+            self._check_memory(future.result(), executor)
+        elif retries < self.max_retries and getattr(exc, "transient", False):
+            self._schedule_retry(upload_id, retries, exc)
+            return
+        else:
+            logger.error(f"Local task failed for upload_id={upload_id}: {exc}")
+        self._finish()
+
+    def _schedule_retry(self, upload_id: str, retries: int, exc: BaseException) -> None:
+        from api.v1.workers.tasks import compute_retry_delay
+
+        with self._lock:
+            if self._closing:
+                # Draining: give the retry its turn now rather than dropping it
+                countdown = 0.0
+            else:
+                countdown = compute_retry_delay(retries)
+            timer = threading.Timer(countdown, self._run_retry, (upload_id, retries + 1))
+            timer.daemon = True
+            self._retry_timers[upload_id] = (timer, retries + 1)
+        logger.warning(
+            f"Retrying local task for upload_id={upload_id} in {countdown:.1f}s "
+            f"(attempt {retries + 1}/{self.max_retries}): {exc}"
+        )
+        timer.start()
+
+    def _run_retry(self, upload_id: str, retries: int) -> None:
+        with self._lock:
+            # Already taken over by shutdown()
+            if self._retry_timers.pop(upload_id, None) is None:
+                return
+        self._submit(upload_id, retries)
+
+    def _check_memory(self, result, executor: ProcessPoolExecutor) -> None:
+        """Recycle the pool if the task reports its worker over budget"""
+        if not isinstance(result, dict):
+            return
+        if not over_rss_budget(result.get("rss_bytes", 0), self.max_rss_mb):
+            return
+
+        with self._lock:
+            # Only the current pool is recycled; late reports from a retired one are ignored
+            if self._closing or executor is not self._executor:
+                return
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, initializer=self._initializer
+            )
+            self.recycled += 1
+        logger.warning(
+            f"Local worker RSS {result['rss_bytes'] / (1024 * 1024):.1f}MiB is over the "
+            f"{self.max_rss_mb}MiB budget; replacing the worker pool"
+        )
+        executor.shutdown(wait=False)
+
+    def _finish(self) -> None:
+        with self._lock:
+            self._outstanding -= 1
+            self._idle.notify_all()
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """Stop accepting work and wait for outstanding tasks to drain"""
+        with self._lock:
+            self._closing = True
+            timers = list(self._retry_timers.items())
+            self._retry_timers.clear()
+        for upload_id, (timer, retries) in timers:
+            timer.cancel()
+            self._submit(upload_id, retries)
+
+        with self._lock:
+            drained = self._idle.wait_for(lambda: self._outstanding == 0, timeout)
+        if not drained:
+            logger.warning(f"Shutting down with {self._outstanding} local tasks unfinished")
+        self._executor.shutdown(wait=drained, cancel_futures=not drained)
+        if drained:
+            shutil.rmtree(self.metrics_dir, ignore_errors=True)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Dispatcher for the configured TASK_BACKEND, created on first use"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            if settings.TASK_BACKEND == "local":
+                if settings.PIPELINE_MODE == "staged":
+                    logger.warning("PIPELINE_MODE=staged needs the celery backend; "
+                                   "the local pool runs process_image as a single task")
+                _dispatcher = LocalDispatcher(
+                    max_workers=settings.WORKER_CONCURRENCY,
+                    max_queue=settings.LOCAL_TASK_QUEUE_SIZE,
+                    max_retries=settings.TASK_MAX_RETRIES,
+                    max_rss_mb=settings.WORKER_MAX_RSS_MB
+                )
+            elif settings.TASK_BACKEND == "celery":
+                _dispatcher = CeleryDispatcher()
+            else:
+                raise ValueError(f"Unknown TASK_BACKEND: {settings.TASK_BACKEND}")
+            logger.info(f"Using {_dispatcher.name} task backend")
+        return _dispatcher
+
+
+def shutdown_dispatcher(timeout: Optional[float] = None) -> None:
+    """Drain and stop the dispatcher, if one was created"""
+    global _dispatcher
+    with _dispatcher_lock:
+        dispatcher, _dispatcher = _dispatcher, None
+    if dispatcher is not None:
+        dispatcher.shutdown(timeout)
@@ -1,12 +1,32 @@
+import base64
 import io
 import time
-from typing import Tuple, Optional
-from PIL import Image, UnidentifiedImageError
+from typing import Callable, Iterator, List, Tuple, Optional
+from PIL import Image, ImageChops, UnidentifiedImageError
 
 from api.utils.config import settings
-from api.v1.services.storage_service import storage_service
+from api.v1.services.storage_service import EncodedImage, encode_image
 from api.utils.logger import logger
 
+# Lookup table mapping any positive difference to a set bit
+_NONZERO_TO_WHITE = [0] + [255] * 255
+
+
+def transformed_frames(
+    source: Image.Image,
+    transform: Callable[[Image.Image], Image.Image],
+    durations: List[int]
+) -> Iterator[Image.Image]:
+    """Decode, convert and transform the frames of `source` one at a time
+
+    Each frame's duration is appended to `durations` as the frame is
+    produced.
+    """
+    for index in range(getattr(source, "n_frames", 1)):
+        source.seek(index)
+        durations.append(source.info.get("duration", 0))
+        yield transform(source.convert("RGBA"))
+
 
 class ImageProcessor:
     @staticmethod
@@ -31,46 +51,66 @@ class ImageProcessor:
         except Exception as e:
             return False, f"Image validation failed: {str(e)}"
     
+    @staticmethod
+    def fit_size(size: Tuple[int, int], max_size: Tuple[int, int]) -> Tuple[int, int]:
+        """Largest size with the same aspect ratio that fits in max_size"""
+        original_width, original_height = size
+        max_width, max_height = max_size
+        
+        ratio = min(max_width / original_width, max_height / original_height)
+        return int(original_width * ratio), int(original_height * ratio)
+    
     @staticmethod
     def resize_image(image: Image.Image, max_size: Tuple[int, int]) -> Image.Image:
         """Resize image while maintaining aspect ratio"""
         original_width, original_height = image.size
-        max_width, max_height = max_size
         
         # Calculate new dimensions
-        ratio = min(max_width / original_width, max_height / original_height)
-        new_width = int(original_width * ratio)
-        new_height = int(original_height * ratio)
+        new_width, new_height = ImageProcessor.fit_size(image.size, max_size)
         
         # Resize image
         resized_image = image.resize((new_width, new_height), Image.LANCZOS)
-        logger.info(f"Resized image from {original_width}x{original_height} to {new_width}x{new_height}")
+        logger.info("Resized image from %dx%d to %dx%d", original_width, original_height, new_width, new_height)
         
         return resized_image
     
     @staticmethod
-    def compress_image(image: Image.Image, format: str = "JPEG", quality: int = 85) -> Image.Image:
-        """Compress image by saving to buffer with lower quality"""
-        buffer = io.BytesIO()
-        format = format.upper()
+    def build_srcset_ladder(image: Image.Image, widths: List[int]) -> List[Image.Image]:
+        """Downscaled copies of an image at each width, widest first
+
+        Each rung is resized from the previous one rather than from the
+        original. Only the first step touches the full-size image, and
+        reducing_gap lets Pillow do most of that with a cheap box reduce()
+        before the Lanczos pass. Later steps shrink by 2x or less on images
+        that are already small, so the whole ladder costs little more than
+        a single resize. Widths at or above the original width are skipped.
+        """
+        if image.mode not in ("RGB", "RGBA", "L"):
+            has_alpha = image.mode in ("LA", "PA") or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha else "RGB")
+
+        original_width, original_height = image.size
+        rungs = []
+        current = image
+        for width in sorted({w for w in widths if 0 < w < original_width}, reverse=True):
+            # Heights come from the original so rounding does not drift down the ladder
+            height = max(1, round(original_height * width / original_width))
+            current = current.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+            rungs.append(current)
         
-        if format in ["JPEG", "WEBP"]:
-            # Handle RGBA to RGB conversion for JPEGs
-            if format == "JPEG" and image.mode in ("RGBA", "LA"):
-                background = Image.new("RGB", image.size, (255, 255, 255))
-                background.paste(image, mask=image.split()[-1]) # use alpha channel as mask
-                image = background
-            
-            image.save(buffer, format=format, quality=quality, optimize=True)
-        elif format == "PNG":
-            image.save(buffer, format="PNG", optimize=True)
-        else:
-            image.save(buffer, format=format)
+        logger.info("Built srcset ladder for %dx%d: %s", original_width, original_height,
+                    [rung.width for rung in rungs])
+        return rungs
+    
+    @staticmethod
+    def compress_image(image: Image.Image, format: str = "JPEG", quality: int = 85) -> EncodedImage:
+        """Encode an image with the encoder's size optimizations on
         
-        buffer.seek(0)
-        compressed_image = Image.open(buffer)
-        logger.info(f"Compressed image to format {format} with quality {quality}")
-        return compressed_image
+        The result is the stored variant itself; it is not decoded again.
+        """
+        encoded = encode_image(image, format, quality, optimize=True)
+        logger.info("Compressed image to format %s with quality %s", encoded.format, quality)
+        return encoded
     
     @staticmethod
     def create_thumbnail(image: Image.Image, size: Tuple[int, int]) -> Image.Image:
@@ -91,9 +131,111 @@ class ImageProcessor:
             
             image = image.crop((left, top, right, bottom))
         
-        logger.info(f"Created thumbnail: {image.size}")
+        logger.info("Created thumbnail: %s", image.size)
         return image
     
+    @staticmethod
+    def create_placeholder(image: Image.Image, max_side: int = 16, quality: int = 40) -> str:
+        """Tiny blurred preview of an image as a data URI
+
+        The image is shrunk to at most `max_side` pixels on its longest edge,
+        keeping the aspect ratio, and encoded as WebP, which keeps
+        the result around 200 characters. Browsers scale it up with smoothing,
+        so it renders as a blur of the final image.
+        """
+        width, height = ImageProcessor.fit_size(image.size, (max_side, max_side))
+        size = (max(1, width), max(1, height))
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        tiny = image.convert("RGBA" if has_alpha else "RGB").resize(
+            size, Image.BILINEAR, reducing_gap=2.0
+        )
+        buffer = io.BytesIO()
+        tiny.save(buffer, format="WEBP", quality=quality)
+        return "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+    
+    @staticmethod
+    def perceptual_hash(image: Image.Image) -> int:
+        """64-bit difference hash (dHash) of an image
+
+        The image is reduced to 9x8 grayscale and each bit records whether a
+        pixel is brighter than its right-hand neighbour. The comparison runs
+        inside Pillow on whole images (subtract, threshold, pack to bits)
+        rather than pixel by pixel in Python.
+        """
+        gray = image.convert("L").resize((9, 8), Image.BILINEAR)
+        brighter = ImageChops.subtract(gray.crop((0, 0, 8, 8)), gray.crop((1, 0, 9, 8)))
+        bits = brighter.point(_NONZERO_TO_WHITE).convert("1").tobytes()
+        return int.from_bytes(bits, "big")
+    
+    @staticmethod
+    def is_animated(image: Image.Image) -> bool:
+        """Check whether an image has more than one frame"""
+        return getattr(image, "is_animated", False)
+    
+    @staticmethod
+    def check_animation_budget(image: Image.Image) -> None:
+        """Reject animations whose frame count or total pixel count exceed the limits
+
+        Only frame headers are read, no frame is decoded, so hostile files
+        are refused before they can pin a worker.
+        """
+        frames = getattr(image, "n_frames", 1)
+        if frames > settings.ANIMATION_MAX_FRAMES:
+            raise ValueError(
+                f"Animation has {frames} frames. Max frames: {settings.ANIMATION_MAX_FRAMES}"
+            )
+        ImageProcessor.check_total_pixels(frames, image.size)
+    
+    @staticmethod
+    def check_total_pixels(frames: int, size: Tuple[int, int], what: str = "Animation") -> None:
+        """Reject `frames` frames of `size` beyond ANIMATION_MAX_TOTAL_PIXELS"""
+        total_pixels = frames * size[0] * size[1]
+        if total_pixels > settings.ANIMATION_MAX_TOTAL_PIXELS:
+            raise ValueError(
+                f"{what} has {total_pixels} pixels across all frames. "
+                f"Max pixels: {settings.ANIMATION_MAX_TOTAL_PIXELS}"
+            )
+    
+    @staticmethod
+    def encode_animation(
+        image: Image.Image,
+        transform: Callable[[Image.Image], Image.Image],
+        format: str = "WEBP",
+        quality: int = 80
+    ) -> EncodedImage:
+        """Apply `transform` to every frame and encode the result as an animation
+
+        Frames are decoded and transformed one at a time, but neither Pillow
+        encoder writes them incrementally: GIF keeps a palette copy of every
+        frame until it writes the file, and WebP lists the RGBA frames
+        before encoding. The whole output animation is therefore in memory
+        at once, up to 4 bytes per pixel, so ANIMATION_MAX_TOTAL_PIXELS is
+        checked against the output frames too (resizing may enlarge them)
+        before any other frame is transformed.
+        """
+        format = format.upper()
+        durations: List[int] = []
+        frames = transformed_frames(image, transform, durations)
+        first = next(frames)
+        ImageProcessor.check_total_pixels(getattr(image, "n_frames", 1), first.size, "Encoded animation")
+        
+        # Both encoders read frame i's duration only after taking frame i from the generator
+        params = {"save_all": True, "append_images": frames, "duration": durations}
+        if "loop" in image.info:
+            params["loop"] = image.info["loop"]
+        if format == "WEBP":
+            params.update(quality=quality, method=4)
+        else:
+            params.update(optimize=True)
+        
+        buffer = io.BytesIO()
+        first.save(buffer, format=format, **params)
+        logger.info(
+            "Encoded %d-frame animation as %s at %dx%d",
+            len(durations), format, first.size[0], first.size[1]
+        )
+        return EncodedImage(buffer.getvalue(), format, first.size[0], first.size[1])
+    
     @staticmethod
     def get_image_format(mime_type: str) -> str:
         """Convert MIME type to PIL format"""
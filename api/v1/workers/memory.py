@@ -0,0 +1,136 @@
+import gc
+import os
+import resource
+import sys
+import tracemalloc
+from typing import List, Optional
+
+from api.utils.metrics import metrics
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process right now"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        # No procfs (e.g. macOS): the lifetime peak is the best available
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    """Highest resident set size since the last reset_peak_rss()"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def reset_peak_rss() -> bool:
+    """Restart peak RSS tracking from the current RSS (Linux only)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class TaskMemoryProfile:
+    """Measure the memory a single task uses.
+
+    Records RSS before and after the task, the peak RSS in between, and
+    the RSS retained once the task's garbage is collected. With
+    `trace_allocations`, tracemalloc also runs for the task and the `top_n`
+    source lines whose allocations grew the most are reported; it slows
+    the task down noticeably, so it is meant for a sample of tasks only.
+    """
+
+    def __init__(self, trace_allocations: bool = False, top_n: int = 10):
+        self.trace_allocations = trace_allocations
+        self.top_n = top_n
+        self.rss_before = 0
+        self.rss_after = 0
+        self.peak_rss = 0
+        self.peak_is_per_task = False
+        self.top_allocations: List[str] = []
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._started_tracing = False
+
+    @property
+    def retained_bytes(self) -> int:
+        return self.rss_after - self.rss_before
+
+    def __enter__(self):
+        self.rss_before = current_rss_bytes()
+        self.peak_is_per_task = reset_peak_rss()
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+            self._snapshot = tracemalloc.take_snapshot()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.peak_rss = peak_rss_bytes()
+        if self._started_tracing:
+            try:
+                diff = tracemalloc.take_snapshot().compare_to(self._snapshot, "lineno")
+                self.top_allocations = [
+                    f"{stat.traceback[0].filename}:{stat.traceback[0].lineno} "
+                    f"{stat.size_diff / 1024:+.1f}KiB ({stat.count_diff:+d} blocks)"
+                    for stat in diff[:self.top_n]
+                    if stat.size_diff > 0
+                ]
+            finally:
+                tracemalloc.stop()
+                self._snapshot = None
+        # Whatever survives a collection is what the task left behind
+        gc.collect()
+        self.rss_after = current_rss_bytes()
+        return False
+
+    def as_dict(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "rss_before_bytes": self.rss_before,
+            "rss_after_bytes": self.rss_after,
+            "peak_rss_bytes": self.peak_rss,
+            "retained_bytes": self.retained_bytes,
+            "peak_is_per_task": self.peak_is_per_task,
+            "top_allocations": self.top_allocations,
+        }
+
+    def summary(self) -> str:
+        """One-line description for the processing log"""
+        mib = 1024 * 1024
+        message = (
+            f"peak RSS {self.peak_rss / mib:.1f}MiB"
+            f"{'' if self.peak_is_per_task else ' (process lifetime)'}, "
+            f"RSS {self.rss_before / mib:.1f}MiB -> {self.rss_after / mib:.1f}MiB "
+            f"(retained {self.retained_bytes / mib:+.1f}MiB)"
+        )
+        if self.top_allocations:
+            message += "; top allocations: " + "; ".join(self.top_allocations)
+        return message
+
+
+def record_memory_metrics(stats: dict) -> None:
+    """Add one task's memory profile (TaskMemoryProfile.as_dict) to the metrics registry"""
+    metrics.observe("task_peak_rss_bytes", stats["peak_rss_bytes"])
+    metrics.observe("task_retained_bytes", stats["retained_bytes"])
+    metrics.set_gauge("worker_rss_bytes", stats["rss_after_bytes"], pid=stats.get("pid", os.getpid()))
+    if stats["retained_bytes"] > 0:
+        metrics.increment("task_retained_bytes_total", stats["retained_bytes"])
+
+
+def over_rss_budget(rss_bytes: int, budget_mb: int) -> bool:
+    """Whether a worker should be recycled (a budget of 0 disables the check)"""
+    return budget_mb > 0 and rss_bytes > budget_mb * 1024 * 1024
@@ -0,0 +1,221 @@
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from api.v1.services.upload_service import UploadService
+from api.v1.services.storage_service import storage_service, is_transient_storage_error
+from api.v1.workers.tasks import (
+    VARIANT_CHECKPOINTS, begin_processing, complete_processing, db_session, fail_processing, render_variants,
+    stage, store_artifacts
+)
+from api.utils.config import settings
+from api.utils.logger import logger
+
+# The staged pipeline splits process_image into four Celery tasks, chained:
+#
+#   fetch (io)  ->  transform (cpu)  ->  store (io)  ->  finalize (io)
+#
+# fetch takes the lease and downloads the original, transform decodes and
+# encodes every pending variant, store uploads and checkpoints them, and
+# finalize marks the upload completed. The io queue is served by a thread
+# pool with high concurrency, the cpu queue by one process per core, so
+# neither kind of work holds a slot the other needs. Stages hand each other
+# a small JSON context; the image bytes go through a StageCache directory
+# shared by the io and cpu workers of a host.
+
+
+class StageCache:
+    """Local directory holding the buffers passed between pipeline stages"""
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = Path(root or settings.PIPELINE_CACHE_DIR or
+                         os.path.join(tempfile.gettempdir(), "image-pipeline"))
+
+    def _dir(self, context: dict) -> Path:
+        return self.root / f"{context['upload_id']}-{context['lease_id']}"
+
+    def write(self, context: dict, name: str, data: bytes) -> str:
+        """Store a buffer for a later stage; returns its path"""
+        directory = self._dir(context)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / name
+        tmp_path = directory / f".{name}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        return str(path)
+
+    @staticmethod
+    def read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def has(path: Optional[str]) -> bool:
+        return path is not None and os.path.isfile(path)
+
+    def discard(self, context: dict) -> None:
+        shutil.rmtree(self._dir(context), ignore_errors=True)
+
+    def prune(self, max_age_seconds: int) -> int:
+        """Remove buffers left behind by chains that never finished"""
+        if not self.root.is_dir():
+            return 0
+        cutoff = time.time() - max_age_seconds
+        removed = 0
+        for directory in self.root.iterdir():
+            try:
+                if directory.stat().st_mtime < cutoff:
+                    shutil.rmtree(directory, ignore_errors=True)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
+
+
+def _resume(upload_service: UploadService, context: dict):
+    """Renew the chain's lease and reload its upload; None if the chain lost the upload"""
+    if not upload_service.acquire_processing_lease(
+        context["upload_id"], context["lease_id"], settings.PROCESSING_LEASE_SECONDS
+    ):
+        logger.warning(f"Upload {context['upload_id']} was taken over by another delivery, stopping chain")
+        return None
+    return upload_service.get_upload(context["upload_id"])
+
+
+def _fail(context: dict, error: Exception, final_attempt: bool, cache: StageCache) -> None:
+    fail_processing(
+        context["upload_id"], context["lease_id"], error, final_attempt,
+        context["start_time"], context["timings"]
+    )
+    # A retried stage still needs its inputs
+    if final_attempt or not is_transient_storage_error(error):
+        cache.discard(context)
+
+
+def fetch_stage(upload_id: str, final_attempt: bool = True, cache: Optional[StageCache] = None) -> Optional[dict]:
+    """Take the lease, move the upload to processing and cache the original"""
+    cache = cache or StageCache()
+    context = {
+        "upload_id": upload_id,
+        "lease_id": str(uuid.uuid4()),
+        "start_time": time.time(),
+        "timings": {},
+        "pending": [],
+        "original": None,
+        "artifacts": [],
+    }
+    try:
+        with db_session() as db:
+            upload_service = UploadService(db)
+            upload, pending, skipped = begin_processing(upload_service, upload_id, context["lease_id"])
+            if skipped:
+                return None
+
+            context["pending"] = pending
+            if pending:
+                with stage(upload_service, upload_id, "download",
+                           "Downloading original image", "Original image downloaded", context["timings"]):
+                    data = storage_service.download_file(upload.original_url)
+                context["original"] = cache.write(context, "original", data)
+            return context
+    except Exception as e:
+        _fail(context, e, final_attempt, cache)
+        raise
+
+
+def _render(upload_service: UploadService, upload, context: dict, cache: StageCache) -> None:
+    if cache.has(context["original"]):
+        data = cache.read(context["original"])
+    else:
+        # Scheduled on a host that does not share the cache; fetch it again
+        logger.info(f"Stage cache miss for upload {upload.id}, downloading the original")
+        data = storage_service.download_file(upload.original_url)
+
+    artifacts = render_variants(upload_service, upload, data, context["pending"], context["timings"])
+    for artifact in artifacts:
+        if "data" in artifact:
+            artifact["path"] = cache.write(context, artifact["variant"], artifact.pop("data"))
+        for rung in artifact.get("rungs", []):
+            rung["path"] = cache.write(context, f"srcset-w{rung['width']}", rung.pop("data"))
+    context["artifacts"] = artifacts
+
+
+def transform_stage(context: Optional[dict], final_attempt: bool = True,
+                    cache: Optional[StageCache] = None) -> Optional[dict]:
+    """Decode the original and encode every pending variant into the cache"""
+    if context is None:
+        return None
+    cache = cache or StageCache()
+    try:
+        with db_session() as db:
+            upload_service = UploadService(db)
+            upload = _resume(upload_service, context)
+            if upload is None:
+                return None
+            if context["pending"]:
+                _render(upload_service, upload, context, cache)
+            return context
+    except Exception as e:
+        _fail(context, e, final_attempt, cache)
+        raise
+
+
+def store_stage(context: Optional[dict], final_attempt: bool = True,
+                cache: Optional[StageCache] = None) -> Optional[dict]:
+    """Upload the encoded variants and checkpoint each one"""
+    if context is None:
+        return None
+    cache = cache or StageCache()
+    try:
+        with db_session() as db:
+            upload_service = UploadService(db)
+            upload = _resume(upload_service, context)
+            if upload is None:
+                return None
+
+            paths = [artifact.get("path") for artifact in context["artifacts"] if "path" in artifact]
+            paths += [rung["path"] for artifact in context["artifacts"] for rung in artifact.get("rungs", [])]
+            if not all(cache.has(path) for path in paths):
+                logger.info(f"Stage cache miss for upload {upload.id}, rendering variants again")
+                _render(upload_service, upload, context, cache)
+
+            # On a retry, skip what the failed attempt already checkpointed
+            artifacts = [
+                artifact for artifact in context["artifacts"]
+                if getattr(upload, VARIANT_CHECKPOINTS[artifact["variant"]]) is None
+            ]
+            store_artifacts(
+                upload_service, upload, artifacts, context["timings"],
+                load=lambda artifact: cache.read(artifact["path"])
+            )
+            # Only what is still needed travels on
+            context["artifacts"] = []
+            return context
+    except Exception as e:
+        _fail(context, e, final_attempt, cache)
+        raise
+
+
+def finalize_stage(context: Optional[dict], final_attempt: bool = True,
+                   cache: Optional[StageCache] = None) -> Optional[dict]:
+    """Mark the upload completed and drop its cached buffers"""
+    if context is None:
+        return None
+    cache = cache or StageCache()
+    try:
+        with db_session() as db:
+            upload = _resume(UploadService(db), context)
+            if upload is None:
+                return None
+            result = complete_processing(
+                db, upload, context["lease_id"], context["start_time"], context["timings"]
+            )
+        cache.discard(context)
+        return result
+    except Exception as e:
+        _fail(context, e, final_attempt, cache)
+        raise
@@ -1,14 +1,37 @@
+import io
+import random
 import time
-from typing import Optional
+import uuid
+from typing import Callable, Optional
 from contextlib import contextmanager
 
+from PIL import Image
+
 from api.db.database import get_db
-from api.v1.services.upload_service import UploadService
-from api.v1.services.storage_service import storage_service
+from api.v1.services.upload_service import UploadService, variant_urls
+from api.v1.services.storage_service import EncodedImage, storage_service, encode_image, is_transient_storage_error
+from api.v1.services.log_retention_service import LogRetentionService
+from api.v1.services.similarity_service import to_signed
+from api.v1.services.upload_session_service import UploadSessionService
+from api.v1.services.webhook_service import WebhookService, get_webhook_dispatcher
 from api.v1.workers.image_processor import ImageProcessor
+from api.v1.workers.memory import (
+    TaskMemoryProfile, current_rss_bytes, over_rss_budget, record_memory_metrics
+)
 from api.v1.models.upload import UploadStatus
+from api.utils.config import settings
 from api.utils.logger import logger
 
+# Variants produced for every upload, in order, and the column that checkpoints
+# each one. The thumbnail stays last because it shrinks the source in place.
+VARIANT_CHECKPOINTS = {
+    "resized": "resized_url",
+    "compressed": "compressed_url",
+    "srcset": "srcset",
+    "thumbnail": "thumbnail_url",
+}
+VARIANTS = tuple(VARIANT_CHECKPOINTS)
+
 
 @contextmanager
 def db_session():
@@ -24,143 +47,592 @@ def db_session():
         db.close()
 
 
-def process_image(upload_id: str) -> dict:
-    """Process image: resize, compress, create thumbnail"""
+@contextmanager
+def stage(
+    upload_service: UploadService,
+    upload_id: str,
+    step: str,
+    started_message: str,
+    completed_message: str,
+    timings: dict
+):
+    """Log the start and end of a processing step and accumulate its duration"""
+    upload_service.add_processing_log(upload_id, step, "started", started_message)
+    started = time.perf_counter()
+    yield
+    duration_ms = int((time.perf_counter() - started) * 1000)
+    timings[step] = timings.get(step, 0) + duration_ms
+    upload_service.add_processing_log(upload_id, step, "completed", completed_message, duration_ms)
+
+
+def compute_retry_delay(retries: int) -> float:
+    """Exponential backoff with jitter for the given retry number (0-based)"""
+    delay = min(settings.TASK_RETRY_BACKOFF_MAX, settings.TASK_RETRY_BACKOFF_BASE * (2 ** retries))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def process_image(upload_id: str, final_attempt: bool = True) -> dict:
+    """Run _process_image, with memory profiling when MEMORY_PROFILING is on
+
+    The result carries `rss_bytes` (the worker's RSS afterwards) whenever a
+    WORKER_MAX_RSS_MB budget is set, so the local backend can recycle its
+    pool, and the full profile under `memory` when profiling.
+    """
+    if not settings.MEMORY_PROFILING:
+        result = _process_image(upload_id, final_attempt)
+        if settings.WORKER_MAX_RSS_MB > 0:
+            result["rss_bytes"] = current_rss_bytes()
+        return result
+
+    profile = TaskMemoryProfile(
+        trace_allocations=random.random() < settings.MEMORY_TRACEMALLOC_SAMPLE_RATE,
+        top_n=settings.MEMORY_TRACEMALLOC_TOP_N
+    )
+    try:
+        with profile:
+            result = _process_image(upload_id, final_attempt)
+    finally:
+        _record_task_memory(upload_id, profile)
+
+    result["memory"] = profile.as_dict()
+    result["rss_bytes"] = profile.rss_after
+    return result
+
+
+def _record_task_memory(upload_id: str, profile: TaskMemoryProfile) -> None:
+    """Store a task's memory profile in the processing log and metrics"""
+    stats = profile.as_dict()
+    record_memory_metrics(stats)
+    summary = profile.summary()
+    if over_rss_budget(profile.rss_after, settings.WORKER_MAX_RSS_MB):
+        summary += f"; over the {settings.WORKER_MAX_RSS_MB}MiB worker budget"
+    logger.info(f"Memory for upload {upload_id}: {summary}")
+    try:
+        with db_session() as db:
+            UploadService(db).add_processing_log(upload_id, "memory", "completed", summary)
+    except Exception as e:
+        logger.warning(f"Failed to record memory profile for upload {upload_id}: {str(e)}")
+
+
+def _process_image(upload_id: str, final_attempt: bool = True) -> dict:
+    """Process image: resize, compress, create thumbnail
+
+    Every variant is checkpointed as soon as it is uploaded, so a retry or
+    redelivery only produces the variants that are still missing. When
+    `final_attempt` is False, transient storage errors leave the upload in
+    processing so the caller can retry it.
+    """
     start_time = time.time()
-    
+    lease_id = str(uuid.uuid4())
+    timings: dict = {}
+
     try:
         with db_session() as db:
             upload_service = UploadService(db)
-            
-            # Get upload record
-            upload = upload_service.get_upload(upload_id)
-            if not upload:
-                raise ValueError(f"Upload not found: {upload_id}")
-            
-            # Update status to processing
-            upload_service.update_upload_status(upload_id, UploadStatus.PROCESSING)
-            upload_service.add_processing_log(upload_id, "start", "started", "Image processing started")
-            
-            logger.info(f"Starting processing for upload: {upload_id}")
-            
-            # ========= ACTUAL PROCESSING STARTS HERE =========
-            
-            # 1. Download original from GCS
-            upload_service.add_processing_log(upload_id, "download", "started", "Downloading original image")
-            
-            # Extract filename from URL
-            original_url = upload.original_url
-            # Get the blob path from GCS URL
-            # URL format: https://storage.googleapis.com/bucket-name/path/to/file.jpg
-            bucket_name = storage_service.bucket_name
-            blob_path = original_url.replace(f"https://storage.googleapis.com/{bucket_name}/", "")
-            
-            # Download the file
-            blob = storage_service.bucket.blob(blob_path)
-            image_bytes = blob.download_as_bytes()
-            
-            upload_service.add_processing_log(upload_id, "download", "completed", "Original image downloaded")
-            
-            # 2. Process the image
-            upload_service.add_processing_log(upload_id, "process", "started", "Processing image")
-            
-            # Open image
-            from PIL import Image
-            import io
-            
-            image = Image.open(io.BytesIO(image_bytes))
-            original_filename = upload.original_filename
-            
-            # Resize
-            upload_service.add_processing_log(upload_id, "resize", "started", "Resizing image")
-            from api.v1.workers.image_processor import ImageProcessor
-            processor = ImageProcessor()
-            
-            resized_image = processor.resize_image(image, (1200, 1200))
-            upload_service.add_processing_log(upload_id, "resize", "completed", "Image resized")
-            
-            # Create thumbnail
-            upload_service.add_processing_log(upload_id, "thumbnail", "started", "Creating thumbnail")
-            thumbnail_image = processor.create_thumbnail(image, (150, 150))
-            upload_service.add_processing_log(upload_id, "thumbnail", "completed", "Thumbnail created")
-            
-            # Compress (use resized image as compressed version)
-            upload_service.add_processing_log(upload_id, "compress", "started", "Compressing image")
-            compressed_image = processor.compress_image(resized_image, quality=85)
-            upload_service.add_processing_log(upload_id, "compress", "completed", "Image compressed")
-            
-            # 3. Upload processed images to GCS
-            upload_service.add_processing_log(upload_id, "upload", "started", "Uploading processed images")
-            
-            # Upload thumbnail
-            thumbnail_url = storage_service.upload_image(
-                thumbnail_image,
-                upload_id,
-                original_filename,
-                suffix="thumbnail",
-                format="JPEG",
-                quality=85
-            )
-            
-            # Upload resized version
-            resized_url = storage_service.upload_image(
-                resized_image,
-                upload_id,
-                original_filename,
-                suffix="resized",
-                format="JPEG",
-                quality=85
-            )
-            
-            # Upload compressed version
-            compressed_url = storage_service.upload_image(
-                compressed_image,
-                upload_id,
-                original_filename,
-                suffix="compressed",
-                format="JPEG",
-                quality=85
-            )
-            
-            upload_service.add_processing_log(upload_id, "upload", "completed", "All images uploaded")
-            
-            # ========= ACTUAL PROCESSING ENDS HERE =========
-            
-            # 4. Save REAL URLs to database
-            upload_service.update_processed_urls(
+
+            upload, pending, skipped = begin_processing(upload_service, upload_id, lease_id)
+            if skipped:
+                return skipped
+
+            if pending:
+                _process_variants(upload_service, upload, pending, timings)
+
+            return complete_processing(db, upload, lease_id, start_time, timings)
+
+    except Exception as e:
+        fail_processing(upload_id, lease_id, e, final_attempt, start_time, timings)
+        raise
+
+
+def begin_processing(upload_service: UploadService, upload_id: str, lease_id: str):
+    """Take the processing lease and move the upload to processing
+
+    Returns (upload, pending variants, None), or (upload, [], result) when
+    this delivery should stop here with `result`.
+    """
+    # Get upload record
+    upload = upload_service.get_upload(upload_id)
+    if not upload:
+        raise ValueError(f"Upload not found: {upload_id}")
+
+    if upload.status == UploadStatus.COMPLETED:
+        logger.info(f"Upload {upload_id} already completed, skipping")
+        return upload, [], {"upload_id": upload_id, "status": "completed", "skipped": True}
+
+    # Only one delivery may work on an upload at a time
+    if not upload_service.acquire_processing_lease(
+        upload_id, lease_id, settings.PROCESSING_LEASE_SECONDS
+    ):
+        logger.warning(f"Upload {upload_id} is already being processed, skipping duplicate delivery")
+        return upload, [], {"upload_id": upload_id, "status": "in_progress", "skipped": True}
+
+    # Update status to processing; refused if another delivery already finished it
+    if not upload_service.update_upload_status(upload_id, UploadStatus.PROCESSING):
+        upload_service.release_processing_lease(upload_id, lease_id)
+        return upload, [], {"upload_id": upload_id, "status": upload.status, "skipped": True}
+    upload_service.add_processing_log(upload_id, "start", "started", "Image processing started")
+
+    logger.info(f"Starting processing for upload: {upload_id}")
+
+    pending = [
+        variant for variant in VARIANTS
+        if getattr(upload, VARIANT_CHECKPOINTS[variant]) is None
+    ]
+    done = [variant for variant in VARIANTS if variant not in pending]
+    if done:
+        upload_service.add_processing_log(
+            upload_id, "resume", "skipped",
+            f"Variants already stored: {', '.join(done)}"
+        )
+    return upload, pending, None
+
+
+def complete_processing(db, upload, lease_id: str, start_time: float, timings: dict) -> dict:
+    """Mark the upload completed, release the lease and queue its webhook"""
+    upload_id = upload.id
+    upload_service = UploadService(db)
+
+    # Status, lease release and webhook outbox row commit together
+    completed = upload_service.update_upload_status(upload_id, UploadStatus.COMPLETED, commit=False)
+    upload_service.release_processing_lease(upload_id, lease_id, commit=False)
+    if completed:
+        WebhookService(db).enqueue(completed, commit=False)
+    db.commit()
+
+    total_duration = int((time.time() - start_time) * 1000)
+    upload_service.add_processing_log(
+        upload_id, "complete", "completed",
+        f"Image processing completed in {total_duration}ms", total_duration
+    )
+    upload_service.record_processing_summary(
+        upload, UploadStatus.COMPLETED, total_duration, timings
+    )
+
+    logger.info(f"Completed processing for upload: {upload_id}")
+
+    return {
+        "upload_id": upload_id,
+        "status": "completed",
+        "processing_time_ms": total_duration
+    }
+
+
+def fail_processing(
+    upload_id: str,
+    lease_id: str,
+    error: Exception,
+    final_attempt: bool,
+    start_time: float,
+    timings: dict
+) -> None:
+    """Release the lease and, unless the error will be retried, mark the upload failed"""
+    will_retry = not final_attempt and is_transient_storage_error(error)
+    if will_retry:
+        logger.warning(f"Transient error processing image {upload_id}, will retry: {str(error)}")
+    else:
+        logger.error(f"Failed to process image {upload_id}: {str(error)}")
+
+    try:
+        with db_session() as db:
+            upload_service = UploadService(db)
+            if will_retry:
+                upload_service.release_processing_lease(upload_id, lease_id)
+                upload_service.add_processing_log(upload_id, "retry", "failed", str(error))
+            else:
+                # Status, lease release and webhook outbox row commit together
+                upload = upload_service.update_upload_status(
+                    upload_id, UploadStatus.FAILED, str(error), commit=False
+                )
+                upload_service.release_processing_lease(upload_id, lease_id, commit=False)
+                if upload:
+                    WebhookService(db).enqueue(upload, commit=False)
+                db.commit()
+                upload_service.add_processing_log(upload_id, "error", "failed", str(error))
+                if upload:
+                    upload_service.record_processing_summary(
+                        upload, UploadStatus.FAILED,
+                        int((time.time() - start_time) * 1000), timings
+                    )
+    except Exception as db_error:
+        logger.error(f"Failed to update failed status: {str(db_error)}")
+
+
+def _process_variants(upload_service: UploadService, upload, pending: list, timings: dict) -> None:
+    """Download the original and produce, upload and checkpoint each pending variant"""
+    # 1. Download original from storage
+    with stage(upload_service, upload.id, "download",
+               "Downloading original image", "Original image downloaded", timings):
+        image_bytes = storage_service.download_file(upload.original_url)
+
+    # 2. Encode each missing variant, then upload and checkpoint them in order
+    artifacts = render_variants(upload_service, upload, image_bytes, pending, timings)
+    store_artifacts(upload_service, upload, artifacts, timings)
+
+
+def render_variants(
+    upload_service: UploadService,
+    upload,
+    image_bytes: bytes,
+    pending: list,
+    timings: dict
+) -> list:
+    """Decode the original and encode every pending variant (the CPU-bound part)
+
+    Returns artifacts in `pending` order: dicts with the variant name and
+    either its encoded `data` or, for the srcset ladder, a list of `rungs`.
+    Each variant is encoded exactly once, and those bytes are what gets
+    stored. Metadata derived on the way (perceptual hash, placeholder) is
+    saved straight away.
+    """
+    upload_id = upload.id
+    processor = ImageProcessor()
+
+    image = Image.open(io.BytesIO(image_bytes))
+    if processor.is_animated(image):
+        return _render_animated_variants(upload_service, upload, image, pending, timings)
+
+    resized_image: Optional[Image.Image] = None
+    if "resized" in pending or "compressed" in pending:
+        with stage(upload_service, upload_id, "resize", "Resizing image", "Image resized", timings):
+            resized_image = processor.resize_image(image, settings.RESIZED_SIZE)
+
+    artifacts = []
+    for variant in pending:
+        if variant == "srcset":
+            with stage(upload_service, upload_id, "srcset",
+                       "Building srcset ladder", "Srcset ladder built", timings):
+                rungs = [
+                    encoded_artifact(encode_image(rung, "JPEG", settings.JPEG_QUALITY))
+                    for rung in processor.build_srcset_ladder(image, settings.SRCSET_WIDTHS)
+                ]
+            artifacts.append({"variant": variant, "rungs": rungs})
+            continue
+        elif variant == "compressed":
+            # The resized image, encoded with the encoder's size optimizations
+            with stage(upload_service, upload_id, "compress",
+                       "Compressing image", "Image compressed", timings):
+                encoded = processor.compress_image(resized_image, quality=settings.JPEG_QUALITY)
+            artifacts.append(encoded_artifact(encoded, variant))
+            continue
+        elif variant == "resized":
+            step = "resize"
+            variant_image = resized_image
+        else:
+            # Thumbnail last: create_thumbnail resizes the source image in place
+            step = "thumbnail"
+            with stage(upload_service, upload_id, "thumbnail",
+                       "Creating thumbnail", "Thumbnail created", timings):
+                placeholder = processor.create_placeholder(
+                    image, settings.PLACEHOLDER_SIZE, settings.PLACEHOLDER_QUALITY
+                )
+                variant_image = processor.create_thumbnail(image, settings.THUMBNAIL_SIZE)
+                # Hash the thumbnail: already small, and stable across re-encodes
+                upload_service.update_image_metadata(
+                    upload_id,
+                    phash=to_signed(processor.perceptual_hash(variant_image)),
+                    placeholder=placeholder
+                )
+
+        started = time.perf_counter()
+        encoded = encode_image(variant_image, "JPEG", settings.JPEG_QUALITY)
+        timings[step] = timings.get(step, 0) + int((time.perf_counter() - started) * 1000)
+        artifacts.append(encoded_artifact(encoded, variant))
+
+    return artifacts
+
+
+def encoded_artifact(encoded: EncodedImage, variant: Optional[str] = None) -> dict:
+    """Artifact (or srcset rung, without a variant) for an encoded image"""
+    artifact = {
+        "data": encoded.data,
+        "content_type": encoded.content_type,
+        "extension": encoded.extension,
+        "width": encoded.width,
+        "height": encoded.height,
+    }
+    if variant:
+        artifact["variant"] = variant
+    return artifact
+
+
+def store_artifacts(
+    upload_service: UploadService,
+    upload,
+    artifacts: list,
+    timings: dict,
+    load: Callable[[dict], bytes] = lambda artifact: artifact["data"],
+    generation: Optional[str] = None,
+    stored: Optional[dict] = None
+) -> dict:
+    """Upload rendered variants and checkpoint each one (the I/O-bound part)
+
+    `load` returns the encoded bytes of an artifact or srcset rung, so
+    callers can keep them somewhere other than in memory. Returns the
+    column values written, collected in `stored` as each object is
+    uploaded.
+
+    With a `generation`, objects are written under paths tagged with it and
+    nothing is checkpointed; regenerate_variants swaps the values in.
+    """
+    upload_id = upload.id
+    stored = {} if stored is None else stored
+    tag = f"-{generation}" if generation else ""
+    for artifact in artifacts:
+        variant = artifact["variant"]
+        if variant == "srcset":
+            if artifact.get("skipped"):
+                # Every rung would re-encode every frame; clients use the resized variant
+                stored["srcset"] = []
+                if not generation:
+                    upload_service.update_image_metadata(upload_id, srcset=[])
+                upload_service.add_processing_log(
+                    upload_id, "srcset", "skipped", "No srcset ladder for animated images"
+                )
+                continue
+            with stage(upload_service, upload_id, "upload",
+                       "Uploading srcset images", "Uploaded srcset images", timings):
+                srcset = stored["srcset"] = []
+                for rung in artifact["rungs"]:
+                    url = storage_service.upload_file(
+                        load(rung),
+                        upload_id,
+                        upload.original_filename,
+                        suffix=f"w{rung['width']}{tag}",
+                        content_type=rung["content_type"],
+                        extension=rung["extension"]
+                    )
+                    srcset.append({"width": rung["width"], "height": rung["height"], "url": url})
+
+                # Checkpoint: the ladder is stored as a whole; a retry rebuilds it
+                if not generation:
+                    upload_service.update_image_metadata(upload_id, srcset=srcset)
+            continue
+
+        with stage(upload_service, upload_id, "upload",
+                   f"Uploading {variant} image", f"Uploaded {variant} image", timings):
+            url = stored[f"{variant}_url"] = storage_service.upload_file(
+                load(artifact),
                 upload_id,
-                thumbnail_url=thumbnail_url,
-                resized_url=resized_url,
-                compressed_url=compressed_url
+                upload.original_filename,
+                suffix=f"{variant}{tag}",
+                content_type=artifact["content_type"],
+                extension=artifact["extension"]
             )
-            
-            # 5. Update status to completed
-            upload_service.update_upload_status(upload_id, UploadStatus.COMPLETED)
-            
-            total_duration = int((time.time() - start_time) * 1000)
+
+            # Checkpoint: the variant is done once its URL is saved
+            if not generation:
+                upload_service.update_processed_urls(upload_id, **{f"{variant}_url": url})
+
+    return stored
+
+
+def regenerate_variants(upload_id: str, variants: list, generation: str, final_attempt: bool = True) -> dict:
+    """Render `variants` of a completed upload again without taking it offline
+
+    The upload stays completed and keeps serving its current variants while
+    the new ones are written under paths tagged with `generation`. Their
+    URLs are swapped in by one compare-and-set, and only then are the old
+    objects deleted. When anything fails the upload is left exactly as it
+    was, never marked failed, and the new objects are deleted unless the
+    error will be retried (the retry writes the same paths). A redelivery
+    after the swap finds the generation in place and is skipped.
+    """
+    start_time = time.time()
+    lease_id = str(uuid.uuid4())
+    timings: dict = {}
+    stored: dict = {}
+    # In process order: the thumbnail shrinks the source in place
+    variants = [variant for variant in VARIANTS if variant in variants]
+
+    with db_session() as db:
+        upload_service = UploadService(db)
+        upload = upload_service.get_upload(upload_id)
+        if not upload or upload.status != UploadStatus.COMPLETED or upload.deleted_at is not None:
+            logger.info(f"Upload {upload_id} is not a completed upload, not regenerating")
+            return {"upload_id": upload_id, "status": upload.status if upload else None, "skipped": True}
+
+        if all(_has_generation(upload, variant, generation) for variant in variants):
+            logger.info(f"Upload {upload_id} already has generation {generation}, skipping")
+            return {"upload_id": upload_id, "status": "completed", "skipped": True}
+
+        if not upload_service.acquire_processing_lease(
+            upload_id, lease_id, settings.PROCESSING_LEASE_SECONDS
+        ):
+            logger.warning(f"Upload {upload_id} is already being processed, skipping regeneration")
+            return {"upload_id": upload_id, "status": "in_progress", "skipped": True}
+
+        try:
             upload_service.add_processing_log(
-                upload_id, "complete", "completed",
-                f"Image processing completed in {total_duration}ms", total_duration
+                upload_id, "regenerate", "started", f"Regenerating {', '.join(variants)}"
             )
-            
-            logger.info(f"Completed processing for upload: {upload_id}")
-            
-            return {
-                "upload_id": upload_id,
-                "status": "completed",
-                "processing_time_ms": total_duration
-            }
-            
+            with stage(upload_service, upload_id, "download",
+                       "Downloading original image", "Original image downloaded", timings):
+                image_bytes = storage_service.download_file(upload.original_url)
+            artifacts = render_variants(upload_service, upload, image_bytes, variants, timings)
+            store_artifacts(upload_service, upload, artifacts, timings, generation=generation, stored=stored)
+            replaced = upload_service.swap_variant_urls(upload_id, lease_id, stored)
+        except Exception as e:
+            db.rollback()
+            _abandon_regeneration(upload_service, upload_id, lease_id, stored, e, final_attempt)
+            raise
+
+        if replaced is None:
+            # Deleted, or the lease expired and another delivery took over
+            upload_service.release_processing_lease(upload_id, lease_id)
+            storage_service.delete_files(variant_urls(stored.values()))
+            return {"upload_id": upload_id, "status": "completed", "skipped": True}
+
+        total_duration = int((time.time() - start_time) * 1000)
+        upload_service.add_processing_log(
+            upload_id, "regenerate", "completed",
+            f"Regenerated {', '.join(variants)} in {total_duration}ms", total_duration
+        )
+
+    try:
+        storage_service.delete_files(replaced)
     except Exception as e:
-        logger.error(f"Failed to process image {upload_id}: {str(e)}")
-        
-        # Update status to failed
-        try:
-            with db_session() as db:
-                upload_service = UploadService(db)
-                upload_service.update_upload_status(upload_id, UploadStatus.FAILED, str(e))
-                upload_service.add_processing_log(upload_id, "error", "failed", str(e))
-        except Exception as db_error:
-            logger.error(f"Failed to update failed status: {str(db_error)}")
-        
-        raise
\ No newline at end of file
+        # Unreferenced now, so nothing is served from them; only storage leaks
+        logger.warning(f"Failed to delete replaced variants of upload {upload_id}: {replaced}: {str(e)}")
+
+    logger.info(f"Regenerated {', '.join(variants)} for upload: {upload_id}")
+    return {"upload_id": upload_id, "status": "completed", "processing_time_ms": total_duration}
+
+
+def _has_generation(upload, variant: str, generation: str) -> bool:
+    """Whether the stored variant was written by the given generation"""
+    urls = variant_urls([getattr(upload, VARIANT_CHECKPOINTS[variant])])
+    return bool(urls) and all(f"-{generation}." in url for url in urls)
+
+
+def _abandon_regeneration(
+    upload_service: UploadService,
+    upload_id: str,
+    lease_id: str,
+    stored: dict,
+    error: Exception,
+    final_attempt: bool
+) -> None:
+    """Leave the upload as it was: release the lease and drop the new objects"""
+    will_retry = not final_attempt and is_transient_storage_error(error)
+    logger.error(f"Failed to regenerate variants of upload {upload_id}: {str(error)}")
+    try:
+        upload_service.release_processing_lease(upload_id, lease_id)
+        upload_service.add_processing_log(upload_id, "regenerate", "failed", str(error))
+        if not will_retry:
+            storage_service.delete_files(variant_urls(stored.values()))
+    except Exception as cleanup_error:
+        logger.error(f"Failed to clean up regeneration of upload {upload_id}: {str(cleanup_error)}")
+
+
+def _render_animated_variants(
+    upload_service: UploadService,
+    upload,
+    image: Image.Image,
+    pending: list,
+    timings: dict
+) -> list:
+    """Encode animated variants frame by frame, keeping the animation"""
+    upload_id = upload.id
+    processor = ImageProcessor()
+    processor.check_animation_budget(image)
+
+    output_format = "WEBP" if settings.ANIMATED_WEBP_TRANSCODE else image.format
+    resized_size = processor.fit_size(image.size, settings.RESIZED_SIZE)
+
+    if "thumbnail" in pending:
+        # Hash the thumbnail of the first frame, the same derived image a still is hashed on
+        image.seek(0)
+        first_thumbnail = processor.create_thumbnail(image.convert("RGBA"), settings.THUMBNAIL_SIZE)
+        upload_service.update_image_metadata(
+            upload_id,
+            phash=to_signed(processor.perceptual_hash(first_thumbnail)),
+            placeholder=processor.create_placeholder(
+                image, settings.PLACEHOLDER_SIZE, settings.PLACEHOLDER_QUALITY
+            )
+        )
+
+    artifacts = []
+    for variant in pending:
+        if variant == "srcset":
+            artifacts.append({"variant": variant, "skipped": True})
+            continue
+        if variant == "thumbnail":
+            step, quality = "thumbnail", settings.JPEG_QUALITY
+            transform = lambda frame: processor.create_thumbnail(frame, settings.THUMBNAIL_SIZE)
+        else:
+            step = "compress" if variant == "compressed" else "resize"
+            quality = settings.WEBP_QUALITY if variant == "compressed" else settings.JPEG_QUALITY
+            transform = lambda frame: frame.resize(resized_size, Image.LANCZOS)
+
+        with stage(upload_service, upload_id, step,
+                   f"Creating animated {variant} image", f"Animated {variant} image created", timings):
+            encoded = processor.encode_animation(image, transform, output_format, quality)
+        artifacts.append(encoded_artifact(encoded, variant))
+
+    return artifacts
+
+
+def cleanup_uploads() -> dict:
+    """Purge failed and abandoned pending uploads, including their stored files"""
+    with db_session() as db:
+        upload_service = UploadService(db)
+        purged = upload_service.cleanup_failed_uploads(
+            hours_old=settings.CLEANUP_FAILED_AFTER_HOURS,
+            pending_hours_old=settings.CLEANUP_PENDING_AFTER_HOURS,
+            chunk_size=settings.CLEANUP_CHUNK_SIZE,
+            time_budget_seconds=settings.CLEANUP_TIME_BUDGET_SECONDS,
+            storage=storage_service
+        )
+        webhooks_pruned = WebhookService(db).prune_delivered(settings.WEBHOOK_RETENTION_DAYS)
+
+    from api.v1.workers.pipeline import StageCache
+
+    stage_buffers_pruned = StageCache().prune(settings.PIPELINE_CACHE_MAX_AGE_SECONDS)
+    return {"purged": purged, "webhooks_pruned": webhooks_pruned, "stage_buffers_pruned": stage_buffers_pruned}
+
+
+def purge_deleted_uploads() -> dict:
+    """Remove tombstoned uploads and their stored files"""
+    with db_session() as db:
+        upload_service = UploadService(db)
+        purged = upload_service.purge_deleted_uploads(
+            chunk_size=settings.CLEANUP_CHUNK_SIZE,
+            time_budget_seconds=settings.CLEANUP_TIME_BUDGET_SECONDS,
+            storage=storage_service
+        )
+    return {"purged": purged}
+
+
+def expire_upload_sessions() -> dict:
+    """Remove expired resumable upload sessions and their stored chunks"""
+    deadline = time.monotonic() + settings.CLEANUP_TIME_BUDGET_SECONDS
+    expired = 0
+    with db_session() as db:
+        session_service = UploadSessionService(db)
+        while time.monotonic() < deadline:
+            removed = session_service.expire_sessions(settings.CLEANUP_CHUNK_SIZE, storage_service)
+            expired += removed
+            if removed < settings.CLEANUP_CHUNK_SIZE:
+                break
+    return {"expired": expired}
+
+
+def deliver_webhooks() -> dict:
+    """Deliver due webhook events, retrying failures with backoff"""
+    with db_session() as db:
+        return get_webhook_dispatcher().deliver_due(
+            db,
+            batch_size=settings.WEBHOOK_BATCH_SIZE,
+            max_attempts=settings.WEBHOOK_MAX_ATTEMPTS,
+            time_budget_seconds=settings.WEBHOOK_TIME_BUDGET_SECONDS
+        )
+
+
+def maintain_processing_logs() -> dict:
+    """Prepare upcoming log partitions and drop the expired ones"""
+    with db_session() as db:
+        return LogRetentionService(db).apply_retention(
+            retention_days=settings.PROCESSING_LOG_RETENTION_DAYS,
+            days_ahead=settings.PROCESSING_LOG_PARTITIONS_AHEAD_DAYS,
+            lock_timeout_seconds=settings.PROCESSING_LOG_DETACH_LOCK_TIMEOUT_SECONDS
+        )
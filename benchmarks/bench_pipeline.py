@@ -0,0 +1,93 @@
+"""Benchmark: single-task processing vs the staged io/cpu pipeline.
+
+Storage latency is simulated with sleeps, so no GCS or Celery is needed.
+"single" runs download, encode and upload in one process per core, like
+the prefork worker running process_image. "staged" runs the network waits
+on a thread pool and only the encoding on the process pool, like the io
+and cpu queues of PIPELINE_MODE=staged. CPU utilization is the CPU time
+spent encoding over the wall time available to the cores.
+
+Run from the repository root:
+
+    python benchmarks/bench_pipeline.py [images] [storage_latency_ms]
+"""
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from PIL import Image
+
+from api.v1.services.storage_service import encode_image
+from api.v1.workers.image_processor import ImageProcessor
+
+CORES = os.cpu_count() or 1
+IO_THREADS = 32
+
+
+def _original() -> bytes:
+    buffer = io.BytesIO()
+    Image.effect_noise((2400, 1800), 64).convert("RGB").save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def render(data: bytes) -> float:
+    """The transform stage: decode and encode every variant. Returns CPU seconds used."""
+    started = time.process_time()
+    image = Image.open(io.BytesIO(data))
+    resized = ImageProcessor.resize_image(image, (1200, 1200))
+    encode_image(resized, "JPEG", 85)
+    for rung in ImageProcessor.build_srcset_ladder(image, [1920, 1280, 960, 640, 320]):
+        encode_image(rung, "JPEG", 85)
+    encode_image(ImageProcessor.create_thumbnail(image, (150, 150)), "JPEG", 85)
+    return time.process_time() - started
+
+
+def single_task(data: bytes, latency: float) -> float:
+    time.sleep(latency)  # download
+    cpu = render(data)
+    time.sleep(latency * 8)  # one upload per variant
+    return cpu
+
+
+def run_single(data: bytes, images: int, latency: float):
+    with ProcessPoolExecutor(CORES) as pool:
+        list(pool.map(render, [data] * CORES))  # warm up
+        started = time.perf_counter()
+        cpu = sum(pool.map(single_task, [data] * images, [latency] * images))
+    return time.perf_counter() - started, cpu
+
+
+def run_staged(data: bytes, images: int, latency: float):
+    with ProcessPoolExecutor(CORES) as cpu_pool, ThreadPoolExecutor(IO_THREADS) as io_pool:
+        list(cpu_pool.map(render, [data] * CORES))  # warm up
+
+        def chain(_):
+            time.sleep(latency)
+            cpu = cpu_pool.submit(render, data).result()
+            time.sleep(latency * 8)
+            return cpu
+
+        started = time.perf_counter()
+        cpu = sum(io_pool.map(chain, range(images)))
+    return time.perf_counter() - started, cpu
+
+
+def main(images: int = 48, latency_ms: float = 40) -> None:
+    data = _original()
+    latency = latency_ms / 1000
+    print(f"{CORES} cores, {images} images, {latency_ms:.0f}ms per storage call")
+    for name, run in (("single", run_single), ("staged", run_staged)):
+        wall, cpu = run(data, images, latency)
+        print(f"{name:>8}: {images / wall:6.1f} images/s, CPU utilization {cpu / (wall * CORES):5.1%}")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 48,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 40
+    )
@@ -0,0 +1,54 @@
+"""Microbenchmark: success_response vs fast_success_response on the status payload.
+
+Run from the repository root:
+
+    python benchmarks/bench_responses.py
+"""
+import os
+import sys
+import timeit
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from api.utils.responses import fast_success_response, orjson, success_response
+from api.v1.schemas.upload import UploadStatusResponse
+
+NOW = datetime.now(timezone.utc)
+
+
+def _model() -> UploadStatusResponse:
+    return UploadStatusResponse(
+        upload_id="550e8400-e29b-41d4-a716-446655440000",
+        status="completed",
+        error_message=None,
+        processing_started_at=NOW,
+        processing_completed_at=NOW,
+        created_at=NOW,
+        updated_at=NOW,
+    )
+
+
+def current_path():
+    return success_response(200, "Status retrieved successfully", _model().model_dump()).body
+
+
+def fast_path():
+    return fast_success_response(200, "Status retrieved successfully", _model()).body
+
+
+def main(number: int = 20000) -> None:
+    import json
+    assert json.loads(current_path()) == json.loads(fast_path())
+
+    print(f"encoder: {'orjson' if orjson is not None else 'json (orjson not installed)'}")
+    results = {}
+    for name, fn in (("success_response", current_path), ("fast_success_response", fast_path)):
+        best = min(timeit.repeat(fn, number=number, repeat=5))
+        results[name] = best / number * 1e6
+        print(f"{name:>22}: {results[name]:.2f} us/response")
+    print(f"{'speedup':>22}: {results['success_response'] / results['fast_success_response']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
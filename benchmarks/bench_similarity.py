@@ -0,0 +1,36 @@
+"""Microbenchmark: near-duplicate queries against the multi-index hash.
+
+Run from the repository root:
+
+    python benchmarks/bench_similarity.py [number_of_hashes]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from api.v1.services.similarity_service import MultiIndexHash
+
+
+def main(size: int = 1_000_000, queries: int = 200) -> None:
+    rng = random.Random(1)
+    index = MultiIndexHash()
+
+    started = time.perf_counter()
+    for i in range(size):
+        index.add(str(i), rng.getrandbits(64))
+    print(f"{'build':>12}: {time.perf_counter() - started:.1f} s for {size} hashes")
+
+    targets = [rng.getrandbits(64) for _ in range(queries)]
+    for distance in (3, 7, 10):
+        started = time.perf_counter()
+        for target in targets:
+            index.query(target, distance)
+        elapsed = (time.perf_counter() - started) / queries * 1000
+        print(f"{f'distance {distance}':>12}: {elapsed:.3f} ms/query")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
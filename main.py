@@ -1,29 +1,40 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 from api.v1.routes.upload import router
 from api.utils.config import settings
 from api.utils.logger import logger
+from api.utils.metrics import render_all
 from api.db.database import engine
-from api.db.base_model import Base
+from api.db.migrations import check_schema_revision
+from api.v1.workers.dispatch import get_dispatcher, shutdown_dispatcher
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic
     logger.info("Starting up Upload Service...")
     try:
-        Base.metadata.create_all(bind=engine)
-        logger.info("Database initialized successfully")
+        # Schema changes are applied with `alembic upgrade head`; here we only
+        # confirm the database is at the revision this code expects.
+        if check_schema_revision(engine):
+            logger.info("Database schema is up to date")
+        else:
+            logger.error("Database schema is behind the code. Run `alembic upgrade head`.")
     except Exception as e:
-        logger.error(f"Failed to initialize database: {str(e)}")
+        logger.error(f"Failed to check database schema: {str(e)}")
         # We don't necessarily want to crash the whole app if DB fails to init, 
         # but in many cases it's better to know early.
     
+    # Start the task backend now so a local worker pool is ready before the first upload
+    get_dispatcher()
+    
     logger.info("Upload Service started successfully")
     yield
     # Shutdown logic
     logger.info("Shutting down Upload Service...")
+    shutdown_dispatcher(timeout=settings.SHUTDOWN_DRAIN_SECONDS)
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -42,3 +53,14 @@ if settings.BACKEND_CORS_ORIGINS:
 
 app.include_router(router, prefix=settings.API_V1_PREFIX)
 
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """This process's metrics and its local workers' in the Prometheus text format"""
+    return PlainTextResponse(render_all(), media_type="text/plain; version=0.0.4")
+
+if settings.STORAGE_TYPE == "local":
+    from api.v1.routes.local_storage import router as local_storage_router
+
+    app.include_router(local_storage_router, prefix=settings.API_V1_PREFIX)
+
@@ -9,6 +9,9 @@ ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
 
+# api.db.database refuses to import without a URL; tests never touch that engine
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
 from api.db.base_model import Base
 
 
@@ -29,3 +32,75 @@ def db_session(engine):
     finally:
         session.rollback()
         session.close()
+
+
+class FakeStorage:
+    """In-memory stand-in for StorageService"""
+
+    bucket_name = "test-bucket"
+
+    def __init__(self):
+        self.objects = {}
+        self.content_types = {}
+        self.fail_uploads = []  # exceptions raised by the next upload calls
+
+    def _url(self, upload_id, filename, suffix="", extension=None):
+        name, ext = filename.rsplit(".", 1)
+        if suffix:
+            name = f"{name}_{suffix}"
+        return f"memory://{upload_id}/{name}.{extension or ext}"
+
+    def upload_file(self, file_content, upload_id, original_filename, suffix="", content_type=None,
+                    extension=None):
+        if self.fail_uploads:
+            raise self.fail_uploads.pop(0)
+        url = self._url(upload_id, original_filename, suffix, extension)
+        self.objects[url] = bytes(file_content)
+        self.content_types[url] = content_type
+        return url
+
+    def upload_session_chunk(self, session_id, chunk_name, file_content):
+        if self.fail_uploads:
+            raise self.fail_uploads.pop(0)
+        url = f"memory://upload-sessions/{session_id}/{chunk_name}"
+        self.objects[url] = bytes(file_content)
+        return url
+
+    def compose_files(self, file_urls, upload_id, original_filename, content_type=None):
+        url = self._url(upload_id, original_filename)
+        self.objects[url] = b"".join(self.objects[source] for source in file_urls)
+        self.content_types[url] = content_type
+        return url
+
+    def download_file(self, file_url):
+        return self.objects[file_url]
+
+    def delete_file(self, file_url):
+        return self.objects.pop(file_url, None) is not None
+
+    def delete_files(self, file_urls):
+        return sum(self.delete_file(url) for url in file_urls)
+
+
+@pytest.fixture()
+def fake_storage():
+    return FakeStorage()
+
+
+@pytest.fixture()
+def worker_env(engine, fake_storage, monkeypatch):
+    """Point the worker pipeline at the test database and in-memory storage"""
+    from api.v1.workers import tasks
+
+    SessionLocal = sessionmaker(bind=engine)
+
+    def get_test_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    monkeypatch.setattr(tasks, "get_db", get_test_db)
+    monkeypatch.setattr(tasks, "storage_service", fake_storage)
+    return fake_storage
@@ -0,0 +1,102 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from api.utils.config import settings
+from api.v1.models.upload import UploadStatus
+from api.v1.schemas.upload import UploadCreate
+from api.v1.services.admission_service import AdmissionService
+from api.v1.services.upload_service import UploadService
+
+
+class _FakeRedis:
+    """Records script calls and replays canned results (or raises)"""
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.calls = []
+
+    def register_script(self, script):
+        async def run(keys, args):
+            self.calls.append((keys, args))
+            result = self.results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return run
+
+
+def test_rate_limit_returns_retry_after_when_out_of_tokens():
+    redis = _FakeRedis([[1, "0"], [0, "2.2"]])
+    service = AdmissionService(redis_client=redis)
+
+    assert asyncio.run(service.check_rate_limit("10.0.0.1")) is None
+    assert asyncio.run(service.check_rate_limit("10.0.0.1")) == 3
+    keys, args = redis.calls[0]
+    assert keys == ["ratelimit:upload:10.0.0.1"]
+    assert args == [settings.RATE_LIMIT_PER_MINUTE / 60, settings.RATE_LIMIT_BURST]
+
+
+def test_rate_limit_fails_open_and_backs_off_from_redis():
+    redis = _FakeRedis([ConnectionError("refused")])
+    service = AdmissionService(redis_client=redis)
+
+    assert asyncio.run(service.check_rate_limit("10.0.0.1")) is None
+    # Redis is not retried on every request while it is down
+    assert asyncio.run(service.check_rate_limit("10.0.0.1")) is None
+    assert len(redis.calls) == 1
+
+
+class _FakeDispatcher:
+    def __init__(self, depth):
+        self.depth = depth
+        self.calls = 0
+
+    def queue_depth(self):
+        self.calls += 1
+        return self.depth
+
+
+@pytest.fixture()
+def fake_dispatcher(monkeypatch):
+    from api.v1.workers import dispatch
+
+    dispatcher = _FakeDispatcher(depth=5)
+    monkeypatch.setattr(dispatch, "get_dispatcher", lambda: dispatcher)
+    return dispatcher
+
+
+def test_backlog_rejects_above_queue_depth_and_caches_measurement(db_session, fake_dispatcher, monkeypatch):
+    monkeypatch.setattr(settings, "BACKPRESSURE_MAX_QUEUE_DEPTH", 10)
+    monkeypatch.setattr(settings, "BACKPRESSURE_CHECK_INTERVAL_SECONDS", 60)
+    service = AdmissionService()
+
+    assert asyncio.run(service.check_backlog(db_session)) is None
+
+    fake_dispatcher.depth = 50
+    # Still within the measurement interval
+    assert asyncio.run(service.check_backlog(db_session)) is None
+    assert fake_dispatcher.calls == 1
+
+    service._backlog_checked_at = float("-inf")
+    assert asyncio.run(service.check_backlog(db_session)) == settings.BACKPRESSURE_RETRY_AFTER_SECONDS
+
+
+def test_backlog_rejects_above_in_flight(db_session, fake_dispatcher, monkeypatch):
+    monkeypatch.setattr(settings, "BACKPRESSURE_MAX_QUEUE_DEPTH", 0)
+    monkeypatch.setattr(settings, "BACKPRESSURE_MAX_IN_FLIGHT", 1)
+    svc = UploadService(db_session)
+    upload = svc.create_upload(UploadCreate(original_filename="busy.jpg"), original_url="http://example.com/busy.jpg")
+    assert svc.acquire_processing_lease(upload.id, "lease", ttl_seconds=300)
+    svc.update_upload_status(upload.id, UploadStatus.PROCESSING)
+
+    service = AdmissionService()
+    assert asyncio.run(service.check_backlog(db_session)) == settings.BACKPRESSURE_RETRY_AFTER_SECONDS
+    assert fake_dispatcher.calls == 0
+
+    # An expired lease means the worker is gone; it no longer counts
+    upload.processing_lease_expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+    db_session.commit()
+    service._backlog_checked_at = float("-inf")
+    assert asyncio.run(service.check_backlog(db_session)) is None
@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from api.v1.models.upload import ImageUpload, UploadStatus
+from api.v1.schemas.upload import UploadCreate
+from api.v1.services.upload_service import UploadService
+from api.v1.workers.backfill import Backfill, BackfillError, Checkpoint
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture()
+def uploads(db_session, worker_env):
+    """Four completed PNGs, one failed PNG and one completed JPEG, a day apart"""
+    svc = UploadService(db_session)
+    base = datetime(2026, 3, 1, tzinfo=timezone.utc)
+    created = []
+    for i, (status, mime_type) in enumerate([
+        (UploadStatus.COMPLETED, "image/png"),
+        (UploadStatus.COMPLETED, "image/png"),
+        (UploadStatus.FAILED, "image/png"),
+        (UploadStatus.COMPLETED, "image/jpeg"),
+        (UploadStatus.COMPLETED, "image/png"),
+        (UploadStatus.COMPLETED, "image/png"),
+    ]):
+        upload = svc.create_upload(
+            UploadCreate(original_filename=f"backfill{i}.png", mime_type=mime_type),
+            original_url=f"memory://backfill{i}/backfill{i}.png"
+        )
+        upload.status = status
+        upload.created_at = base + timedelta(days=i)
+        upload.thumbnail_url = f"memory://backfill{i}/thumb.jpg"
+        upload.resized_url = f"memory://backfill{i}/resized.jpg"
+        upload.srcset = [{"width": 320, "height": 240, "url": f"memory://backfill{i}/w320.jpg"}]
+        created.append(upload.id)
+    db_session.commit()
+    yield created
+    db_session.query(ImageUpload).filter(ImageUpload.id.in_(created)).delete()
+    db_session.commit()
+
+
+FILTERS = {"created_after": "2026-03-01", "created_before": "2026-04-01", "mime_type": "image/png"}
+
+
+def recorder(enqueued):
+    return lambda upload_id, variants, generation: enqueued.append(upload_id)
+
+
+def test_backfill_enqueues_matching_uploads_in_order(db_session, uploads):
+    calls = []
+    clock = FakeClock()
+    backfill = Backfill(FILTERS, lambda *args: calls.append(args), variants=["thumbnail"], rate=2, batch_size=2,
+                        report=lambda message: None, clock=clock, sleep=clock.sleep)
+
+    result = backfill.run()
+
+    assert [upload_id for upload_id, _, _ in calls] == [uploads[0], uploads[1], uploads[4], uploads[5]]
+    assert {(tuple(variants), generation) for _, variants, generation in calls} == \
+        {(("thumbnail",), calls[0][2])}
+    assert result["scanned"] == 4 and result["done"]
+    # Two per second: three waits of half a second after the first
+    assert clock.slept == [0.5, 0.5, 0.5]
+
+    # The uploads keep serving their variants until the regenerated ones are swapped in
+    db_session.expire_all()
+    upload = db_session.get(ImageUpload, uploads[0])
+    assert upload.status == UploadStatus.COMPLETED
+    assert upload.thumbnail_url == "memory://backfill0/thumb.jpg"
+
+
+def test_backfill_resumes_from_checkpoint(db_session, uploads, tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "backfill.json"))
+    enqueued, generations = [], set()
+
+    def enqueue(upload_id, variants, generation):
+        enqueued.append(upload_id)
+        generations.add(generation)
+
+    def backfill():
+        return Backfill(FILTERS, enqueue, batch_size=1, checkpoint=checkpoint, report=lambda message: None)
+
+    assert backfill().run(limit=3)["enqueued"] == 3
+    assert checkpoint.load()["position"][1] == uploads[4]
+
+    result = backfill().run()
+    assert result["enqueued"] == 1 and result["done"]
+    assert enqueued == [uploads[0], uploads[1], uploads[4], uploads[5]]
+    # A resumed run writes the same generation, so redeliveries are recognised
+    assert generations == {checkpoint.load()["generation"]}
+
+    with pytest.raises(BackfillError):
+        Backfill(dict(FILTERS, mime_type="image/jpeg"), recorder(enqueued), checkpoint=checkpoint).run()
+
+
+def test_interrupted_batch_is_enqueued_on_resume(db_session, uploads, tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "backfill.json"))
+    enqueued = []
+
+    def broken_broker(upload_id, variants, generation):
+        if enqueued:
+            raise ConnectionError("broker went away")
+        enqueued.append(upload_id)
+
+    with pytest.raises(ConnectionError):
+        Backfill(FILTERS, broken_broker, batch_size=2, checkpoint=checkpoint,
+                 report=lambda message: None).run()
+    assert checkpoint.load()["in_flight"] == [uploads[0], uploads[1]]
+
+    # The whole batch again: regenerate_variants skips what already has the generation
+    Backfill(FILTERS, recorder(enqueued), batch_size=2, checkpoint=checkpoint,
+             report=lambda message: None).run()
+    assert enqueued == [uploads[0], uploads[0], uploads[1], uploads[4], uploads[5]]
+
+
+def test_backfill_waits_for_the_queue_to_drain(db_session, uploads):
+    depths = iter([5, 5, 1, 0, 0, 0])
+    clock = FakeClock()
+    enqueued = []
+    backfill = Backfill(FILTERS, recorder(enqueued), batch_size=10, queue_depth=lambda: next(depths),
+                        max_queue_depth=2, dry_run=True, report=lambda message: None,
+                        clock=clock, sleep=clock.sleep)
+
+    result = backfill.run()
+
+    assert clock.slept == [1, 1]
+    assert result["scanned"] == 4
+    # A dry run enqueues nothing
+    assert enqueued == []
@@ -0,0 +1,106 @@
+import io
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from PIL import Image
+
+from api.v1.models.upload import ImageUpload, UploadStatus
+from api.v1.services.direct_upload_service import (
+    DirectUploadService, InvalidUploadTicketError, UploadObjectMissingError, detect_image_type
+)
+from api.v1.services.storage_service import LocalStorageService
+
+BASE_URL = "http://testserver/api/v1/storage"
+
+
+@pytest.fixture()
+def local_storage(tmp_path):
+    return LocalStorageService(root=str(tmp_path), base_url=BASE_URL)
+
+
+def _png_bytes():
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), (10, 20, 30)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _client_put(storage, upload_url, content_type, body):
+    """What the /storage PUT route does with a signed URL"""
+    parts = urlsplit(upload_url)
+    query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+    file_path = parts.path.split("/api/v1/storage/", 1)[1]
+    assert storage.verify_upload_signature(
+        file_path, content_type, int(query["max_bytes"]), int(query["expires"]), query["signature"]
+    )
+    with storage.open_for_write(file_path) as f:
+        f.write(body)
+
+
+def test_detect_image_type():
+    assert detect_image_type(_png_bytes()[:16]) == "image/png"
+    assert detect_image_type(b"\xff\xd8\xff\xe0" + bytes(12)) == "image/jpeg"
+    assert detect_image_type(b"GIF89a" + bytes(10)) == "image/gif"
+    assert detect_image_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert detect_image_type(b"<html>") is None
+
+
+def test_direct_upload_round_trip(db_session, local_storage):
+    service = DirectUploadService(db_session)
+    ticket = service.create_ticket("photo.png", "image/png", local_storage)
+
+    with pytest.raises(UploadObjectMissingError):
+        service.finalize(ticket["finalize_token"], local_storage)
+
+    body = _png_bytes()
+    _client_put(local_storage, ticket["upload_url"], "image/png", body)
+
+    upload, created = service.finalize(ticket["finalize_token"], local_storage)
+    assert created
+    assert upload.id == ticket["upload_id"]
+    assert upload.status == UploadStatus.PENDING
+    assert upload.file_size == len(body)
+    assert local_storage.download_file(upload.original_url) == body
+
+    again, created = service.finalize(ticket["finalize_token"], local_storage)
+    assert again.id == upload.id and not created
+
+    db_session.delete(upload)
+    db_session.commit()
+
+
+def test_signature_covers_path_and_content_type(local_storage):
+    url, _ = local_storage.generate_upload_url("uploads/a/photo.png", "image/png", 100, 60)
+    query = {key: values[0] for key, values in parse_qs(urlsplit(url).query).items()}
+    args = (100, int(query["expires"]), query["signature"])
+
+    assert local_storage.verify_upload_signature("uploads/a/photo.png", "image/png", *args)
+    assert not local_storage.verify_upload_signature("uploads/b/photo.png", "image/png", *args)
+    assert not local_storage.verify_upload_signature("uploads/a/photo.png", "text/html", *args)
+    assert not local_storage.verify_upload_signature("uploads/a/photo.png", "image/png", 10 ** 9, *args[1:])
+
+
+def test_finalize_rejects_wrong_content_and_tampered_token(db_session, local_storage):
+    service = DirectUploadService(db_session)
+    ticket = service.create_ticket("photo.jpg", "image/jpeg", local_storage)
+    _client_put(local_storage, ticket["upload_url"], "image/jpeg", b"<html>not an image</html>")
+
+    body, signature = ticket["finalize_token"].split(".")
+    with pytest.raises(InvalidUploadTicketError):
+        service.finalize(f"{body}.{signature[::-1]}", local_storage)
+
+    with pytest.raises(ValueError):
+        service.finalize(ticket["finalize_token"], local_storage)
+    # Rejected objects are removed, and no upload is recorded
+    with pytest.raises(UploadObjectMissingError):
+        service.finalize(ticket["finalize_token"], local_storage)
+    assert db_session.get(ImageUpload, ticket["upload_id"]) is None
+
+
+def test_local_storage_refuses_paths_outside_root(local_storage):
+    with pytest.raises(ValueError):
+        local_storage.resolve_path("../outside.txt")
+
+    url = local_storage.upload_session_chunk("session", "000000000000-a", b"ab")
+    second = local_storage.upload_session_chunk("session", "000000000002-b", b"cd")
+    composed = local_storage.compose_files([url, second], "upload", "photo.png", "image/png")
+    assert local_storage.download_file(composed) == b"abcd"
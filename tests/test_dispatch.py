@@ -0,0 +1,139 @@
+import time
+
+import pytest
+
+from api.utils.config import settings
+from api.utils.metrics import metrics, render_all
+from api.v1.workers.dispatch import DispatchQueueFullError, LocalDispatcher, LocalTaskError
+
+# Tasks run in child processes, so they record attempts in a file named by
+# the "upload id" instead of in memory.
+
+
+def _record_attempt(path: str, final_attempt: bool) -> int:
+    with open(path, "a") as f:
+        f.write(f"{final_attempt}\n")
+    with open(path) as f:
+        return len(f.readlines())
+
+
+def flaky_task(path: str, final_attempt: bool) -> dict:
+    if _record_attempt(path, final_attempt) < 3:
+        raise LocalTaskError("storage unavailable", transient=True)
+    return {"status": "completed"}
+
+
+def broken_task(path: str, final_attempt: bool) -> dict:
+    _record_attempt(path, final_attempt)
+    raise LocalTaskError("not an image", transient=False)
+
+
+def slow_task(path: str, final_attempt: bool) -> dict:
+    time.sleep(0.5)
+    _record_attempt(path, final_attempt)
+    return {"status": "completed"}
+
+
+def _attempts(path):
+    with open(path) as f:
+        return f.read().split()
+
+
+@pytest.fixture()
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(settings, "TASK_RETRY_BACKOFF_BASE", 0)
+
+
+def test_local_dispatcher_retries_transient_errors(tmp_path, no_backoff):
+    path = str(tmp_path / "flaky")
+    dispatcher = LocalDispatcher(max_workers=1, max_queue=4, max_retries=2, task=flaky_task, initializer=None)
+
+    dispatcher.submit_process_image(path)
+    # Wait for the retries before draining, so they run with their own backoff
+    deadline = time.monotonic() + 10
+    while dispatcher.outstanding and time.monotonic() < deadline:
+        time.sleep(0.05)
+    dispatcher.shutdown(timeout=10)
+
+    # Same semantics as the Celery task: only the last allowed attempt is final
+    assert _attempts(path) == ["False", "False", "True"]
+    assert dispatcher.outstanding == 0
+
+
+def test_local_dispatcher_does_not_retry_permanent_errors(tmp_path, no_backoff):
+    path = str(tmp_path / "broken")
+    dispatcher = LocalDispatcher(max_workers=1, max_queue=4, max_retries=2, task=broken_task, initializer=None)
+
+    dispatcher.submit_process_image(path)
+    dispatcher.shutdown(timeout=10)
+
+    assert _attempts(path) == ["False"]
+
+
+def test_local_dispatcher_bounds_queue_and_drains_on_shutdown(tmp_path):
+    dispatcher = LocalDispatcher(max_workers=1, max_queue=1, max_retries=0, task=slow_task, initializer=None)
+
+    dispatcher.submit_process_image(str(tmp_path / "first"))
+    with pytest.raises(DispatchQueueFullError):
+        dispatcher.submit_process_image(str(tmp_path / "second"))
+
+    dispatcher.shutdown(timeout=10)
+
+    assert _attempts(tmp_path / "first") == ["True"]
+    assert not (tmp_path / "second").exists()
+    with pytest.raises(RuntimeError):
+        dispatcher.submit_process_image(str(tmp_path / "third"))
+
+
+def bloated_task(path: str, final_attempt: bool) -> dict:
+    import os
+
+    with open(path, "a") as f:
+        f.write(f"{os.getpid()}\n")
+    time.sleep(0.2)
+    return {"status": "completed", "rss_bytes": 10 ** 12}
+
+
+def test_local_dispatcher_recycles_pool_over_rss_budget(tmp_path):
+    path = str(tmp_path / "bloated")
+    dispatcher = LocalDispatcher(
+        max_workers=1, max_queue=4, max_retries=0, task=bloated_task, initializer=None, max_rss_mb=100
+    )
+
+    dispatcher.submit_process_image(path)
+    deadline = time.monotonic() + 10
+    while dispatcher.outstanding and time.monotonic() < deadline:
+        time.sleep(0.05)
+    dispatcher.submit_process_image(path)
+    dispatcher.shutdown(timeout=10)
+
+    first, second = _attempts(path)
+    assert first != second
+    # The second report arrives while shutting down, when there is nothing to recycle
+    assert dispatcher.recycled == 1
+
+
+def metered_task(path: str, final_attempt: bool) -> dict:
+    outcome = "error" if _record_attempt(path, final_attempt) == 1 else "ok"
+    metrics.observe("storage_operation_seconds", 0.25, operation="upload", outcome=outcome)
+    if outcome == "error":
+        raise LocalTaskError("storage unavailable", transient=True)
+    return {"status": "completed"}
+
+
+def test_local_worker_metrics_are_served_by_the_api(tmp_path, no_backoff):
+    path = str(tmp_path / "metered")
+    metrics.observe("storage_operation_seconds", 1, operation="upload", outcome="ok")
+    dispatcher = LocalDispatcher(max_workers=1, max_queue=4, max_retries=1, task=metered_task, initializer=None)
+
+    dispatcher.submit_process_image(path)
+    deadline = time.monotonic() + 10
+    while dispatcher.outstanding and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    # The failed attempt counts too, and the child does not re-export the parent's values
+    text = render_all([dispatcher.metrics_dir])
+    assert 'storage_operation_seconds_count{operation="upload",outcome="error"} 1' in text
+    assert 'storage_operation_seconds_count{operation="upload",outcome="ok"} 2' in text
+    dispatcher.shutdown(timeout=10)
+    metrics.reset()
@@ -0,0 +1,227 @@
+import base64
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+import google_crc32c
+import pytest
+from google.api_core.exceptions import RetryError
+from google.resumable_media.common import DataCorruption
+
+from api.utils.config import settings
+from api.utils.metrics import metrics
+from api.v1.services.storage_service import StorageService, is_transient_storage_error
+
+BUCKET = "test-bucket"
+
+
+def _hashes(data):
+    crc32c = base64.b64encode(google_crc32c.value(data).to_bytes(4, "big")).decode()
+    md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+    return crc32c, md5
+
+
+class FakeGCSServer(ThreadingHTTPServer):
+    """The parts of the GCS JSON API the storage service uses, with fault injection"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeGCSHandler)
+        self.objects = {}
+        self.failures = []  # statuses returned to the next requests
+        self.delay = 0.0
+        self.corrupt_uploads = False
+        self.corrupt_downloads = False
+        self.connections = 0
+        self.requests = 0
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FakeGCSHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _resource(self, name):
+        data, content_type = self.server.objects[name]
+        crc32c, md5 = _hashes(data)
+        return {"bucket": BUCKET, "name": name, "size": str(len(data)), "contentType": content_type,
+                "crc32c": crc32c, "md5Hash": md5, "generation": "1"}
+
+    def _intercept(self):
+        """Read the body, then apply an injected delay or failure; True when handled"""
+        self.body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.requests += 1
+        time.sleep(self.server.delay)
+        if self.server.failures:
+            self._send(self.server.failures.pop(0), {"error": {"message": "injected"}})
+            return True
+        parts = urlsplit(self.path)
+        self.route, self.query = parts.path, parts.query
+        return False
+
+    def _object_name(self, prefix):
+        return unquote(self.route[len(prefix):])
+
+    def do_POST(self):
+        if self._intercept():
+            return
+        if self.route == f"/upload/storage/v1/b/{BUCKET}/o":
+            boundary = self.headers["Content-Type"].split("boundary=")[1].strip('"').encode()
+            metadata_part, media_part = self.body.split(b"--" + boundary)[1:3]
+            metadata = json.loads(metadata_part.split(b"\r\n\r\n", 1)[1])
+            media_headers, data = media_part.split(b"\r\n\r\n", 1)
+            data = data[:-2]
+            content_type = media_headers.decode().split("content-type: ", 1)[1].strip()
+            if self.server.corrupt_uploads:
+                data = data[:-1] + bytes([data[-1] ^ 1])
+            if "crc32c" in metadata and metadata["crc32c"] != _hashes(data)[0]:
+                return self._send(400, {"error": {"code": 400, "message": "Provided CRC32C does not match"}})
+            self.server.objects[metadata["name"]] = (data, content_type)
+            return self._send(200, self._resource(metadata["name"]))
+        if self.route.endswith("/compose"):
+            name = self._object_name(f"/storage/v1/b/{BUCKET}/o/")[:-len("/compose")]
+            request = json.loads(self.body)
+            data = b"".join(self.server.objects[source["name"]][0] for source in request["sourceObjects"])
+            self.server.objects[name] = (data, request.get("destination", {}).get("contentType"))
+            return self._send(200, self._resource(name))
+        self._send(404, {"error": {"code": 404, "message": "Not Found"}})
+
+    def do_GET(self):
+        if self._intercept():
+            return
+        if self.route.startswith(f"/download/storage/v1/b/{BUCKET}/o/"):
+            name = self._object_name(f"/download/storage/v1/b/{BUCKET}/o/")
+            if name not in self.server.objects:
+                return self._send(404, {"error": {"code": 404, "message": "Not Found"}})
+            data, content_type = self.server.objects[name]
+            crc32c, md5 = _hashes(data)
+            headers = {"x-goog-hash": f"crc32c={crc32c},md5={md5}", "x-goog-generation": "1"}
+            status = 200
+            if self.headers.get("Range"):
+                start, end = self.headers["Range"].split("=")[1].split("-")
+                start, end = int(start), min(int(end), len(data) - 1)
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+                data, status = data[start:end + 1], 206
+            elif self.server.corrupt_downloads:
+                data = data[:-1] + bytes([data[-1] ^ 1])
+            return self._send(status, data, content_type or "application/octet-stream", headers)
+        name = self._object_name(f"/storage/v1/b/{BUCKET}/o/")
+        if name not in self.server.objects:
+            return self._send(404, {"error": {"code": 404, "message": "Not Found"}})
+        self._send(200, self._resource(name))
+
+    def do_DELETE(self):
+        if self._intercept():
+            return
+        name = self._object_name(f"/storage/v1/b/{BUCKET}/o/")
+        if self.server.objects.pop(name, None) is None:
+            return self._send(404, {"error": {"code": 404, "message": "Not Found"}})
+        self._send(204)
+
+
+@pytest.fixture()
+def gcs_server():
+    server = FakeGCSServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def gcs(gcs_server, monkeypatch):
+    monkeypatch.setattr(settings, "GCS_API_ENDPOINT", gcs_server.endpoint)
+    monkeypatch.setattr(settings, "GCS_RETRY_INITIAL_DELAY_SECONDS", 0.01)
+    monkeypatch.setattr(settings, "GCS_RETRY_MAX_DELAY_SECONDS", 0.05)
+    monkeypatch.setattr(settings, "GCS_RETRY_DEADLINE_SECONDS", 2)
+    service = StorageService()
+    service.bucket_name = BUCKET
+    metrics.reset()
+    yield service
+    metrics.reset()
+
+
+def test_round_trip_over_one_pooled_connection(gcs, gcs_server):
+    url = gcs.upload_file(b"\xff\xd8first", "up1", "photo.jpg", suffix="resized", content_type="image/jpeg")
+    chunk = gcs.upload_session_chunk("session", "000000000000-a", b"-second")
+
+    assert gcs.download_file(url) == b"\xff\xd8first"
+    assert gcs.read_file_header(url, 2) == b"\xff\xd8"
+    assert gcs.get_file_info(url) == {"size": 7, "content_type": "image/jpeg"}
+    composed = gcs.compose_files([url, chunk], "up1", "photo.jpg", "image/jpeg")
+    assert gcs.download_file(composed) == b"\xff\xd8first-second"
+    assert gcs_server.connections == 1
+
+    # Concurrent deletes open more, up to the pool size
+    assert gcs.delete_files([url, chunk, composed]) == 3
+    assert gcs.get_file_info(url) is None
+    assert gcs_server.connections <= 3
+    snapshot = metrics.snapshot()
+    assert snapshot['storage_operation_seconds_count{operation="upload",outcome="ok"}'] == 2
+    assert snapshot['storage_operation_seconds_count{operation="download",outcome="ok"}'] == 2
+    assert snapshot['storage_operation_seconds_count{operation="delete",outcome="ok"}'] == 3
+
+
+def test_transient_errors_are_retried(gcs, gcs_server):
+    gcs_server.failures = [503, 429]
+    url = gcs.upload_file(b"data", "up2", "photo.jpg")
+
+    gcs_server.failures = [500, 502]
+    assert gcs.download_file(url) == b"data"
+
+    gcs_server.failures = [503]
+    assert gcs.get_file_info(url)["size"] == 4
+    assert gcs_server.requests == 8
+
+
+def test_checksum_mismatch_is_detected(gcs, gcs_server):
+    gcs_server.corrupt_uploads = True
+    with pytest.raises(Exception, match="CRC32C"):
+        gcs.upload_file(b"data", "up3", "photo.jpg")
+    assert not gcs_server.objects
+
+    gcs_server.corrupt_uploads = False
+    url = gcs.upload_file(b"data", "up3", "photo.jpg")
+    gcs_server.corrupt_downloads = True
+    with pytest.raises(DataCorruption):
+        gcs.download_file(url)
+    assert metrics.snapshot()['storage_operation_seconds_count{operation="download",outcome="error"}'] == 1
+
+
+def test_slow_response_is_cut_off_by_the_timeouts(gcs, gcs_server):
+    url = gcs.upload_file(b"data", "up4", "photo.jpg")
+    gcs.timeout = (1, 0.2)
+    gcs.retry = gcs.retry.with_timeout(0.5)
+    gcs_server.delay = 1
+
+    started = time.perf_counter()
+    with pytest.raises(RetryError):
+        gcs.get_file_info(url)
+    # Attempts time out after 0.2s and retrying stops at the deadline, well before the server answers
+    assert time.perf_counter() - started < 1.0
+    assert is_transient_storage_error(RetryError("gave up", None))
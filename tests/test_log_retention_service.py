@@ -0,0 +1,125 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from alembic import command
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from api.db.migrations import get_alembic_config
+from api.v1.models.upload import ProcessingLog
+from api.v1.schemas.upload import UploadCreate
+from api.v1.services.log_retention_service import LogRetentionService
+from api.v1.services.upload_service import UploadService
+
+
+def test_retention_deletes_old_logs_when_not_partitioned(db_session):
+    svc = UploadService(db_session)
+    upload = svc.create_upload(UploadCreate(original_filename="logs.jpg"), original_url="http://example.com/logs.jpg")
+    old = svc.add_processing_log(upload.id, step="download", status="completed")
+    old.created_at = datetime.now(timezone.utc) - timedelta(days=40)
+    recent = svc.add_processing_log(upload.id, step="resize", status="completed")
+    db_session.commit()
+    old_id, recent_id = old.id, recent.id
+
+    retention = LogRetentionService(db_session)
+    assert not retention.is_partitioned()
+
+    result = retention.apply_retention(retention_days=30, days_ahead=7)
+
+    assert result["deleted"] >= 1
+    remaining = {log.id for log in db_session.query(ProcessingLog).filter(ProcessingLog.upload_id == upload.id)}
+    assert old_id not in remaining
+    assert recent_id in remaining
+
+
+def test_partition_names_are_daily():
+    assert LogRetentionService.partition_name(datetime(2026, 3, 7).date()) == "processing_logs_p20260307"
+
+
+def test_a_failing_retention_step_does_not_stop_the_others(db_session, monkeypatch):
+    retention = LogRetentionService(db_session)
+    monkeypatch.setattr(retention, "is_partitioned", lambda: True)
+
+    def overlapping(days_ahead):
+        raise OperationalError("CREATE TABLE", {}, Exception("default partition would be violated"))
+
+    monkeypatch.setattr(retention, "ensure_partitions", overlapping)
+    monkeypatch.setattr(retention, "drop_expired_partitions", lambda *args: ["processing_logs_p20260101"])
+    monkeypatch.setattr(retention, "delete_expired_default_logs", lambda retention_days: 3)
+
+    assert retention.apply_retention(retention_days=30, days_ahead=7) == {
+        "created": [], "dropped": ["processing_logs_p20260101"], "deleted": 3
+    }
+
+
+# A throwaway Postgres database; the test drops and recreates its public schema
+POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+
+def _migrated_postgres():
+    engine = create_engine(POSTGRES_URL)
+    with engine.begin() as connection:
+        connection.execute(text("DROP SCHEMA public CASCADE"))
+        connection.execute(text("CREATE SCHEMA public"))
+    config = get_alembic_config()
+    config.attributes["configure_logger"] = False
+    with engine.begin() as connection:
+        config.attributes["connection"] = connection
+        command.upgrade(config, "head")
+        # Old days are otherwise covered by the (empty) legacy partition
+        connection.execute(text("DROP TABLE processing_logs_legacy"))
+    return engine
+
+
+def _insert_log(session, created_at):
+    session.execute(text(
+        "INSERT INTO image_uploads (id, original_filename, original_url, status, created_at, updated_at) "
+        "VALUES (:id, 'a.jpg', 'memory://a.jpg', 'completed', now(), now())"
+    ), {"id": str(created_at.timestamp())})
+    session.execute(text(
+        "INSERT INTO processing_logs (upload_id, step, status, created_at, updated_at) "
+        "VALUES (:id, 'download', 'completed', :at, :at)"
+    ), {"id": str(created_at.timestamp()), "at": created_at})
+    session.commit()
+
+
+@pytest.mark.skipif(not POSTGRES_URL, reason="TEST_POSTGRES_URL is not set")
+def test_default_partition_rows_expire_and_block_only_their_own_day():
+    engine = _migrated_postgres()
+    session = sessionmaker(bind=engine)()
+    now = datetime.now(timezone.utc)
+    # No partition for either day, so both land in DEFAULT
+    _insert_log(session, now - timedelta(days=40))
+    _insert_log(session, now + timedelta(days=10))
+    retention = LogRetentionService(session)
+
+    result = retention.apply_retention(retention_days=30, days_ahead=11)
+
+    assert result["deleted"] == 1
+    # The day with a row in DEFAULT cannot get a partition; the days around it do
+    assert retention.partition_name((now + timedelta(days=10)).date()) not in result["created"]
+    assert retention.partition_name((now + timedelta(days=11)).date()) in result["created"]
+    assert session.execute(text("SELECT count(*) FROM processing_logs_default")).scalar() == 1
+    session.close()
+
+
+@pytest.mark.skipif(not POSTGRES_URL, reason="TEST_POSTGRES_URL is not set")
+def test_expired_partition_is_skipped_while_the_parent_is_in_use():
+    engine = _migrated_postgres()
+    session = sessionmaker(bind=engine)()
+    retention = LogRetentionService(session)
+    old_day = (datetime.now(timezone.utc) - timedelta(days=40)).date()
+    expired = retention.ensure_partitions(0, today=old_day)
+
+    # A long-running reader holds a lock on the parent: the detach gives up instead of queueing
+    with engine.connect() as reader:
+        reader.execute(text("SELECT count(*) FROM processing_logs"))
+        assert retention.drop_expired_partitions(30, lock_timeout_seconds=0.2) == []
+        assert session.execute(text("SELECT to_regclass(:name)"), {"name": expired[0]}).scalar()
+        reader.rollback()
+
+    assert expired[0] in retention.drop_expired_partitions(30, lock_timeout_seconds=0.2)
+    assert session.execute(text("SELECT to_regclass(:name)"), {"name": expired[0]}).scalar() is None
+    session.close()
@@ -0,0 +1,56 @@
+import json
+import logging
+import sys
+import time
+
+from api.utils.logger import CallSiteRateLimitFilter, JsonFormatter
+
+
+def _record(msg, *args, level=logging.INFO, lineno=10, exc_info=None):
+    return logging.LogRecord("test", level, "/app/module.py", lineno, msg, args, exc_info)
+
+
+def test_json_formatter_escapes_quotes_and_newlines():
+    record = _record('Failed: "bad" value\nsecond line %s', "x'y")
+    record.correlation_id = "abc"
+
+    payload = json.loads(JsonFormatter().format(record))
+
+    assert payload["message"] == 'Failed: "bad" value\nsecond line x\'y'
+    assert payload["correlation_id"] == "abc"
+    assert payload["level"] == "INFO"
+
+
+def test_json_formatter_includes_exception():
+    try:
+        raise ValueError('boom "quoted"')
+    except ValueError:
+        record = _record("failed", level=logging.ERROR, exc_info=sys.exc_info())
+
+    payload = json.loads(JsonFormatter().format(record))
+    assert 'ValueError: boom "quoted"' in payload["exception"]
+
+
+def test_rate_limit_filter_limits_per_call_site():
+    log_filter = CallSiteRateLimitFilter(rate=0.001, burst=3)
+
+    passed = [log_filter.filter(_record("hot", lineno=1)) for _ in range(10)]
+    assert passed.count(True) == 3
+
+    # A different call site has its own budget
+    assert log_filter.filter(_record("other", lineno=2))
+
+    # Warnings are never sampled
+    assert all(log_filter.filter(_record("warn", level=logging.WARNING, lineno=1)) for _ in range(10))
+
+
+def test_rate_limit_filter_reports_suppressed_count():
+    log_filter = CallSiteRateLimitFilter(rate=1000, burst=1)
+    assert log_filter.filter(_record("hot"))
+    assert not log_filter.filter(_record("hot"))
+
+    # Tokens refill quickly at this rate
+    time.sleep(0.01)
+    record = _record("hot")
+    assert log_filter.filter(record)
+    assert record.suppressed == 1
@@ -0,0 +1,84 @@
+import json
+import os
+import urllib.request
+
+from api.utils.metrics import MetricsRegistry, read_snapshots, serve_snapshots
+from api.v1.workers.memory import TaskMemoryProfile, over_rss_budget
+
+_kept = []
+
+
+def test_profile_reports_retained_and_peak_memory():
+    with TaskMemoryProfile() as profile:
+        _kept.append(bytearray(64 * 1024 * 1024))
+        temporary = bytearray(32 * 1024 * 1024)
+        del temporary
+
+    stats = profile.as_dict()
+    assert stats["retained_bytes"] >= 48 * 1024 * 1024
+    assert stats["peak_rss_bytes"] >= stats["rss_after_bytes"]
+    assert stats["top_allocations"] == []
+    assert "retained" in profile.summary()
+    _kept.clear()
+
+
+def test_sampled_profile_lists_top_allocations():
+    with TaskMemoryProfile(trace_allocations=True, top_n=3) as profile:
+        _kept.append([str(i) * 10 for i in range(20000)])
+
+    assert 0 < len(profile.top_allocations) <= 3
+    assert "test_memory.py" in profile.top_allocations[0]
+    _kept.clear()
+
+
+def test_over_rss_budget():
+    assert not over_rss_budget(10 ** 12, 0)
+    assert over_rss_budget(101 * 1024 * 1024, 100)
+    assert not over_rss_budget(99 * 1024 * 1024, 100)
+
+
+def test_metrics_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    registry.increment("uploads_total", status="completed")
+    registry.increment("uploads_total", status="completed")
+    registry.set_gauge("worker_rss_bytes", 1024, pid=7)
+    registry.observe("task_peak_rss_bytes", 10)
+    registry.observe("task_peak_rss_bytes", 30)
+
+    text = registry.render_text()
+    assert 'uploads_total{status="completed"} 2' in text
+    assert 'worker_rss_bytes{pid="7"} 1024' in text
+    assert "task_peak_rss_bytes_count 2" in text
+    assert "task_peak_rss_bytes_max 30" in text
+    assert registry.snapshot()["task_peak_rss_bytes_sum"] == 40
+
+
+def test_worker_snapshots_are_merged(tmp_path):
+    worker = MetricsRegistry()
+    worker.increment("uploads_total", status="completed")
+    worker.observe("storage_operation_seconds", 0.5, operation="upload", outcome="ok")
+    worker.set_gauge("worker_rss_bytes", 2048, pid=os.getpid())
+    (tmp_path / f"{os.getpid()}.json").write_text(json.dumps(worker.dump()))
+    # An exited worker: its totals stay, its gauges go
+    worker.set_gauge("worker_rss_bytes", 4096, pid=2 ** 22 + 1)
+    (tmp_path / f"{2 ** 22 + 1}.json").write_text(json.dumps(worker.dump()))
+
+    merged = MetricsRegistry()
+    merged.observe("storage_operation_seconds", 2.0, operation="upload", outcome="ok")
+    read_snapshots(str(tmp_path), merged)
+
+    snapshot = merged.snapshot()
+    assert snapshot['uploads_total{status="completed"}'] == 2
+    assert snapshot['storage_operation_seconds_count{operation="upload",outcome="ok"}'] == 3
+    assert snapshot['storage_operation_seconds_max{operation="upload",outcome="ok"}'] == 2.0
+    assert snapshot[f'worker_rss_bytes{{pid="{os.getpid()}"}}'] == 2048
+    assert f'worker_rss_bytes{{pid="{2 ** 22 + 1}"}}' not in snapshot
+
+    server = serve_snapshots(str(tmp_path), 0, host="127.0.0.1")
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            text = response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert 'uploads_total{status="completed"} 2' in text
@@ -0,0 +1,98 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import create_engine, text
+
+from api.db.base_model import Base
+from api.db.migrations import check_schema_revision, get_alembic_config
+
+
+def _run(engine, fn, *args):
+    config = get_alembic_config()
+    config.attributes["configure_logger"] = False
+    with engine.connect() as connection:
+        config.attributes["connection"] = connection
+        fn(config, *args)
+        connection.commit()
+
+
+def test_migrations_match_models(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    assert not check_schema_revision(engine)
+
+    _run(engine, command.upgrade, "head")
+
+    assert check_schema_revision(engine)
+    with engine.connect() as connection:
+        diff = compare_metadata(MigrationContext.configure(connection), Base.metadata)
+    assert diff == []
+
+
+def test_migrations_downgrade_to_base(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'downgrade.db'}")
+    _run(engine, command.upgrade, "head")
+    _run(engine, command.downgrade, "base")
+
+    assert not check_schema_revision(engine)
+
+
+def test_database_created_before_migrations_is_adopted(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'create_all.db'}")
+    # The schema the API's old create_all startup left behind, with no alembic_version
+    _run(engine, command.upgrade, "0003")
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE alembic_version"))
+    assert not check_schema_revision(engine)
+
+    _run(engine, command.upgrade, "head")
+
+    assert check_schema_revision(engine)
+
+
+# A throwaway Postgres database; the test drops and recreates its public schema
+POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+
+@pytest.mark.skipif(not POSTGRES_URL, reason="TEST_POSTGRES_URL is not set")
+def test_partitioning_migration_keeps_existing_logs_on_postgres():
+    engine = create_engine(POSTGRES_URL)
+    with engine.begin() as connection:
+        connection.execute(text("DROP SCHEMA public CASCADE"))
+        connection.execute(text("CREATE SCHEMA public"))
+
+    _run(engine, command.upgrade, "0003")
+    yesterday = datetime.now(timezone.utc) - timedelta(days=1)
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO image_uploads (id, original_filename, original_url, status, created_at, updated_at) "
+            "VALUES ('pg-upload', 'a.jpg', 'memory://a.jpg', 'completed', :at, :at)"
+        ), {"at": yesterday})
+        connection.execute(text(
+            "INSERT INTO processing_logs (upload_id, step, status, created_at, updated_at) "
+            "VALUES ('pg-upload', 'download', 'completed', :at, :at)"
+        ), {"at": yesterday})
+
+    _run(engine, command.upgrade, "head")
+
+    with engine.begin() as connection:
+        partitions = set(connection.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'processing_logs'"
+        )).scalars())
+        assert {"processing_logs_legacy", "processing_logs_default"} <= partitions
+        assert connection.execute(text("SELECT count(*) FROM processing_logs")).scalar() == 1
+        # New rows get ids from the same sequence; past the legacy bound they land in daily partitions
+        connection.execute(text(
+            "INSERT INTO processing_logs (upload_id, step, status, created_at, updated_at) "
+            "VALUES ('pg-upload', 'upload', 'completed', now() + interval '3 days', now())"
+        ))
+        assert connection.execute(text("SELECT count(*) FROM processing_logs_legacy")).scalar() == 1
+        assert connection.execute(text(
+            "SELECT count(*) FROM pg_constraint WHERE conname = 'processing_logs_legacy_bound'"
+        )).scalar() == 0
+
+    _run(engine, command.downgrade, "base")
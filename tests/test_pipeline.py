@@ -0,0 +1,94 @@
+import io
+
+import pytest
+from google.api_core import exceptions as gcs_exceptions
+from PIL import Image
+
+from api.v1.models.upload import ImageUpload, UploadStatus
+from api.v1.schemas.upload import UploadCreate
+from api.v1.services.upload_service import UploadService
+from api.v1.workers import pipeline
+from api.v1.workers.pipeline import (
+    StageCache, fetch_stage, finalize_stage, store_stage, transform_stage
+)
+
+
+@pytest.fixture()
+def staged_env(worker_env, monkeypatch, tmp_path):
+    monkeypatch.setattr(pipeline, "storage_service", worker_env)
+    return worker_env, StageCache(str(tmp_path / "cache"))
+
+
+def _create_upload(db_session, storage):
+    buffer = io.BytesIO()
+    Image.new("RGB", (400, 300), (40, 120, 200)).save(buffer, format="JPEG")
+    original_url = storage.upload_file(buffer.getvalue(), "orig", "staged.jpg")
+    return UploadService(db_session).create_upload(
+        UploadCreate(original_filename="staged.jpg", mime_type="image/jpeg"),
+        original_url=original_url
+    )
+
+
+def test_stages_complete_upload_and_clear_cache(db_session, staged_env):
+    storage, cache = staged_env
+    upload = _create_upload(db_session, storage)
+
+    context = fetch_stage(upload.id, cache=cache)
+    assert context["pending"] == ["resized", "compressed", "srcset", "thumbnail"]
+    context = transform_stage(context, cache=cache)
+    # Only paths travel between stages, never the image bytes
+    assert all("data" not in artifact and "path" in artifact
+               for artifact in context["artifacts"] if artifact["variant"] != "srcset")
+    context = store_stage(context, cache=cache)
+    result = finalize_stage(context, cache=cache)
+
+    assert result["status"] == "completed"
+    db_session.expire_all()
+    stored = db_session.get(ImageUpload, upload.id)
+    assert stored.status == UploadStatus.COMPLETED
+    assert stored.thumbnail_url and stored.resized_url and stored.compressed_url and stored.srcset
+    assert stored.processing_lease_id is None
+    assert list(cache.root.iterdir()) == []
+
+
+def test_store_retry_skips_checkpointed_variants_and_survives_cache_loss(db_session, staged_env):
+    storage, cache = staged_env
+    upload = _create_upload(db_session, storage)
+    context = transform_stage(fetch_stage(upload.id, cache=cache), cache=cache)
+
+    original_upload_file = storage.upload_file
+    calls = []
+
+    def flaky_upload_file(*args, **kwargs):
+        calls.append(kwargs["suffix"])
+        if calls == ["resized", "compressed"]:
+            raise gcs_exceptions.ServiceUnavailable("try again")
+        return original_upload_file(*args, **kwargs)
+
+    storage.upload_file = flaky_upload_file
+    with pytest.raises(gcs_exceptions.ServiceUnavailable):
+        store_stage(context, final_attempt=False, cache=cache)
+    db_session.expire_all()
+    assert db_session.get(ImageUpload, upload.id).status == UploadStatus.PROCESSING
+
+    # The retry lands on a host without the buffers
+    cache.discard(context)
+    calls.clear()
+    finalize_stage(store_stage(context, final_attempt=False, cache=cache), cache=cache)
+
+    assert calls == ["compressed", "w320", "thumbnail"]
+    db_session.expire_all()
+    assert db_session.get(ImageUpload, upload.id).status == UploadStatus.COMPLETED
+
+
+def test_chain_stops_when_another_delivery_holds_the_upload(db_session, staged_env):
+    storage, cache = staged_env
+    upload = _create_upload(db_session, storage)
+    context = fetch_stage(upload.id, cache=cache)
+
+    # The lease expired and another delivery took over
+    UploadService(db_session).release_processing_lease(upload.id, context["lease_id"])
+    assert UploadService(db_session).acquire_processing_lease(upload.id, "other-worker", 300)
+
+    assert transform_stage(context, cache=cache) is None
+    assert store_stage(None, cache=cache) is None
@@ -0,0 +1,70 @@
+import json
+from datetime import datetime, timezone
+
+from api.utils import responses
+from api.utils.responses import (
+    cache_headers, fast_success_response, is_not_modified, make_etag, not_modified_response, success_response
+)
+from api.v1.schemas.upload import UploadStatusResponse
+
+
+def _status_model():
+    now = datetime(2026, 10, 19, 8, 30, 15, 123456, tzinfo=timezone.utc)
+    return UploadStatusResponse(
+        upload_id="abc",
+        status="processing",
+        error_message='quote "inside"',
+        processing_started_at=now,
+        created_at=now,
+        updated_at=now,
+    )
+
+
+def test_fast_response_matches_success_envelope():
+    model = _status_model()
+
+    expected = success_response(200, "ok", model.model_dump())
+    actual = fast_success_response(200, "ok", model)
+
+    assert actual.status_code == expected.status_code == 200
+    assert actual.media_type == "application/json"
+    assert json.loads(actual.body) == json.loads(expected.body)
+
+
+def test_fast_response_without_orjson(monkeypatch):
+    monkeypatch.setattr(responses, "orjson", None)
+    model = _status_model()
+
+    body = json.loads(fast_success_response(202, "accepted", model, headers={"X-Test": "1"}).body)
+    assert body["data"]["created_at"] == "2026-10-19T08:30:15.123456+00:00"
+    assert body["data"] == json.loads(success_response(202, "accepted", model.model_dump()).body)["data"]
+
+
+def test_fast_response_empty_data():
+    body = json.loads(fast_success_response(200, "ok").body)
+    assert body == {"status": "success", "status_code": 200, "message": "ok", "data": {}}
+
+
+def test_conditional_get_helpers():
+    updated_at = datetime(2026, 10, 19, 8, 30, 15, 123456, tzinfo=timezone.utc)
+    etag = make_etag("status", "abc", "completed", updated_at.isoformat())
+    headers = cache_headers(etag, updated_at, "no-cache")
+
+    assert headers["Last-Modified"] == "Mon, 19 Oct 2026 08:30:15 GMT"
+    assert etag != make_etag("status", "abc", "processing", updated_at.isoformat())
+
+    assert is_not_modified({"if-none-match": etag}, etag, updated_at)
+    assert is_not_modified({"if-none-match": f'"other", W/{etag}'}, etag, updated_at)
+    assert not is_not_modified({"if-none-match": '"other"'}, etag, updated_at)
+    assert is_not_modified({"if-modified-since": headers["Last-Modified"]}, etag, updated_at)
+    assert not is_not_modified({"if-modified-since": "Mon, 19 Oct 2026 08:30:14 GMT"}, etag, updated_at)
+    # If-None-Match wins over If-Modified-Since
+    assert not is_not_modified(
+        {"if-none-match": '"other"', "if-modified-since": headers["Last-Modified"]}, etag, updated_at
+    )
+    assert not is_not_modified({"if-modified-since": "garbage"}, etag, updated_at)
+
+    response = not_modified_response(headers)
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers["etag"] == etag
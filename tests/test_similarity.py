@@ -0,0 +1,96 @@
+import io
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from api.v1.schemas.upload import UploadCreate
+from api.v1.services.similarity_service import (
+    MultiIndexHash, SimilarityService, from_signed, to_signed
+)
+from api.v1.services.upload_service import UploadService
+from api.v1.workers.image_processor import ImageProcessor
+
+
+def _scene(seed=1, size=(320, 240)):
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, (250, 250, 250))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x, y, x + rng.randrange(20, 120), y + rng.randrange(20, 120)), fill=color)
+    return image
+
+
+def _reencode(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return Image.open(io.BytesIO(buffer.getvalue()))
+
+
+def test_perceptual_hash_tolerates_reencode_and_resize():
+    original = _scene()
+    base = ImageProcessor.perceptual_hash(original)
+
+    assert (ImageProcessor.perceptual_hash(_reencode(original, 30)) ^ base).bit_count() <= 4
+    assert (ImageProcessor.perceptual_hash(original.resize((160, 120))) ^ base).bit_count() <= 4
+    assert (ImageProcessor.perceptual_hash(_scene(seed=2)) ^ base).bit_count() > 10
+
+
+def test_signed_round_trip():
+    for value in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+        signed = to_signed(value)
+        assert -(1 << 63) <= signed < 1 << 63
+        assert from_signed(signed) == value
+
+
+def test_multi_index_matches_brute_force():
+    rng = random.Random(7)
+    index = MultiIndexHash()
+    hashes = {f"u{i}": rng.getrandbits(64) for i in range(500)}
+    target = rng.getrandbits(64)
+    # Plant neighbours at known distances
+    for distance in (0, 3, 7, 10):
+        bits = rng.sample(range(64), distance)
+        hashes[f"near{distance}"] = target ^ sum(1 << b for b in bits)
+    for key, value in hashes.items():
+        index.add(key, value)
+
+    expected = sorted(
+        (key, (value ^ target).bit_count())
+        for key, value in hashes.items() if (value ^ target).bit_count() <= 10
+    )
+    assert sorted(index.query(target, 10)) == expected
+    assert ("near10", 10) in expected
+
+    index.remove("near3")
+    assert "near3" not in {key for key, _ in index.query(target, 10)}
+    with pytest.raises(ValueError):
+        index.query(target, MultiIndexHash.MAX_DISTANCE + 1)
+
+
+def _upload_with_hash(db_session, value):
+    svc = UploadService(db_session)
+    upload = svc.create_upload(
+        UploadCreate(original_filename="a.jpg", mime_type="image/jpeg"), original_url="gs://b/a.jpg"
+    )
+    svc.update_image_metadata(upload.id, phash=to_signed(value))
+    db_session.refresh(upload)
+    return upload
+
+
+def test_find_similar_skips_deleted_uploads(db_session):
+    service = SimilarityService()
+    base = (1 << 63) | 0x0F0F
+    target = _upload_with_hash(db_session, base)
+    near = _upload_with_hash(db_session, base ^ 0b101)
+    gone = _upload_with_hash(db_session, base ^ 0b1)
+    _upload_with_hash(db_session, ~base & ((1 << 64) - 1))
+
+    results = service.find_similar(db_session, target, max_distance=4, limit=10)
+    assert [(upload.id, distance) for upload, distance in results] == [(gone.id, 1), (near.id, 2)]
+
+    UploadService(db_session).tombstone_upload(gone.id)
+    results = service.find_similar(db_session, target, max_distance=4, limit=10)
+    assert [upload.id for upload, _ in results] == [near.id]
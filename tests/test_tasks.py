@@ -0,0 +1,403 @@
+import base64
+import io
+
+import pytest
+from google.api_core import exceptions as gcs_exceptions
+from PIL import Image
+
+from api.v1.models.upload import ImageUpload, ProcessingSummary, UploadStatus
+from api.v1.models.webhook import WebhookDelivery
+from api.v1.schemas.upload import UploadCreate
+from api.v1.services.upload_service import UploadService
+from api.v1.workers.tasks import process_image, regenerate_variants
+
+
+def _create_upload(db_session, storage, size=(400, 300)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 40, 40)).save(buffer, format="JPEG")
+    original_url = storage.upload_file(buffer.getvalue(), "orig", "photo.jpg")
+
+    svc = UploadService(db_session)
+    return svc.create_upload(
+        UploadCreate(original_filename="photo.jpg", mime_type="image/jpeg"),
+        original_url=original_url
+    )
+
+
+def test_process_image_creates_all_variants(db_session, worker_env):
+    upload = _create_upload(db_session, worker_env)
+
+    result = process_image(upload.id)
+
+    assert result["status"] == "completed"
+    db_session.expire_all()
+    stored = db_session.get(ImageUpload, upload.id)
+    assert stored.status == UploadStatus.COMPLETED
+    assert stored.thumbnail_url and stored.resized_url and stored.compressed_url
+    assert stored.processing_lease_id is None
+    assert stored.phash is not None
+
+    # Placeholder keeps the 4:3 aspect ratio and stays small enough to inline
+    prefix = "data:image/webp;base64,"
+    assert stored.placeholder.startswith(prefix)
+    assert len(stored.placeholder) < 400
+    preview = Image.open(io.BytesIO(base64.b64decode(stored.placeholder[len(prefix):])))
+    assert preview.size == (16, 12)
+
+    summary = db_session.get(ProcessingSummary, upload.id)
+    assert summary.status == UploadStatus.COMPLETED
+    assert summary.total_duration_ms is not None
+    assert {"download", "resize", "compress", "srcset", "thumbnail", "upload"} <= set(summary.stage_durations)
+
+
+def test_completion_queues_webhook(db_session, worker_env):
+    upload = _create_upload(db_session, worker_env)
+    upload.callback_url = "https://client.example.com/hooks"
+    db_session.commit()
+
+    process_image(upload.id)
+
+    delivery = db_session.query(WebhookDelivery).filter(WebhookDelivery.upload_id == upload.id).one()
+    assert delivery.event == "upload.completed"
+    assert delivery.url == "https://client.example.com/hooks"
+    assert delivery.payload["thumbnail_url"] is not None
+    # Keep the shared database free of deliveries pointing at real hosts
+    db_session.delete(delivery)
+    db_session.commit()
+
+
+def test_completion_and_its_webhook_commit_together(db_session, worker_env, monkeypatch):
+    from api.v1.services.webhook_service import WebhookService
+
+    upload = _create_upload(db_session, worker_env)
+    upload.callback_url = "https://client.example.com/hooks"
+    db_session.commit()
+    enqueue = WebhookService.enqueue
+    calls = []
+
+    def enqueue_fails_once(self, upload, commit=True):
+        calls.append(upload.status)
+        if len(calls) == 1:
+            raise RuntimeError("outbox insert failed")
+        return enqueue(self, upload, commit)
+
+    monkeypatch.setattr(WebhookService, "enqueue", enqueue_fails_once)
+
+    with pytest.raises(RuntimeError):
+        process_image(upload.id)
+
+    # The completed status was rolled back with the failed insert, never stored without its event
+    db_session.expire_all()
+    assert calls == [UploadStatus.COMPLETED, UploadStatus.FAILED]
+    assert db_session.get(ImageUpload, upload.id).status == UploadStatus.FAILED
+    deliveries = db_session.query(WebhookDelivery).filter(WebhookDelivery.upload_id == upload.id).all()
+    assert [delivery.event for delivery in deliveries] == ["upload.failed"]
+    db_session.delete(deliveries[0])
+    db_session.commit()
+
+
+def test_srcset_ladder_is_stored_widest_first(db_session, worker_env):
+    upload = _create_upload(db_session, worker_env, size=(2000, 1000))
+
+    process_image(upload.id)
+
+    db_session.expire_all()
+    stored = db_session.get(ImageUpload, upload.id)
+    assert [(rung["width"], rung["height"]) for rung in stored.srcset] == [
+        (1920, 960), (1280, 640), (960, 480), (640, 320), (320, 160)
+    ]
+    for rung in stored.srcset:
+        assert Image.open(io.BytesIO(worker_env.objects[rung["url"]])).size == (rung["width"], rung["height"])
+
+
+def test_each_variant_is_encoded_once_and_stored_as_encoded(db_session, worker_env, monkeypatch):
+    buffer = io.BytesIO()
+    Image.new("RGBA", (400, 300), (200, 40, 40, 255)).save(buffer, format="PNG")
+    original_url = worker_env.upload_file(buffer.getvalue(), "png", "photo.png")
+    upload = UploadService(db_session).create_upload(
+        UploadCreate(original_filename="photo.png", mime_type="image/png"), original_url=original_url
+    )
+    saves, opens = [], []
+    original_save, original_open = Image.Image.save, Image.open
+    monkeypatch.setattr(Image.Image, "save", lambda self, fp, format=None, **params: (
+        saves.append(format), original_save(self, fp, format, **params))[1])
+    monkeypatch.setattr(Image, "open", lambda fp, *args: (opens.append(fp), original_open(fp, *args))[1])
+
+    process_image(upload.id)
+
+    # resized, compressed, one srcset rung, thumbnail, and the WebP placeholder
+    assert sorted(saves) == ["JPEG", "JPEG", "JPEG", "JPEG", "WEBP"]
+    # Only the original is decoded
+    assert len(opens) == 1
+    db_session.expire_all()
+    stored = db_session.get(ImageUpload, upload.id)
+    for url in (stored.resized_url, stored.compressed_url, stored.thumbnail_url, stored.srcset[0]["url"]):
+        assert url.endswith(".jpg")
+        assert worker_env.content_types[url] == "image/jpeg"
+    assert original_open(io.BytesIO(worker_env.objects[stored.compressed_url])).size == (1200, 900)
+
+
+def test_retry_resumes_only_missing_variants(db_session, worker_env):
+    upload = _create_upload(db_session, worker_env)
+    # First variant uploads, second hits a transient error
+    original_upload_file = worker_env.upload_file
+    calls = []
+
+    def flaky_upload_file(*args, **kwargs):
+        calls.append(kwargs.get("suffix") or args[3])
+        if calls == ["resized", "compressed"]:
+            raise gcs_exceptions.ServiceUnavailable("try again")
+        return original_upload_file(*args, **kwargs)
+
+    worker_env.upload_file = flaky_upload_file
+
+    with pytest.raises(gcs_exceptions.ServiceUnavailable):
+        process_image(upload.id, final_attempt=False)
+
+    db_session.expire_all()
+    stored = db_session.get(ImageUpload, upload.id)
+    assert stored.status == UploadStatus.PROCESSING
+    assert stored.resized_url is not None
+    assert stored.compressed_url is None
+    assert stored.processing_lease_id is None
+
+    calls.clear()
+    process_image(upload.id, final_attempt=False)
+
+    assert calls == ["compressed", "w320", "thumbnail"]
+    db_session.expire_all()
+    assert db_session.get(ImageUpload, upload.id).status == UploadStatus.COMPLETED
+
+
+def test_final_attempt_marks_failed(db_session, worker_env):
+    upload = _create_upload(db_session, worker_env)
+    worker_env.fail_uploads = [gcs_exceptions.ServiceUnavailable("down")]
+
+    with pytest.raises(gcs_exceptions.ServiceUnavailable):
+        process_image(upload.id, final_attempt=True)
+
+    db_session.expire_all()
+    assert db_session.get(ImageUpload, upload.id).status == UploadStatus.FAILED
+    assert db_session.get(ProcessingSummary, upload.id).status == UploadStatus.FAILED
+
+
+def test_duplicate_delivery_is_skipped(db_session, worker_env):
+    upload = _create_upload(db_session, worker_env)
+    assert UploadService(db_session).acquire_processing_lease(upload.id, "other-worker", 300)
+
+    result = process_image(upload.id)
+
+    assert result["skipped"] is True
+    db_session.expire_all()
+    assert db_session.get(ImageUpload, upload.id).status == UploadStatus.PENDING
+
+
+def test_regeneration_swaps_in_new_variants_then_deletes_the_old(db_session, worker_env):
+    upload = _create_upload(db_session, worker_env)
+    process_image(upload.id)
+    db_session.expire_all()
+    before = db_session.get(ImageUpload, upload.id)
+    old_thumbnail, old_rungs, resized = before.thumbnail_url, [r["url"] for r in before.srcset], before.resized_url
+
+    result = regenerate_variants(upload.id, ["thumbnail", "srcset"], "g1")
+
+    assert result["status"] == "completed"
+    db_session.expire_all()
+    after = db_session.get(ImageUpload, upload.id)
+    assert after.status == UploadStatus.COMPLETED
+    assert after.processing_lease_id is None
+    assert after.thumbnail_url != old_thumbnail and after.thumbnail_url in worker_env.objects
+    assert all("-g1." in rung["url"] and rung["url"] in worker_env.objects for rung in after.srcset)
+    assert old_thumbnail not in worker_env.objects
+    assert not any(url in worker_env.objects for url in old_rungs)
+    assert after.resized_url == resized and resized in worker_env.objects
+
+    # A redelivery of the same generation has nothing left to do
+    assert regenerate_variants(upload.id, ["thumbnail", "srcset"], "g1")["skipped"] is True
+
+
+def test_failed_regeneration_keeps_the_upload_serving(db_session, worker_env):
+    upload = _create_upload(db_session, worker_env)
+    process_image(upload.id)
+    db_session.expire_all()
+    before = db_session.get(ImageUpload, upload.id)
+    old_urls = (before.resized_url, before.thumbnail_url)
+    # The new resized variant uploads, the thumbnail hits an error
+    original_upload_file = worker_env.upload_file
+
+    def flaky_upload_file(*args, **kwargs):
+        if kwargs["suffix"].startswith("thumbnail"):
+            raise gcs_exceptions.ServiceUnavailable("down")
+        return original_upload_file(*args, **kwargs)
+
+    worker_env.upload_file = flaky_upload_file
+
+    with pytest.raises(gcs_exceptions.ServiceUnavailable):
+        regenerate_variants(upload.id, ["resized", "thumbnail"], "g1", final_attempt=True)
+
+    db_session.expire_all()
+    after = db_session.get(ImageUpload, upload.id)
+    assert after.status == UploadStatus.COMPLETED
+    assert after.processing_lease_id is None
+    assert (after.resized_url, after.thumbnail_url) == old_urls
+    assert all(url in worker_env.objects for url in old_urls)
+    assert not any("-g1." in url for url in worker_env.objects)
+
+
+def _create_animated_upload(db_session, storage, frames=12, size=(320, 240)):
+    images = [Image.new("RGB", size, (i * 20 % 256, 80, 160)) for i in range(frames)]
+    buffer = io.BytesIO()
+    images[0].save(buffer, format="GIF", save_all=True, append_images=images[1:], duration=80, loop=0)
+    original_url = storage.upload_file(buffer.getvalue(), "anim", "anim.gif")
+
+    return UploadService(db_session).create_upload(
+        UploadCreate(original_filename="anim.gif", mime_type="image/gif"),
+        original_url=original_url
+    )
+
+
+def test_animated_gif_keeps_animation(db_session, worker_env):
+    upload = _create_animated_upload(db_session, worker_env)
+
+    process_image(upload.id)
+
+    db_session.expire_all()
+    stored = db_session.get(ImageUpload, upload.id)
+    assert stored.status == UploadStatus.COMPLETED
+    for url in (stored.resized_url, stored.thumbnail_url, stored.compressed_url):
+        variant = Image.open(io.BytesIO(worker_env.objects[url]))
+        assert variant.format == "GIF"
+        assert variant.n_frames == 12
+        assert worker_env.content_types[url] == "image/gif"
+    assert stored.placeholder.startswith("data:image/webp;base64,")
+    assert stored.srcset == []
+
+
+def test_animated_and_still_uploads_are_hashed_alike(db_session, worker_env):
+    # Wide, with different content in the middle than at the sides: only a cropped hash matches
+    still = Image.new("RGB", (320, 160), (20, 20, 20))
+    still.paste(Image.linear_gradient("L").resize((160, 160)).convert("RGB"), (80, 0))
+    png, gif = io.BytesIO(), io.BytesIO()
+    still.save(png, format="PNG")
+    still.save(gif, format="GIF", save_all=True, append_images=[Image.new("RGB", (320, 160), "white")],
+               duration=80, loop=0)
+    svc = UploadService(db_session)
+    uploads = [
+        svc.create_upload(UploadCreate(original_filename=name, mime_type=mime_type),
+                          original_url=worker_env.upload_file(buffer.getvalue(), name, name))
+        for name, mime_type, buffer in (("still.png", "image/png", png), ("anim.gif", "image/gif", gif))
+    ]
+
+    for upload in uploads:
+        process_image(upload.id)
+
+    db_session.expire_all()
+    still_hash, animated_hash = (db_session.get(ImageUpload, upload.id).phash for upload in uploads)
+    assert bin((still_hash ^ animated_hash) & (2 ** 64 - 1)).count("1") <= 2
+
+
+def test_animated_webp_transcode(db_session, worker_env, monkeypatch):
+    from api.utils.config import settings
+    monkeypatch.setattr(settings, "ANIMATED_WEBP_TRANSCODE", True)
+    upload = _create_animated_upload(db_session, worker_env)
+
+    process_image(upload.id)
+
+    db_session.expire_all()
+    stored = db_session.get(ImageUpload, upload.id)
+    assert stored.resized_url.endswith(".webp")
+    variant = Image.open(io.BytesIO(worker_env.objects[stored.resized_url]))
+    assert variant.format == "WEBP"
+    assert variant.n_frames == 12
+
+
+@pytest.mark.parametrize("output_format", ["GIF", "WEBP"])
+def test_animation_keeps_per_frame_durations(output_format):
+    from api.v1.workers.image_processor import ImageProcessor
+
+    frames = [Image.new("RGB", (64, 48), (i * 40, 0, 0)) for i in range(5)]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format="GIF", save_all=True, append_images=frames[1:],
+                   duration=[50, 100, 150, 200, 250], loop=0)
+
+    encoded = ImageProcessor.encode_animation(
+        Image.open(buffer), lambda frame: frame.resize((32, 24)), output_format
+    )
+
+    output = Image.open(io.BytesIO(encoded.data))
+    assert (output.n_frames, output.size) == (5, (32, 24))
+    durations = []
+    for index in range(output.n_frames):
+        output.seek(index)
+        output.load()
+        durations.append(output.info["duration"])
+    assert durations == [50, 100, 150, 200, 250]
+
+
+def test_animation_enlarged_past_the_pixel_budget_is_refused(monkeypatch):
+    from api.utils.config import settings
+    from api.v1.workers.image_processor import ImageProcessor
+
+    monkeypatch.setattr(settings, "ANIMATION_MAX_TOTAL_PIXELS", 100_000)
+    frames = [Image.new("RGB", (32, 24), (i * 40, 0, 0)) for i in range(5)]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format="GIF", save_all=True, append_images=frames[1:], duration=100)
+    image = Image.open(buffer)
+    ImageProcessor.check_animation_budget(image)
+
+    # Small enough as uploaded, but every encoded frame would be 320x240
+    with pytest.raises(ValueError, match="Encoded animation"):
+        ImageProcessor.encode_animation(image, lambda frame: frame.resize((320, 240)), "WEBP")
+
+
+def test_animation_over_frame_budget_fails(db_session, worker_env, monkeypatch):
+    from api.utils.config import settings
+    monkeypatch.setattr(settings, "ANIMATION_MAX_FRAMES", 5)
+    upload = _create_animated_upload(db_session, worker_env)
+
+    with pytest.raises(ValueError, match="frames"):
+        process_image(upload.id)
+
+    db_session.expire_all()
+    assert db_session.get(ImageUpload, upload.id).status == UploadStatus.FAILED
+
+
+def test_memory_profile_is_logged(db_session, worker_env, monkeypatch):
+    from api.utils.config import settings
+    from api.v1.models.upload import ProcessingLog
+
+    monkeypatch.setattr(settings, "MEMORY_PROFILING", True)
+    monkeypatch.setattr(settings, "MEMORY_TRACEMALLOC_SAMPLE_RATE", 1.0)
+    upload = _create_upload(db_session, worker_env)
+
+    result = process_image(upload.id)
+
+    assert result["memory"]["peak_rss_bytes"] > 0
+    assert result["rss_bytes"] == result["memory"]["rss_after_bytes"]
+    log = db_session.query(ProcessingLog).filter(
+        ProcessingLog.upload_id == upload.id, ProcessingLog.step == "memory"
+    ).one()
+    assert "peak RSS" in log.message and "top allocations" in log.message
+
+
+def test_memory_profile_reaches_the_celery_worker_exporter(db_session, worker_env, monkeypatch, tmp_path):
+    from api.utils.config import settings
+    from api.utils.metrics import MetricsRegistry, read_snapshots, set_snapshot_dir
+    from api.v1.workers.celery_app import export_task_metrics
+
+    monkeypatch.setattr(settings, "MEMORY_PROFILING", True)
+    monkeypatch.setattr(settings, "MEMORY_TRACEMALLOC_SAMPLE_RATE", 0.0)
+    upload = _create_upload(db_session, worker_env)
+    # As in a pool process of a worker started with WORKER_METRICS_PORT
+    set_snapshot_dir(str(tmp_path))
+    try:
+        process_image(upload.id)
+        export_task_metrics()
+    finally:
+        set_snapshot_dir(None)
+
+    exported = MetricsRegistry()
+    read_snapshots(str(tmp_path), exported)
+    snapshot = exported.snapshot()
+    assert snapshot["task_peak_rss_bytes_count"] == 1
+    assert any(name.startswith("worker_rss_bytes{") for name in snapshot)
@@ -86,7 +86,193 @@ def test_cleanup_failed_uploads(db_session):
     old.status = UploadStatus.FAILED
     old.created_at = datetime.now(timezone.utc) - timedelta(hours=25)
     db_session.commit()
+    old_id = old.id
 
     cleaned = svc.cleanup_failed_uploads(hours_old=24)
     assert cleaned >= 1
-    assert svc.get_upload(old.id) is None
+    assert svc.get_upload(old_id) is None
+
+
+def test_processing_lease_is_exclusive(db_session):
+    svc = UploadService(db_session)
+    upload = svc.create_upload(UploadCreate(original_filename="lease.jpg"), original_url="http://example.com/l.jpg")
+
+    assert svc.acquire_processing_lease(upload.id, "a", ttl_seconds=300)
+    assert not svc.acquire_processing_lease(upload.id, "b", ttl_seconds=300)
+    # Re-entrant for the holder
+    assert svc.acquire_processing_lease(upload.id, "a", ttl_seconds=300)
+
+    assert not svc.release_processing_lease(upload.id, "b")
+    assert svc.release_processing_lease(upload.id, "a")
+    assert svc.acquire_processing_lease(upload.id, "b", ttl_seconds=300)
+
+
+def test_expired_processing_lease_can_be_taken_over(db_session):
+    svc = UploadService(db_session)
+    upload = svc.create_upload(UploadCreate(original_filename="lease2.jpg"), original_url="http://example.com/l2.jpg")
+
+    assert svc.acquire_processing_lease(upload.id, "a", ttl_seconds=-1)
+    assert svc.acquire_processing_lease(upload.id, "b", ttl_seconds=300)
+
+
+def test_cleanup_purges_abandoned_pending_and_storage_in_chunks(db_session, fake_storage):
+    svc = UploadService(db_session)
+    old = datetime.now(timezone.utc) - timedelta(hours=30)
+
+    stale = []
+    for i in range(5):
+        url = fake_storage.upload_file(b"data", f"stale{i}", "stale.jpg")
+        upload = svc.create_upload(UploadCreate(original_filename="stale.jpg"), original_url=url)
+        upload.created_at = upload.updated_at = old
+        if i % 2:
+            upload.status = UploadStatus.FAILED
+        rung_url = fake_storage.upload_file(b"rung", f"stale{i}", "stale.jpg", suffix="w320")
+        upload.srcset = [{"width": 320, "height": 240, "url": rung_url}]
+        stale.append(upload.id)
+    recent = svc.create_upload(UploadCreate(original_filename="new.jpg"), original_url="http://example.com/new.jpg")
+    db_session.commit()
+    svc.add_processing_log(stale[0], step="start", status="started")
+
+    cleaned = svc.cleanup_failed_uploads(hours_old=24, pending_hours_old=6, chunk_size=2, storage=fake_storage)
+
+    assert cleaned >= 5
+    assert all(svc.get_upload(upload_id) is None for upload_id in stale)
+    assert svc.get_upload(recent.id) is not None
+    assert not any(f"stale{i}" in url for url in fake_storage.objects for i in range(5))
+    assert db_session.query(ProcessingLog).filter(ProcessingLog.upload_id == stale[0]).count() == 0
+
+
+def test_variant_swap_needs_the_lease_and_returns_the_replaced_urls(db_session):
+    svc = UploadService(db_session)
+    upload = svc.create_upload(UploadCreate(original_filename="again.jpg"), original_url="http://example.com/a.jpg")
+    upload.status = UploadStatus.COMPLETED
+    upload.thumbnail_url = "http://cdn/thumb.jpg"
+    upload.srcset = [{"width": 320, "height": 240, "url": "http://cdn/w320.jpg"}]
+    db_session.commit()
+    new_values = {"thumbnail_url": "http://cdn/thumb-g1.jpg", "srcset": []}
+
+    assert svc.swap_variant_urls(upload.id, "lease", new_values) is None
+    assert svc.acquire_processing_lease(upload.id, "lease", 300)
+    assert svc.swap_variant_urls(upload.id, "lease", new_values) == ["http://cdn/thumb.jpg", "http://cdn/w320.jpg"]
+
+    db_session.expire_all()
+    swapped = svc.get_upload(upload.id)
+    assert swapped.status == UploadStatus.COMPLETED
+    assert swapped.thumbnail_url == "http://cdn/thumb-g1.jpg"
+    assert swapped.processing_lease_id is None
+    db_session.delete(swapped)
+    db_session.commit()
+
+
+def test_cleanup_stops_when_time_budget_is_spent(db_session):
+    svc = UploadService(db_session)
+    upload = svc.create_upload(UploadCreate(original_filename="budget.jpg"), original_url="http://example.com/b.jpg")
+    upload.status = UploadStatus.FAILED
+    upload.created_at = datetime.now(timezone.utc) - timedelta(hours=48)
+    db_session.commit()
+
+    assert svc.cleanup_failed_uploads(hours_old=24, time_budget_seconds=1e-9) == 0
+    assert svc.get_upload(upload.id) is not None
+
+
+def test_tombstoned_upload_is_hidden_and_purged(db_session, fake_storage):
+    svc = UploadService(db_session)
+    url = fake_storage.upload_file(b"data", "gone", "gone.jpg")
+    upload = svc.create_upload(UploadCreate(original_filename="gone.jpg"), original_url=url)
+    upload_id = upload.id
+
+    assert svc.tombstone_upload(upload_id)
+    assert not svc.tombstone_upload(upload_id)
+    assert svc.get_upload(upload_id) is None
+    # Files stay until the purger runs
+    assert url in fake_storage.objects
+
+    assert svc.purge_deleted_uploads(storage=fake_storage) >= 1
+    assert url not in fake_storage.objects
+    assert db_session.get(ImageUpload, upload_id) is None
+
+
+def test_purge_skips_uploads_with_live_processing_lease(db_session, fake_storage):
+    svc = UploadService(db_session)
+    upload = svc.create_upload(UploadCreate(original_filename="busy.jpg"), original_url="http://example.com/busy.jpg")
+    upload_id = upload.id
+    svc.acquire_processing_lease(upload_id, "worker", ttl_seconds=300)
+    svc.tombstone_upload(upload_id)
+
+    svc.purge_deleted_uploads(storage=fake_storage)
+    db_session.expire_all()
+    assert db_session.get(ImageUpload, upload_id) is not None
+
+    svc.release_processing_lease(upload_id, "worker")
+    svc.purge_deleted_uploads(storage=fake_storage)
+    db_session.expire_all()
+    assert db_session.get(ImageUpload, upload_id) is None
+
+
+def test_list_uploads_keyset_pagination(engine):
+    from sqlalchemy.orm import sessionmaker
+    from api.v1.services.upload_service import decode_cursor
+
+    # Own session; other tests leave rows behind in the shared database
+    db = sessionmaker(bind=engine)()
+    db.query(ProcessingLog).delete()
+    db.query(ImageUpload).delete()
+    db.commit()
+
+    svc = UploadService(db)
+    base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    ids = []
+    for i in range(7):
+        upload = svc.create_upload(UploadCreate(original_filename=f"{i}.jpg"), original_url=f"http://example.com/{i}.jpg")
+        # Two uploads share a timestamp to exercise the id tie-breaker
+        upload.created_at = base + timedelta(minutes=min(i, 5))
+        upload.status = UploadStatus.COMPLETED if i % 2 else UploadStatus.PENDING
+        ids.append(upload.id)
+    db.commit()
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = svc.list_uploads(limit=3, cursor=cursor)
+        seen.extend(upload.id for upload in page)
+        if cursor is None:
+            break
+    assert len(seen) == len(set(seen)) == 7
+
+    completed, _ = svc.list_uploads(status=UploadStatus.COMPLETED, limit=10)
+    assert {u.id for u in completed} == {ids[1], ids[3], ids[5]}
+
+    window, _ = svc.list_uploads(created_after=base + timedelta(minutes=1),
+                                 created_before=base + timedelta(minutes=3), limit=10)
+    assert {u.id for u in window} == {ids[1], ids[2]}
+
+    svc.tombstone_upload(ids[0])
+    remaining, _ = svc.list_uploads(limit=10)
+    assert ids[0] not in {u.id for u in remaining}
+
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+    db.close()
+
+
+def test_completed_upload_cannot_move_back(db_session):
+    svc = UploadService(db_session)
+    upload = svc.create_upload(UploadCreate(original_filename="cas.jpg"), original_url="http://example.com/cas.jpg")
+
+    # Cannot complete without processing first
+    assert svc.update_upload_status(upload.id, UploadStatus.COMPLETED) is None
+
+    svc.update_upload_status(upload.id, UploadStatus.PROCESSING)
+    started_at = svc.get_upload(upload.id).processing_started_at
+    # Resuming keeps the original start time
+    assert svc.update_upload_status(upload.id, UploadStatus.PROCESSING).processing_started_at == started_at
+
+    assert svc.update_upload_status(upload.id, UploadStatus.COMPLETED) is not None
+    assert svc.update_upload_status(upload.id, UploadStatus.PROCESSING) is None
+    assert svc.update_upload_status(upload.id, UploadStatus.FAILED, "late failure") is None
+
+    refreshed = svc.get_upload(upload.id)
+    assert refreshed.status == UploadStatus.COMPLETED
+    assert refreshed.error_message is None
+
+    with pytest.raises(ValueError):
+        svc.update_upload_status(upload.id, "bogus")
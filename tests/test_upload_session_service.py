@@ -0,0 +1,183 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import update
+
+from api.utils.config import settings
+from api.v1.models.upload import ImageUpload, UploadSession, UploadSessionStatus, UploadStatus
+from api.v1.services.upload_service import UploadService
+from api.v1.services.upload_session_service import (
+    UploadOffsetMismatchError, UploadSessionService, UploadSessionStateError
+)
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_CHUNK_MIN_BYTES", 5)
+
+
+def _new_session(db_session, total_size=10):
+    return UploadSessionService(db_session).create_session("photo.jpg", "image/jpeg", total_size)
+
+
+def test_append_chunks_in_order(db_session, fake_storage):
+    service = UploadSessionService(db_session)
+    session = _new_session(db_session)
+
+    service.append_chunk(session, 0, b"hello", fake_storage)
+    service.append_chunk(session, 5, b"world", fake_storage)
+
+    assert session.received_bytes == 10
+    assert [fake_storage.objects[url] for url in session.chunk_urls] == [b"hello", b"world"]
+
+
+def test_resent_chunk_reports_current_offset(db_session, fake_storage):
+    service = UploadSessionService(db_session)
+    session = _new_session(db_session)
+    service.append_chunk(session, 0, b"hello", fake_storage)
+
+    with pytest.raises(UploadOffsetMismatchError) as excinfo:
+        service.append_chunk(session, 0, b"hello", fake_storage)
+    assert excinfo.value.current_offset == 5
+
+    with pytest.raises(ValueError):
+        service.append_chunk(session, 5, b"too long for it", fake_storage)
+    assert len(fake_storage.objects) == 1
+
+
+def test_only_the_last_chunk_may_be_small(db_session, fake_storage):
+    service = UploadSessionService(db_session)
+    session = _new_session(db_session, total_size=13)
+
+    with pytest.raises(ValueError, match="too small"):
+        service.append_chunk(session, 0, b"tiny", fake_storage)
+    assert fake_storage.objects == {}
+
+    service.append_chunk(session, 0, b"hello", fake_storage)
+    service.append_chunk(session, 5, b"world", fake_storage)
+    service.append_chunk(session, 10, b"!!!", fake_storage)
+    assert session.received_bytes == 13
+
+
+def test_concurrent_append_loser_leaves_no_chunk(db_session, fake_storage):
+    service = UploadSessionService(db_session)
+    session = _new_session(db_session)
+    # Another request appends after this one read the session
+    db_session.execute(
+        update(UploadSession).where(UploadSession.id == session.id).values(received_bytes=5)
+    )
+    db_session.commit()
+
+    with pytest.raises(UploadOffsetMismatchError) as excinfo:
+        service.append_chunk(session, 0, b"hello", fake_storage)
+    assert excinfo.value.current_offset == 5
+    assert fake_storage.objects == {}
+
+
+def test_finalize_composes_original_and_creates_upload(db_session, fake_storage):
+    service = UploadSessionService(db_session)
+    session = _new_session(db_session)
+
+    with pytest.raises(UploadSessionStateError):
+        service.finalize(session, fake_storage)
+
+    service.append_chunk(session, 0, b"hello", fake_storage)
+    service.append_chunk(session, 5, b"world", fake_storage)
+    chunk_urls = list(session.chunk_urls)
+
+    upload, created = service.finalize(session, fake_storage)
+    assert created
+    assert upload.status == UploadStatus.PENDING
+    assert upload.file_size == 10
+    assert fake_storage.objects[upload.original_url] == b"helloworld"
+    assert not any(url in fake_storage.objects for url in chunk_urls)
+    assert session.status == UploadSessionStatus.FINALIZED
+    assert session.upload_id == upload.id
+
+    # A retried finalize returns the same upload
+    again, created = service.finalize(session, fake_storage)
+    assert again.id == upload.id and not created
+
+    with pytest.raises(UploadSessionStateError):
+        service.append_chunk(session, 10, b"x", fake_storage)
+
+    db_session.delete(upload)
+    db_session.commit()
+
+
+def test_failed_compose_leaves_session_resumable(db_session, fake_storage):
+    service = UploadSessionService(db_session)
+    session = _new_session(db_session, total_size=5)
+    service.append_chunk(session, 0, b"hello", fake_storage)
+    uploads_before = db_session.query(ImageUpload).count()
+
+    def broken_compose(*args, **kwargs):
+        raise ConnectionError("network down")
+
+    fake_storage.compose_files = broken_compose
+    with pytest.raises(ConnectionError):
+        service.finalize(session, fake_storage)
+
+    db_session.refresh(session)
+    assert session.status == UploadSessionStatus.ACTIVE
+    assert db_session.query(ImageUpload).count() == uploads_before
+
+
+def test_stale_finalize_claim_is_taken_over(db_session, fake_storage, monkeypatch):
+    service = UploadSessionService(db_session)
+    session = _new_session(db_session, total_size=5)
+    service.append_chunk(session, 0, b"hello", fake_storage)
+    # The process finalizing the session dies right after creating the upload record
+    create_upload = UploadService.create_upload
+
+    def create_then_die(self, *args, **kwargs):
+        create_upload(self, *args, **kwargs)
+        raise SystemExit("worker killed")
+
+    monkeypatch.setattr(UploadService, "create_upload", create_then_die)
+    with pytest.raises(SystemExit):
+        service.finalize(session, fake_storage)
+    monkeypatch.setattr(UploadService, "create_upload", create_upload)
+    db_session.refresh(session)
+    assert session.status == UploadSessionStatus.FINALIZING
+
+    # A recent claim still belongs to the other call
+    with pytest.raises(UploadSessionStateError):
+        service.finalize(session, fake_storage)
+
+    db_session.execute(
+        update(UploadSession).where(UploadSession.id == session.id)
+        .values(finalize_claimed_at=datetime.now(timezone.utc) - timedelta(hours=1))
+    )
+    db_session.commit()
+    upload, created = service.finalize(session, fake_storage)
+
+    # Same upload id, so the same compose target and the record the dead call created
+    assert created and upload.id == session.upload_id
+    assert db_session.query(ImageUpload).filter(ImageUpload.original_url == upload.original_url).count() == 1
+    assert fake_storage.objects[upload.original_url] == b"hello"
+    assert session.status == UploadSessionStatus.FINALIZED
+    db_session.delete(upload)
+    db_session.commit()
+
+
+def test_expire_sessions_removes_chunks(db_session, fake_storage):
+    service = UploadSessionService(db_session)
+    stale = _new_session(db_session)
+    live = _new_session(db_session)
+    service.append_chunk(stale, 0, b"hello", fake_storage)
+    service.append_chunk(live, 0, b"world", fake_storage)
+    db_session.execute(
+        update(UploadSession)
+        .where(UploadSession.id == stale.id)
+        .values(expires_at=datetime.now(timezone.utc) - timedelta(minutes=1))
+    )
+    db_session.commit()
+    stale_id, live_id = stale.id, live.id
+
+    assert service.get_session(stale_id) is None
+    assert service.expire_sessions(chunk_size=100, storage=fake_storage) == 1
+
+    assert db_session.get(UploadSession, stale_id) is None
+    assert service.get_session(live_id) is not None
+    assert list(fake_storage.objects.values()) == [b"world"]
@@ -0,0 +1,49 @@
+from api.utils.config import settings
+from api.v1.services import storage_service as storage_module
+from api.v1.workers import warmup
+
+
+class _StubStorage:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.resets = 0
+
+    def reset_client(self):
+        self.resets += 1
+
+    @property
+    def bucket(self):
+        if self.fail:
+            raise RuntimeError("no credentials")
+        return object()
+
+
+def test_warm_up_reports_each_step(monkeypatch):
+    monkeypatch.setattr(storage_module, "storage_service", _StubStorage())
+
+    timings = warmup.warm_up_worker()
+
+    assert {"imports", "pillow_plugins", "database", "storage_client", "warmup_encode", "total"} <= set(timings)
+    assert all(ms >= 0 for ms in timings.values())
+
+
+def test_warm_up_survives_failing_steps(monkeypatch):
+    monkeypatch.setattr(storage_module, "storage_service", _StubStorage(fail=True))
+
+    timings = warmup.warm_up_worker()
+
+    assert "storage_client" in timings and "warmup_encode" in timings
+
+
+def test_init_worker_process_resets_inherited_clients(monkeypatch):
+    stub = _StubStorage()
+    monkeypatch.setattr(storage_module, "storage_service", stub)
+    monkeypatch.setattr(settings, "WORKER_WARMUP", False)
+    def fail_warm_up():
+        raise AssertionError("warm-up should be skipped")
+
+    monkeypatch.setattr(warmup, "warm_up_worker", fail_warm_up)
+
+    warmup.init_worker_process()
+
+    assert stub.resets == 1